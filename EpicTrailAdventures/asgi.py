@@ -2,6 +2,8 @@
 ASGI config for EpicTrailAdventures project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django and WebSockets to the consumers in myApp/routing.py, so
+one ASGI server (daphne, uvicorn) serves both from the same event loop.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,19 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'EpicTrailAdventures.settings')
 
-application = get_asgi_application()
+# Set up Django before anything imports models (the consumers do)
+django_asgi_app = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.security.websocket import AllowedHostsOriginValidator  # noqa: E402
+
+from myApp.routing import websocket_urlpatterns  # noqa: E402
+
+application = ProtocolTypeRouter({
+    "http": django_asgi_app,
+    # Browsers send Origin on WebSocket handshakes; only our own hosts may connect
+    "websocket": AllowedHostsOriginValidator(
+        AuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+    ),
+})
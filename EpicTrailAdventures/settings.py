@@ -84,8 +84,17 @@ TEMPLATES = [
 WSGI_APPLICATION = 'EpicTrailAdventures.wsgi.application'
 
 ASGI_APPLICATION = "EpicTrailAdventures.asgi.application"
+# "sqlite" reaches sockets in every ASGI worker process on this host
+# (myApp/channel_layers.py); "memory" only those in the sending process.
+CHANNEL_LAYER = config('CHANNEL_LAYER', default='sqlite')
 CHANNEL_LAYERS = {
-    "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+    "default": {
+        "sqlite": {
+            "BACKEND": "myApp.channel_layers.SQLiteChannelLayer",
+            "CONFIG": {"path": BASE_DIR / "channels.sqlite3"},
+        },
+        "memory": {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+    }[CHANNEL_LAYER]
 }
 
 # Database
@@ -95,8 +104,25 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock when a transaction starts, so concurrent
+            # reservations queue up instead of failing on lock upgrade
+            'transaction_mode': 'IMMEDIATE',
+            # Seconds to wait for the lock before myApp.reservations retries
+            'timeout': 2,
+        },
     }
 }
+
+# Overbooking-safe reservations (myApp.reservations)
+RESERVATION_RETRY_ATTEMPTS = 5
+RESERVATION_RETRY_BACKOFF = 0.05  # seconds, doubled on every retry
+
+# Background jobs (myApp/jobs.py), run by `manage.py run_jobs`
+JOBS_EAGER = config('JOBS_EAGER', default=False, cast=bool)  # dev without a worker: run cheap jobs in-process after commit
+JOBS_WORKER_THREADS = 4
+JOBS_RETRY_BACKOFF = 10  # seconds before the first retry, doubled each time
+JOBS_FILES_DIR = BASE_DIR / 'jobfiles'  # reports and backups; not served publicly
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.mysql',
@@ -112,6 +138,19 @@ DATABASES = {
 # }
 
 
+# Caches
+# "shared" is visible to every worker process; myApp.stats keeps its counters there
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache",
+    },
+}
+STATS_SHARED_TTL = 300  # seconds before a cached counter is recomputed anyway
+STATS_LOCAL_TTL = 5  # seconds a worker trusts its in-process copy
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
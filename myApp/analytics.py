@@ -0,0 +1,86 @@
+"""
+Single-pass booking analytics.
+
+BookingSummary accumulates the analytics figures (bookings, guests and
+revenue, revenue per category, the distribution of party sizes and a
+month-by-month series) from booking rows fed to it one at a time.
+summarize_bookings() reads the stored totals of every booking exactly once,
+as plain tuples fetched `chunk_size` at a time, so memory grows with the
+number of distinct months and party sizes rather than with the number of
+bookings.
+
+The analytics page reads the daily rollup (rollups.py) instead; this is for
+work that walks every booking anyway, such as the PDF report.
+"""
+from collections import Counter
+from decimal import Decimal
+
+from django.db.models import DateField
+from django.db.models.functions import TruncMonth
+
+from .models import Booking
+from .rollups import BOOKING_CATEGORIES
+from .timeseries import Series, buckets
+
+CHUNK_SIZE = 2000  # rows fetched per query
+
+# Columns read per booking; BookingSummary.add() takes them in this order
+ROW_FIELDS = ('month', 'pax', 'total_amount', *BOOKING_CATEGORIES.values())
+
+
+class BookingSummary:
+    def __init__(self):
+        self.bookings = 0
+        self.guests = 0
+        self.revenue = Decimal('0')
+        self.category_revenue = dict.fromkeys(BOOKING_CATEGORIES, Decimal('0'))
+        self.pax_distribution = Counter()  # party size -> bookings
+        self.monthly = {}  # first day of month -> [bookings, guests, revenue]
+
+    def add(self, month, pax, total, *category_totals):
+        """Count one booking, given as the ROW_FIELDS values."""
+        self.bookings += 1
+        self.guests += pax
+        self.revenue += total
+        for category, amount in zip(self.category_revenue, category_totals):
+            self.category_revenue[category] += amount
+        self.pax_distribution[pax] += 1
+        if month is not None:
+            entry = self.monthly.get(month)
+            if entry is None:
+                entry = self.monthly[month] = [0, 0, Decimal('0')]
+            entry[0] += 1
+            entry[1] += pax
+            entry[2] += total
+
+    def series(self):
+        """The monthly figures as a zero-filled timeseries.Series from the first month to the last."""
+        labels = buckets(min(self.monthly), max(self.monthly), 'month') if self.monthly else []
+        result = Series('month', 'created_at', labels)
+        for index, month in enumerate(labels):
+            count, guests, revenue = self.monthly.get(month, (0, 0, 0))
+            result.bookings[index] = count
+            result.pax[index] = guests
+            result.revenue[index] = float(revenue)
+        return result
+
+
+def booking_rows(queryset=None, *extra_fields):
+    """
+    Tuples of `extra_fields` followed by the ROW_FIELDS for `queryset`
+    (default: every booking), with months in the current time zone.
+    """
+    queryset = Booking.objects.order_by() if queryset is None else queryset
+    return (
+        queryset.annotate(month=TruncMonth('created_at', output_field=DateField()))
+        .values_list(*extra_fields, *ROW_FIELDS)
+    )
+
+
+def summarize_bookings(queryset=None, chunk_size=CHUNK_SIZE):
+    """A BookingSummary of `queryset` (default: every booking), read in one pass."""
+    summary = BookingSummary()
+    queryset = Booking.objects.all() if queryset is None else queryset
+    for row in booking_rows(queryset.order_by()).iterator(chunk_size=chunk_size):
+        summary.add(*row)
+    return summary
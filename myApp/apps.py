@@ -5,7 +5,7 @@ class MyappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'myApp'
 
-
-# Connecting Signals
-def ready(self):
-    import myApp.signals
+    # Connecting Signals
+    def ready(self):
+        import myApp.signals
+        import myApp.tasks  # registers the background job tasks
@@ -0,0 +1,463 @@
+"""
+Database backups.
+
+dump() writes every model's rows as JSON lines in Django's "jsonl"
+serialization format, one object per line, so `loaddata` can read the result.
+Models are written one after another in dependency order, each read through
+.iterator() `chunk_size` rows at a time with its many-to-many ids prefetched
+per chunk. Memory use stays flat however large the tables grow, and the
+lines can be gzip- or zstd-compressed on the way to disk.
+
+A dump reads each model in turn, so it is not a point-in-time copy of the
+whole database. snapshot() makes one for SQLite with the online backup API:
+in WAL mode it copies everything in one step, which never blocks writers;
+otherwise it copies a few pages per step so a writer waits at most one step
+(SQLite starts the copy again if a write lands in between).
+
+dump_changes() is the incremental kind: only the rows the change log
+(changes.py) names after a checkpoint, plus the ids of those deleted since,
+so a nightly backup costs the day's changes rather than the whole database.
+A full dump starts with the latest change log entry, an ordinary object to
+`loaddata`, which records the checkpoint the first incremental one must
+start from.
+restore() replays a full dump followed by a chain of incremental ones,
+streaming the files and inserting each model's rows in bulk.
+"""
+import gzip
+import io
+import itertools
+import json
+import os
+import shutil
+import sqlite3
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.core import serializers
+from django.core.management.color import no_style
+from django.core.serializers import jsonl
+from django.db import DEFAULT_DB_ALIAS, connection, router, transaction
+from django.db.models import Prefetch
+from django.db.models.constants import OnConflict
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+
+from . import changes, inventory, popularity, rollups, stats
+from .models import ChangeLog
+
+try:
+    import zstandard
+except ImportError:  # optional; only needed for zstd backups
+    zstandard = None
+
+CHANGE_LOG_LABEL = ChangeLog._meta.label_lower
+CHUNK_SIZE = 2000  # rows fetched per query and serialised per write
+GZIP_LEVEL = 6  # level 9 is much slower for a few percent smaller output
+SNAPSHOT_PAGES = 1024  # pages copied per step when writers have to be let in
+SNAPSHOT_PAUSE = 0.005  # seconds between those steps
+
+# Compression -> file name suffix
+COMPRESSIONS = {
+    'gzip': '.gz',
+    'zstd': '.zst',
+    'none': '',
+}
+# Backup kind -> (file name suffix, uncompressed content type)
+KINDS = {
+    'ndjson': ('.jsonl', 'application/x-ndjson'),
+    'sqlite': ('.sqlite3', 'application/vnd.sqlite3'),
+}
+COMPRESSED_CONTENT_TYPES = {
+    'gzip': 'application/gzip',
+    'zstd': 'application/zstd',
+}
+
+
+def check_options(kind, compression):
+    """Raise ValueError unless a `kind` backup compressed with `compression` can be made here."""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown backup kind {kind!r}; use one of {', '.join(KINDS)}.")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression!r}; use one of {', '.join(COMPRESSIONS)}.")
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError("zstd backups need the zstandard package; install it or use gzip.")
+    if kind == 'sqlite' and connection.vendor != 'sqlite':
+        raise ValueError("Binary snapshots are only available for SQLite databases.")
+
+
+def file_suffix(kind, compression):
+    return KINDS[kind][0] + COMPRESSIONS[compression]
+
+
+def content_type(kind, compression):
+    return COMPRESSED_CONTENT_TYPES.get(compression, KINDS[kind][1])
+
+
+def open_compressed(path, compression):
+    """`path` opened for binary writing through `compression`."""
+    if compression == 'gzip':
+        return gzip.open(path, 'wb', compresslevel=GZIP_LEVEL)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd=True)
+    return open(path, 'wb')
+
+
+class JSONLSerializer(jsonl.Serializer):
+    """
+    Django's JSON lines serializer, reading many-to-many ids straight from
+    the prefetch cache. The stock one builds (without running) a fallback
+    queryset for every object and field first, which costs more than the
+    rest of the serialization put together.
+    """
+
+    def handle_m2m_field(self, obj, field):
+        prefetched = getattr(obj, '_prefetched_objects_cache', {}).get(field.name)
+        if prefetched is None or not field.remote_field.through._meta.auto_created:
+            return super().handle_m2m_field(obj, field)
+        self._current[field.name] = [self._value_from_field(related, related._meta.pk) for related in prefetched]
+
+
+def backup_models():
+    """Concrete models to back up, each after the models its foreign keys point at."""
+    app_list = [(app_config, None) for app_config in apps.get_app_configs()]
+    return [
+        model for model in serializers.sort_dependencies(app_list, allow_cycles=True)
+        if not model._meta.proxy and model is not ChangeLog
+        and router.allow_migrate_model(DEFAULT_DB_ALIAS, model)
+    ]
+
+
+def model_rows(model, chunk_size=CHUNK_SIZE, pks=None):
+    """
+    Every row of `model` (or those in `pks`) in pk order, read `chunk_size`
+    at a time with many-to-many ids prefetched.
+    """
+    queryset = model._base_manager.order_by('pk')
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    many_to_many = [
+        Prefetch(field.name, queryset=field.related_model._base_manager.only('pk'))
+        for field in model._meta.many_to_many if field.remote_field.through._meta.auto_created
+    ]
+    return queryset.prefetch_related(*many_to_many).iterator(chunk_size=chunk_size)
+
+
+def dump(out, models=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Write `models` (default: backup_models(), after the latest change log
+    entry as the checkpoint) to the text file `out` as JSON lines. Returns
+    the number of objects written, not counting the checkpoint.
+    """
+    if models is None:
+        # Read before any rows: what changes during the dump is in the next incremental backup too
+        JSONLSerializer().serialize(ChangeLog.objects.order_by('-id')[:1], stream=out)
+        models = backup_models()
+    total = sum(model._base_manager.count() for model in models) if progress is not None else 0
+    done = 0
+    for model in models:
+        rows = model_rows(model, chunk_size)
+        while batch := list(itertools.islice(rows, chunk_size)):
+            JSONLSerializer().serialize(batch, stream=out)
+            done += len(batch)
+            if total:
+                progress(min(100, 100 * done // total))
+    return done
+
+
+def write_dump(path, compression='gzip', **options):
+    """dump() to the file `path`, compressed with `compression`. Returns the number of objects."""
+    with open_compressed(path, compression) as raw, io.TextIOWrapper(raw, encoding='utf-8') as out:
+        return dump(out, **options)
+
+
+def dump_changes(out, since, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Write the rows changed after checkpoint `since` to the text file `out`:
+    a {"checkpoint": {"since", "until"}} line, then {"model", "deleted": [pks]}
+    lines for rows that are gone, then the rest as they are now, in dump()'s
+    format. Returns (objects written or deleted, checkpoint `until`), where
+    the next incremental backup should start.
+    """
+    until = changes.checkpoint()
+    changed = changes.changed_since(since, until)
+    models = [model for model in backup_models() if model in changed]
+    total = sum(len(pks) for pks in changed.values())
+    done = 0
+    out.write(json.dumps({'checkpoint': {'since': since, 'until': until}}) + '\n')
+
+    present = {}
+    for model in models:
+        pks = sorted(changed[model])
+        present[model] = []
+        for start in range(0, len(pks), chunk_size):
+            batch = pks[start:start + chunk_size]
+            found = set(model._base_manager.filter(pk__in=batch).values_list('pk', flat=True))
+            present[model].extend(pk for pk in batch if pk in found)
+            gone = [pk for pk in batch if pk not in found]
+            if gone:
+                out.write(json.dumps({'model': model._meta.label_lower, 'deleted': gone}) + '\n')
+                done += len(gone)
+
+    for model in models:
+        pks = present[model]
+        for start in range(0, len(pks), chunk_size):
+            batch = list(model_rows(model, chunk_size, pks[start:start + chunk_size]))
+            JSONLSerializer().serialize(batch, stream=out)
+            done += len(batch)
+            if progress is not None and total:
+                progress(min(100, 100 * done // total))
+    return done, until
+
+
+def write_changes(path, since, compression='gzip', **options):
+    """dump_changes() to the file `path`, compressed with `compression`."""
+    with open_compressed(path, compression) as raw, io.TextIOWrapper(raw, encoding='utf-8') as out:
+        return dump_changes(out, since, **options)
+
+
+def open_backup(path):
+    """The backup at `path` opened for reading text, decompressed according to its suffix."""
+    if path.endswith(COMPRESSIONS['gzip']):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith(COMPRESSIONS['zstd']):
+        if zstandard is None:
+            raise ValueError("zstd backups need the zstandard package to read.")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def read_checkpoint(path):
+    """
+    {"since", "until"} for an incremental backup. A full one has "since"
+    None and ends at its change log entry, or at 0 if it has none (the log
+    was empty, or the dump predates the entry).
+    """
+    with open_backup(path) as lines:
+        first = json.loads(next(lines, '').strip() or '{}')
+    if 'checkpoint' in first:
+        return first['checkpoint']
+    return {'since': None, 'until': first['pk'] if first.get('model') == CHANGE_LOG_LABEL else 0}
+
+
+def check_chain(paths):
+    """
+    Raise ValueError unless `paths` is at most one full backup followed by
+    incremental ones, each starting no later than the one before it ended.
+    Checkpoints are change log ids, which only works because ids are handed
+    out in commit order (see changes.py).
+    """
+    previous = None
+    for index, path in enumerate(paths):
+        checkpoint = read_checkpoint(path)
+        if checkpoint['since'] is None and index:
+            raise ValueError(f"{path} is a full backup; only the first backup restored can be full.")
+        if previous is not None and checkpoint['since'] > previous:
+            raise ValueError(
+                f"{path} starts after checkpoint {checkpoint['since']}, but the backup before it ends at "
+                f"{previous}; the changes in between are missing."
+            )
+        previous = checkpoint['until']
+
+
+def backup_tables(models):
+    """The tables of `models` and of their many-to-many relations."""
+    tables = set()
+    for model in models:
+        tables.add(model._meta.db_table)
+        tables.update(field.remote_field.through._meta.db_table for field in model._meta.many_to_many)
+    return sorted(tables)
+
+
+# Model signals muted while a backup is loaded
+MODEL_SIGNALS = (post_init, pre_save, post_save, pre_delete, post_delete, m2m_changed)
+
+
+@contextmanager
+def signals_muted():
+    """
+    Disconnect every receiver of the model signals until the block ends, so
+    restored rows do not send notifications, reprice bookings or adjust the
+    derived tables one row at a time. Receivers are process-wide: nothing
+    else in the process should be writing meanwhile.
+    """
+    connected = {}
+    for signal in MODEL_SIGNALS:
+        with signal.lock:
+            connected[signal] = signal.receivers
+            signal.receivers = []
+            signal.sender_receivers_cache.clear()
+    try:
+        yield
+    finally:
+        for signal, receivers in connected.items():
+            with signal.lock:
+                signal.receivers = receivers
+                signal.sender_receivers_cache.clear()
+
+
+def insert(model, objects, replace=False):
+    """
+    INSERT `objects` in as few statements as the database allows,
+    overwriting rows with the same pk if `replace`. The inserts are raw,
+    like loaddata's saves, so auto_now fields keep their backed-up values.
+    """
+    fields = model._meta.local_concrete_fields
+    options = {}
+    if replace:
+        options = {
+            'on_conflict': OnConflict.UPDATE,
+            'update_fields': [field for field in fields if not field.primary_key],
+            'unique_fields': [model._meta.pk],
+        }
+    manager = model._base_manager
+    batch_size = max(1, connection.ops.bulk_batch_size(fields, objects))
+    for start in range(0, len(objects), batch_size):
+        manager._insert(objects[start:start + batch_size], fields=fields, raw=True, **options)
+
+
+def insert_relations(model, objects, replace=False):
+    """
+    Write the many-to-many rows of deserialized `objects` with one
+    bulk_create per relation, first deleting the old rows if `replace`.
+    """
+    for field in model._meta.many_to_many:
+        through = field.remote_field.through
+        if not through._meta.auto_created:
+            continue  # A through model of its own is backed up as one
+        owner, target = f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+        owners = [obj.object.pk for obj in objects if field.name in obj.m2m_data]
+        if replace:
+            through._base_manager.filter(**{f'{owner}__in': owners}).delete()
+        through._base_manager.bulk_create(
+            [
+                through(**{owner: obj.object.pk, target: pk})
+                for obj in objects for pk in obj.m2m_data.get(field.name, ())
+            ],
+            batch_size=CHUNK_SIZE,
+        )
+
+
+def batches(lines, chunk_size=CHUNK_SIZE):
+    """
+    The JSON lines of a backup as lists of up to `chunk_size` consecutive
+    objects of one model. Checkpoint and deletion lines come one per list.
+    """
+    batch = []
+    for line in lines:
+        if not line.strip():
+            continue
+        data = json.loads(line)
+        if 'fields' not in data:
+            if batch:
+                yield batch
+                batch = []
+            yield [data]
+            continue
+        if batch and (len(batch) == chunk_size or data['model'] != batch[0]['model']):
+            yield batch
+            batch = []
+        batch.append(data)
+    if batch:
+        yield batch
+
+
+def load(path, chunk_size=CHUNK_SIZE):
+    """
+    Apply one backup file, `chunk_size` objects at a time: delete what it
+    lists as deleted and insert the rest, overwriting rows that already
+    exist if it is incremental. Returns (saved, deleted).
+    """
+    saved = deleted = 0
+    replace = False
+    with open_backup(path) as lines:
+        for batch in batches(lines, chunk_size):
+            first = batch[0]
+            if 'checkpoint' in first:
+                replace = True
+            elif first['model'] == CHANGE_LOG_LABEL:
+                continue  # a full backup's checkpoint, not data
+            elif 'deleted' in first:
+                apps.get_model(first['model'])._base_manager.filter(pk__in=first['deleted']).delete()
+                deleted += len(first['deleted'])
+            else:
+                objects = list(serializers.deserialize('python', batch))
+                model = type(objects[0].object)
+                insert(model, [obj.object for obj in objects], replace)
+                insert_relations(model, objects, replace)
+                saved += len(objects)
+    return saved, deleted
+
+
+def restore(paths, chunk_size=CHUNK_SIZE):
+    """
+    Load a full backup and/or a chain of incremental ones, in order, in a
+    single transaction with signals muted, then rebuild the derived tables
+    (room inventory, revenue rollups, item popularity), which backups do not
+    track. Stored booking totals are restored as they were backed up; every
+    repricing is in the change log, so they stay in step with the catalog.
+    The change log restarts at the last backup's checkpoint, which the next
+    incremental backup continues from.
+
+    A full backup replaces everything in the tables it covers, including
+    the content types and permissions migrate creates. Returns (objects
+    saved, objects deleted); raises ValueError for a broken chain.
+    """
+    check_chain(paths)
+    until = read_checkpoint(paths[-1])['until']
+    saved = deleted = 0
+    models = backup_models()
+    tables = backup_tables(models)
+    with transaction.atomic(), signals_muted():
+        if read_checkpoint(paths[0])['since'] is None:
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sql_flush(no_style(), tables):
+                    cursor.execute(sql)
+        with connection.constraint_checks_disabled():
+            for path in paths:
+                counts = load(path, chunk_size)
+                saved += counts[0]
+                deleted += counts[1]
+        connection.check_constraints(table_names=tables)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+        inventory.rebuild()
+        rollups.rebuild()
+        popularity.rebuild()
+        changes.rebaseline(until)
+        stats.clear()
+    return saved, deleted
+
+
+def snapshot(path, compression='none', pages=SNAPSHOT_PAGES, pause=SNAPSHOT_PAUSE, progress=None):
+    """
+    Copy the SQLite database to `path` with the online backup API, then
+    compress it in place if asked. Returns the number of pages copied.
+    """
+    # A connection of its own, so the copy sees only committed data and leaves
+    # Django's connection (and any transaction open on it) alone
+    name = str(connection.settings_dict['NAME'])
+    timeout = connection.settings_dict['OPTIONS'].get('timeout', 5)
+    source = sqlite3.connect(name, uri=name.startswith('file:'), timeout=timeout)
+    wal = source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    copy_path = path if compression == 'none' else f"{path}.copy"
+    copied = {}
+
+    def step(status, remaining, total):
+        copied['pages'] = total
+        if progress is not None and total:
+            progress(100 * (total - remaining) // total)
+
+    target = sqlite3.connect(copy_path)
+    try:
+        with target:
+            source.backup(target, pages=-1 if wal else pages, progress=step, sleep=pause)
+    finally:
+        target.close()
+        source.close()
+
+    if compression != 'none':
+        with open(copy_path, 'rb') as raw, open_compressed(path, compression) as out:
+            shutil.copyfileobj(raw, out, 1024 * 1024)
+        os.remove(copy_path)
+    return copied.get('pages', 0)
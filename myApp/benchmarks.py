@@ -0,0 +1,713 @@
+"""
+Performance benchmarks, run with ``python manage.py benchmark <scenario>``.
+
+Each scenario runs against a throwaway test database seeded by the helpers
+below, so the development database is never touched.
+"""
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, reset_queries, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import URLPattern
+
+from .consumers import user_group
+from .models import (
+    Activity, Booking, DailyRevenueRollup, DirtyRollupDay, Food, FoodOrder, Notification, Package, Room,
+    RoomInventory, RoomType, Tour,
+)
+from . import reservations, rollups, stats
+
+SCENARIOS = {}
+
+# Caches are swapped for local memory so a benchmark never sees (or leaves
+# behind) values from the real shared cache.
+BENCHMARK_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-default'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-shared'},
+}
+
+
+def scenario(name):
+    """Register a benchmark function under `name`."""
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+@contextmanager
+def throwaway_database():
+    """Create a fresh test database for the duration of the block."""
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(CACHES=BENCHMARK_CACHES):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def clear_caches():
+    for alias in BENCHMARK_CACHES:
+        caches[alias].clear()
+    stats.clear_local()
+
+
+@contextmanager
+def timer():
+    """Yield a dict whose 'seconds' key is filled in when the block exits."""
+    result = {}
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result['seconds'] = time.perf_counter() - start
+
+
+def seed_catalog():
+    """Create a small catalog with one item of every kind; returns them in a dict."""
+    room_type = RoomType.objects.create(
+        name='Bench Double', capacity=2, price_per_night=Decimal('2500'), total_rooms=50
+    )
+    return {
+        'room_type': room_type,
+        'rooms': [Room.objects.create(name=f'Room {i}', room_type=room_type) for i in range(5)],
+        'activity': Activity.objects.create(name='Archery', description='', price_per_person=Decimal('500')),
+        'package': Package.objects.create(name='Combo', description='', price_per_person=Decimal('1500')),
+        'food': Food.objects.create(name='Lunch', price_per_person=Decimal('700')),
+        'tour': Tour.objects.create(name='Falls', description='', price_per_person=Decimal('1200')),
+    }
+
+
+def seed_bookings(catalog, count, user=None, start=date(2025, 1, 1)):
+    """Create `count` fully priced bookings spread over consecutive days."""
+    bookings = []
+    for i in range(count):
+        check_in = start + timedelta(days=i % 365)
+        booking = Booking.objects.create(
+            user=user, customer_name=f'Guest {i}', check_in=check_in,
+            check_out=check_in + timedelta(days=1 + i % 3), pax=1 + i % 4,
+        )
+        booking.rooms.set([catalog['rooms'][i % len(catalog['rooms'])]])
+        booking.activities.set([catalog['activity']])
+        booking.packages.set([catalog['package']])
+        booking.tours.set([catalog['tour']])
+        bookings.append(booking)
+    return bookings
+
+
+def simple_get_urls():
+    """Paths of every myApp URL pattern that takes no arguments and is safe to GET."""
+    from . import urls
+
+    skipped = {'logout', 'backup_data'}
+    paths = []
+    for pattern in urls.urlpatterns:
+        if not isinstance(pattern, URLPattern) or pattern.name in skipped:
+            continue
+        route = str(pattern.pattern)
+        if '<' in route or route.startswith('^'):
+            continue
+        paths.append('/' + route)
+    return paths
+
+
+# --- Context processors ---
+
+MYAPP_PROCESSORS = [
+    'myApp.context_processors.total_users',
+    'myApp.context_processors.total_bookings',
+    'myApp.context_processors.total_amount',
+    'myApp.context_processors.total_cost',
+]
+
+
+def eager_myapp_context(request):
+    """The four myApp processors with every value forced, as they used to run."""
+    from . import context_processors
+
+    context = {}
+    for name in ('total_users', 'total_bookings', 'total_amount', 'total_cost'):
+        for key, value in getattr(context_processors, name)(request).items():
+            context[key] = list(value) if key == 'user_bookings' else str(value)
+    return context
+
+
+def templates_with_processors(processors):
+    options = dict(settings.TEMPLATES[0]['OPTIONS'])
+    base = [p for p in options['context_processors'] if p not in MYAPP_PROCESSORS]
+    options['context_processors'] = base + processors
+    return [dict(settings.TEMPLATES[0], OPTIONS=options)]
+
+
+@scenario('context-processors')
+def bench_context_processors(out, size=200, **options):
+    """
+    Queries per request for every argument-free GET view, with the myApp
+    context processors removed, forced eagerly, and lazy (the real setup).
+    Caches are cleared before every request so cold-path work is counted.
+    """
+    catalog = seed_catalog()
+    admin = User.objects.create_superuser(username='bench-admin', password='bench-pass')
+    seed_bookings(catalog, size, user=admin)
+
+    variants = {
+        'none': templates_with_processors([]),
+        'eager': templates_with_processors(['myApp.benchmarks.eager_myapp_context']),
+        'lazy': settings.TEMPLATES,
+    }
+    client = Client()
+    client.force_login(admin)
+
+    out.write(f"{'view':<28}{'none':>8}{'eager':>8}{'lazy':>8}")
+    totals = dict.fromkeys(variants, 0)
+    for path in simple_get_urls():
+        counts = {}
+        for variant, templates in variants.items():
+            with override_settings(TEMPLATES=templates):
+                clear_caches()
+                # Seeding can fill the capped query log, which would count every request as 0
+                reset_queries()
+                with CaptureQueriesContext(connection) as queries:
+                    client.get(path)
+            counts[variant] = len(queries)
+            totals[variant] += len(queries)
+        out.write(f"{path:<28}{counts['none']:>8}{counts['eager']:>8}{counts['lazy']:>8}")
+    out.write(f"{'TOTAL':<28}{totals['none']:>8}{totals['eager']:>8}{totals['lazy']:>8}")
+
+
+# --- Reservations ---
+
+@scenario('reservations')
+def bench_reservations(out, size=400, threads=16, **options):
+    """
+    `threads` workers fire `size` reservations in total at one room type with
+    far less capacity than demand, then the ledger is checked for overbooking.
+    """
+    catalog = seed_catalog()
+    room_type = catalog['room_type']
+    room_ids = [room.pk for room in catalog['rooms']]
+    outcomes = Counter()
+    lock = threading.Lock()
+    per_thread = size // threads
+    start = threading.Barrier(threads)
+
+    def worker(index):
+        start.wait()
+        try:
+            for i in range(per_thread):
+                check_in = date(2025, 6, 1) + timedelta(days=(index + i) % 7)
+                try:
+                    reservations.create_booking(
+                        selections={'rooms': [room_ids[i % len(room_ids)]]},
+                        check_in=check_in, check_out=check_in + timedelta(days=2),
+                    )
+                    outcome = 'booked'
+                except reservations.RoomUnavailable:
+                    outcome = 'full'
+                except reservations.ReservationBusy:
+                    outcome = 'busy'
+                with lock:
+                    outcomes[outcome] += 1
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    with timer() as elapsed:
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+    attempts = sum(outcomes.values())
+    busiest = max(RoomInventory.objects.values_list('booked', flat=True), default=0)
+    out.write(f"attempts: {attempts} in {elapsed['seconds']:.2f}s ({attempts / elapsed['seconds']:.0f}/s)")
+    out.write(f"booked: {outcomes['booked']}  full: {outcomes['full']}  busy: {outcomes['busy']}")
+    out.write(f"capacity: {room_type.total_rooms}  busiest night: {busiest}")
+    out.write("OVERBOOKED" if busiest > room_type.total_rooms else "no overbooking")
+    # Rollup flushes that lost the race for the lock leave their days marked; one more catches up
+    left = DirtyRollupDay.objects.count()
+    rollups.flush()
+    stale = sorted((r.date, r.category, r.bookings, r.pax, r.revenue) for r in rollups.compute()) != sorted(
+        DailyRevenueRollup.objects.values_list('date', 'category', 'bookings', 'pax', 'revenue')
+    )
+    out.write(f"rollup days left dirty: {left}; after one more flush: {'STALE' if stale else 'up to date'}")
+
+
+# --- Notification fan-out ---
+
+def notify_staff_one_by_one(message, type):
+    """The fan-out as it used to be: a query for staff, then one INSERT per staff user."""
+    return [
+        Notification.objects.create(user=admin, message=message, type=type)
+        for admin in User.objects.filter(is_staff=True)
+    ]
+
+
+@scenario('notifications')
+def bench_notifications(out, size=500, bookings=20, **options):
+    """
+    Average time to create a booking as the number of staff users grows to
+    `size`: with the fan-out queued as a job (the real setup), run inline as
+    one bulk INSERT, and run inline with the old per-row loop swapped in.
+    """
+    from . import tasks
+
+    catalog = seed_catalog()
+    bulk = tasks.notify_staff
+    variants = {
+        'queued': (False, bulk),
+        'bulk': (True, bulk),
+        'per-row': (True, notify_staff_one_by_one),
+    }
+    out.write(f"{'staff':>8}" + ''.join(f"{name + ' ms':>12}" for name in variants))
+    staff = 0
+    for target in sorted({0, size // 10, size // 2, size}):
+        User.objects.bulk_create(
+            User(username=f'bench-staff-{i}', is_staff=True) for i in range(staff, target)
+        )
+        staff = target
+        timings = {}
+        for variant, (eager, fan_out) in variants.items():
+            tasks.notify_staff = fan_out
+            clear_caches()
+            try:
+                with override_settings(JOBS_EAGER=eager):
+                    seed_bookings(catalog, 1)  # warm the staff id cache
+                    with timer() as elapsed:
+                        seed_bookings(catalog, bookings)
+            finally:
+                tasks.notify_staff = bulk
+            timings[variant] = elapsed['seconds'] * 1000 / bookings
+        out.write(f"{target:>8}" + ''.join(f"{timings[name]:>12.2f}" for name in variants))
+
+
+# --- Channel layers ---
+
+def bench_layers(capacity):
+    """The two layers under test, each sized so the benchmark never fills a channel."""
+    from channels.layers import InMemoryChannelLayer
+    from .channel_layers import SQLiteChannelLayer
+
+    path = os.path.join(tempfile.mkdtemp(), 'channels.sqlite3')
+    return {
+        'memory': InMemoryChannelLayer(capacity=capacity),
+        'sqlite': SQLiteChannelLayer(path=path, capacity=capacity),
+    }
+
+
+async def point_to_point(layer, count):
+    channel = await layer.new_channel()
+    for i in range(count):
+        await layer.send(channel, {'type': 'bench', 'n': i})
+    for _ in range(count):
+        await layer.receive(channel)
+
+
+async def fan_out(layer, members, count):
+    channels = [await layer.new_channel() for _ in range(members)]
+    for channel in channels:
+        await layer.group_add('bench', channel)
+
+    async def drain(channel):
+        for _ in range(count):
+            await layer.receive(channel)
+
+    receivers = asyncio.gather(*(drain(channel) for channel in channels))
+    for i in range(count):
+        await layer.group_send('bench', {'type': 'bench', 'n': i})
+    await receivers
+
+
+def receive_in_other_process(path, ready, count):
+    from .channel_layers import SQLiteChannelLayer
+
+    async def listen():
+        layer = SQLiteChannelLayer(path=path, capacity=count)
+        channel = await layer.new_channel()
+        await layer.group_add('bench-remote', channel)
+        ready.set()
+        for _ in range(count):
+            await layer.receive(channel)
+
+    asyncio.run(listen())
+
+
+@scenario('channel-layers')
+def bench_channel_layers(out, size=2000, members=200, **options):
+    """
+    Messages per second through the in-memory and SQLite layers, sent to one
+    channel and fanned out to a group of `members`, then a check that a
+    group_send reaches a receiver in another process (SQLite only).
+    """
+    out.write(f"{'layer':<8}{'send+receive/s':>16}{'group deliveries/s':>20}")
+    for name, layer in bench_layers(capacity=size).items():
+        with timer() as single:
+            async_to_sync(point_to_point)(layer, size)
+        fan_count = max(size // members, 1)
+        with timer() as group:
+            async_to_sync(fan_out)(layer, members, fan_count)
+        out.write(
+            f"{name:<8}{size / single['seconds']:>16.0f}"
+            f"{members * fan_count / group['seconds']:>20.0f}"
+        )
+
+    layer = bench_layers(capacity=size)['sqlite']
+    ready = multiprocessing.Event()
+    child = multiprocessing.Process(target=receive_in_other_process, args=(layer.path, ready, size))
+    child.start()
+    ready.wait(30)
+    with timer() as remote:
+        for i in range(size):
+            async_to_sync(layer.group_send)('bench-remote', {'type': 'bench', 'n': i})
+        child.join(60)
+    delivered = child.exitcode == 0
+    out.write(
+        f"cross-process: {'all' if delivered else 'NOT all'} {size} messages delivered "
+        f"in {remote['seconds']:.2f}s ({size / remote['seconds']:.0f}/s)"
+    )
+
+
+# --- WebSockets ---
+
+def websocket_scope(session_key):
+    return {
+        'type': 'websocket',
+        'path': '/ws/notifications/',
+        'headers': [
+            (b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode()),
+            (b'origin', b'http://testserver'),
+            (b'host', b'testserver'),
+        ],
+        'subprotocols': [],
+    }
+
+
+async def hold_sockets(application, scope, count, batch=200):
+    """Open `count` sockets through the full ASGI stack; returns their communicators."""
+    sockets = []
+    for start in range(0, count, batch):
+        opened = [ApplicationCommunicator(application, dict(scope)) for _ in range(min(batch, count - start))]
+        for socket in opened:
+            await socket.send_input({'type': 'websocket.connect'})
+        for socket in opened:
+            reply = await socket.receive_output(30)
+            assert reply['type'] == 'websocket.accept', reply
+        sockets += opened
+    return sockets
+
+
+async def broadcast_latency(layer, sockets, group):
+    with timer() as elapsed:
+        await layer.group_send(group, {'type': 'send_notification', 'message': 'bench', 'unread': 0})
+        await asyncio.gather(*(socket.receive_output(30) for socket in sockets))
+    return elapsed['seconds']
+
+
+async def close_sockets(sockets):
+    for socket in sockets:
+        await socket.send_input({'type': 'websocket.disconnect', 'code': 1000})
+    for socket in sockets:
+        await socket.wait(30)
+
+
+@scenario('websockets')
+def bench_websockets(out, size=2000, **options):
+    """
+    Holds `size` idle notification sockets open through the real ASGI stack
+    (origin check, session auth, routing) as one staff user, then reports
+    memory per connection and how long a notification pushed to the user's
+    group takes to reach them all, for each channel layer.
+    """
+    from django.contrib.sessions.backends.db import SessionStore
+    from channels.layers import get_channel_layer
+    from EpicTrailAdventures.asgi import application
+
+    staff = User.objects.create_user(username='bench-staff', is_staff=True)
+    session = SessionStore()
+    session.update({'_auth_user_id': str(staff.pk), '_auth_user_backend': settings.AUTHENTICATION_BACKENDS[0],
+                    '_auth_user_hash': staff.get_session_auth_hash()})
+    session.create()
+    scope = websocket_scope(session.session_key)
+
+    layers = {
+        'memory': {'BACKEND': 'channels.layers.InMemoryChannelLayer'},
+        'sqlite': {'BACKEND': 'myApp.channel_layers.SQLiteChannelLayer',
+                   'CONFIG': {'path': os.path.join(tempfile.mkdtemp(), 'channels.sqlite3')}},
+    }
+    out.write(f"{'layer':<8}{'sockets':>9}{'connect s':>11}{'KiB/socket':>12}{'broadcast ms':>14}")
+    for name, layer_settings in layers.items():
+        with override_settings(ALLOWED_HOSTS=['testserver'], CHANNEL_LAYERS={'default': layer_settings}):
+            async def run():
+                layer = get_channel_layer()
+                tracemalloc.start()
+                before = tracemalloc.get_traced_memory()[0]
+                with timer() as connect:
+                    sockets = await hold_sockets(application, scope, size)
+                per_socket = (tracemalloc.get_traced_memory()[0] - before) / size / 1024
+                tracemalloc.stop()
+                await asyncio.sleep(0.5)  # let the sockets go idle
+                latencies = [await broadcast_latency(layer, sockets, user_group(staff.pk)) for _ in range(3)]
+                await close_sockets(sockets)
+                return connect['seconds'], per_socket, min(latencies)
+
+            connect_seconds, per_socket, latency = async_to_sync(run)()
+        out.write(f"{name:<8}{size:>9}{connect_seconds:>11.2f}{per_socket:>12.1f}{latency * 1000:>14.1f}")
+
+
+# --- CSV export ---
+
+def seed_priced_bookings(count, batch_size=5000):
+    """Bulk-insert `count` bookings with stored totals (no selections) and a tenth as many food orders."""
+    user = User.objects.create_user(username='bench-exporter')
+    food = Food.objects.create(name='Bench Lunch', price_per_person=Decimal('700'))
+    for start in range(0, count, batch_size):
+        Booking.objects.bulk_create(
+            Booking(customer_name=f'Guest {i}', pax=1 + i % 4, total_amount=Decimal(1000 + i % 5000))
+            for i in range(start, min(start + batch_size, count))
+        )
+    FoodOrder.objects.bulk_create(
+        (FoodOrder(user=user, food=food, quantity=1 + i % 3) for i in range(count // 10)),
+        batch_size=batch_size,
+    )
+
+
+def measure_download(view, request, trace=False):
+    """
+    (seconds, seconds to first chunk, bytes) for calling `view` and reading the
+    body, plus the peak traced MiB when `trace` is set (tracing slows the run).
+    """
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    response = view(request)
+    chunks = response.streaming_content if response.streaming else [response.content]
+    first_byte = None
+    size = 0
+    for chunk in chunks:
+        if first_byte is None:
+            first_byte = time.perf_counter() - started
+        size += len(chunk)
+    seconds = time.perf_counter() - started
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return seconds, first_byte or seconds, size, peak
+
+
+@scenario('csv-export')
+def bench_csv_export(out, size=1_000_000, **options):
+    """
+    Time, time to first byte, size and peak Python memory for exporting
+    `size` bookings (and size/10 food orders) as CSV: streamed, streamed
+    with gzip, and buffered into one HttpResponse as the export used to be.
+    Memory is measured in a second, traced run so tracing does not skew the
+    timings.
+    """
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from .views import export_report_csv
+
+    with timer() as seeding:
+        seed_priced_bookings(size)
+    out.write(f"Seeded {size} bookings in {seeding['seconds']:.1f}s")
+
+    def buffered(request):
+        # The old shape: the whole file is built in memory before the first byte goes out
+        response = export_report_csv(request)
+        return HttpResponse(b''.join(response.streaming_content), content_type='text/csv')
+
+    admin = User.objects.create_superuser(username='bench-admin', password='bench')
+    variants = [
+        ('streamed', export_report_csv, {}),
+        ('gzip', export_report_csv, {'HTTP_ACCEPT_ENCODING': 'gzip'}),
+        ('buffered', buffered, {}),
+    ]
+    out.write(f"{'variant':<10}{'seconds':>9}{'rows/s':>10}{'first byte s':>14}{'MiB sent':>10}{'peak MiB':>10}")
+    for name, view, headers in variants:
+        request = RequestFactory().get('/reports/export/csv/', **headers)
+        request.user = admin
+        seconds, first_byte, sent, _ = measure_download(view, request)
+        peak = measure_download(view, request, trace=True)[3]
+        rows = size + size // 10
+        out.write(
+            f"{name:<10}{seconds:>9.2f}{rows / seconds:>10.0f}{first_byte:>14.3f}"
+            f"{sent / 2 ** 20:>10.1f}{peak:>10.1f}"
+        )
+
+
+# --- Analytics summary ---
+
+def spread_bookings_over_months(months=24):
+    """Move the seeded bookings, in id order, onto `months` consecutive months and price their categories."""
+    from django.db.models import F, Max, Min
+    from django.utils import timezone
+
+    ids = Booking.objects.aggregate(first=Min('id'), last=Max('id'))
+    per_month = (ids['last'] - ids['first']) // months + 1
+    start = timezone.now() - timedelta(days=31 * months)
+    for month in range(months):
+        low = ids['first'] + month * per_month
+        Booking.objects.filter(id__gte=low, id__lt=low + per_month).update(
+            created_at=start + timedelta(days=31 * month),
+        )
+    Booking.objects.update(
+        rooms_total=F('total_amount') / 2,
+        activities_total=F('total_amount') / 4,
+        tours_total=F('total_amount') / 4,
+    )
+
+
+def measure_call(func, trace=False):
+    """(seconds, peak traced MiB or None) for calling func()."""
+    if trace:
+        tracemalloc.start()
+    with timer() as timing:
+        func()
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return timing['seconds'], peak
+
+
+@scenario('analytics-summary')
+def bench_analytics_summary(out, size=1_000_000, **options):
+    """
+    Time and peak Python memory for summarising `size` bookings (totals,
+    category revenue, party sizes, monthly series): in one chunked pass of
+    tuples (analytics.summarize_bookings), from a list of Booking instances
+    as the analytics view used to, and as one SQL aggregate per figure.
+    """
+    from django.db.models import Count, DateField, Sum
+    from django.db.models.functions import TruncMonth
+    from django.utils import timezone
+    from . import analytics
+    from .rollups import BOOKING_CATEGORIES
+
+    with timer() as seeding:
+        seed_priced_bookings(size)
+        spread_bookings_over_months()
+    months = len(Booking.objects.dates('created_at', 'month'))
+    out.write(f"Seeded {size} bookings over {months} months in {seeding['seconds']:.1f}s")
+
+    def instances():
+        # The old shape: every booking held in memory and walked once per figure
+        bookings = list(Booking.objects.all())
+        count = len(bookings)
+        revenue = sum(b.total_amount for b in bookings)
+        by_category = {
+            category: sum(getattr(b, field) for b in bookings) for category, field in BOOKING_CATEGORIES.items()
+        }
+        pax = Counter(b.pax for b in bookings)
+        monthly = Counter(timezone.localtime(b.created_at).date().replace(day=1) for b in bookings)
+        return count, revenue, by_category, pax, monthly
+
+    def aggregates():
+        bookings = Booking.objects.order_by()
+        totals = bookings.aggregate(
+            count=Count('id'), revenue=Sum('total_amount'),
+            **{category: Sum(field) for category, field in BOOKING_CATEGORIES.items()},
+        )
+        pax = dict(bookings.values_list('pax').annotate(n=Count('id')))
+        monthly = list(
+            bookings.annotate(month=TruncMonth('created_at', output_field=DateField()))
+            .values('month').annotate(n=Count('id'), revenue=Sum('total_amount'))
+        )
+        return totals, pax, monthly
+
+    variants = [
+        ('one pass', analytics.summarize_bookings),
+        ('instances', instances),
+        ('sql', aggregates),
+    ]
+    out.write(f"{'variant':<11}{'seconds':>9}{'rows/s':>10}{'peak MiB':>10}")
+    for name, func in variants:
+        seconds, _ = measure_call(func)
+        peak = measure_call(func, trace=True)[1]
+        out.write(f"{name:<11}{seconds:>9.2f}{size / seconds:>10.0f}{peak:>10.1f}")
+
+
+# --- Restore ---
+
+LOADDATA_MAX = 2_000  # loaddata saves one object at a time, so it only gets this many bookings
+
+
+@scenario('restore')
+def bench_restore(out, size=1_000_000, **options):
+    """
+    Time and peak Python memory for restoring a gzipped JSON lines backup
+    of `size` bookings (each with one activity) and size/10 food orders:
+    backups.restore(), which streams the file into bulk INSERTs with signals
+    muted, against loaddata, which parses the whole file and saves each
+    object with its signals, on at most LOADDATA_MAX of the bookings.
+    """
+    import json
+    from django.core.management import call_command
+    from django.core.management.color import no_style
+    from . import backups
+
+    with timer() as seeding:
+        seed_priced_bookings(size)
+        activity = Activity.objects.create(name='Bench Archery', description='', price_per_person=Decimal('200'))
+        through = Booking.activities.through
+        ids = list(Booking.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(ids), 5000):
+            through.objects.bulk_create(
+                [through(booking_id=pk, activity=activity) for pk in ids[start:start + 5000]]
+            )
+    out.write(f"Seeded {size} bookings in {seeding['seconds']:.1f}s")
+
+    def empty_tables():
+        tables = backups.backup_tables(backups.backup_models())
+        with transaction.atomic(), connection.cursor() as cursor:
+            for sql in connection.ops.sql_flush(no_style(), tables):
+                cursor.execute(sql)
+
+    small = min(size, LOADDATA_MAX)
+    with tempfile.TemporaryDirectory() as files:
+        full = os.path.join(files, 'full.jsonl.gz')
+        trimmed = os.path.join(files, 'trimmed.jsonl')
+        with timer() as dumping:
+            backups.write_dump(full)
+        out.write(f"Wrote {os.path.getsize(full) / 2 ** 20:.1f} MiB in {dumping['seconds']:.1f}s")
+        with backups.open_backup(full) as lines, open(trimmed, 'w') as trim:
+            bookings = 0
+            for line in lines:
+                if json.loads(line)['model'] == 'myApp.booking':
+                    bookings += 1
+                    if bookings > small:
+                        continue
+                trim.write(line)
+
+        def loaddata():
+            empty_tables()
+            call_command('loaddata', trimmed, verbosity=0)
+
+        variants = [
+            ('restore', size, lambda: backups.restore([full])),
+            ('loaddata', small, loaddata),
+        ]
+        out.write(f"{'variant':<10}{'bookings':>10}{'seconds':>9}{'bookings/s':>12}{'peak MiB':>10}")
+        for name, count, func in variants:
+            seconds, _ = measure_call(func)
+            peak = measure_call(func, trace=True)[1]
+            out.write(f"{name:<10}{count:>10}{seconds:>9.2f}{count / seconds:>12.0f}{peak:>10.1f}")
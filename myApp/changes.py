@@ -0,0 +1,78 @@
+"""
+Change tracking for incremental backups.
+
+Every save or delete of a TRACKED_MODELS row adds a ChangeLog entry naming
+it. signals.py writes the entries for single saves and deletes and for
+many-to-many changes (which count as a change to the owning row); the bulk
+paths that skip signals (BookingQuerySet.refresh_totals,
+NotificationQuerySet.mark_read, tasks.notify_staff and
+retention.prune_notifications) record their rows themselves.
+
+Entries only say which rows changed, not how: an incremental backup reads
+the rows named after a checkpoint as they are now, and those that are gone
+were deleted. Derived tables (inventory, rollups, popularity) are not
+tracked; a restore rebuilds them.
+
+A checkpoint is just the latest entry id, so backups rely on ids being
+handed out in commit order: no entry may commit with an id below one a
+backup has already read. SQLite guarantees it, since one transaction
+writes at a time (and this project starts every transaction IMMEDIATE).
+A database with concurrent writers would need a commit-ordered cursor
+instead, such as a transaction id, before backups could rely on it.
+"""
+from collections import defaultdict
+
+from django.apps import apps
+from django.contrib.auth.models import User
+
+from .models import (
+    Activity, Booking, ChangeLog, Duty, Food, FoodOrder, Notification, NotificationArchive,
+    Package, Profile, Room, RoomBooking, RoomType, SystemSetting, Tour,
+)
+
+TRACKED_MODELS = (
+    User, Profile, Activity, Package, RoomType, Room, RoomBooking, Food, Tour,
+    Booking, FoodOrder, Notification, NotificationArchive, SystemSetting, Duty,
+)
+
+
+def checkpoint():
+    """The id of the latest ChangeLog entry, or 0 if there are none."""
+    return ChangeLog.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def changed_since(since, until):
+    """{model: set of pks} for the entries after `since`, up to and including `until`."""
+    changed = defaultdict(set)
+    rows = (
+        ChangeLog.objects.filter(id__gt=since, id__lte=until)
+        .values_list('model', 'object_id').distinct().order_by()
+    )
+    for label, pk in rows.iterator():
+        changed[apps.get_model(label)].add(pk)
+    return changed
+
+
+def rebaseline(checkpoint):
+    """
+    Start the log afresh at `checkpoint` after a restore: drop every entry
+    and keep one with that id, so checkpoint() returns it and new entries
+    come after it. Entries made since the backup describe rows the restore
+    replaced, and would leak into the next incremental backup.
+    """
+    ChangeLog.objects.all().delete()
+    if checkpoint:
+        ChangeLog.objects.create(id=checkpoint, model=ChangeLog._meta.label_lower, object_id=checkpoint)
+
+
+def prune(through, batch_size=5000):
+    """
+    Delete the entries before checkpoint `through`, keeping that one so
+    checkpoint() and the next full dump still report it. Returns how many went.
+    """
+    removed = 0
+    while True:
+        ids = list(ChangeLog.objects.filter(id__lt=through).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return removed
+        removed += ChangeLog.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,277 @@
+"""
+A channel layer shared by every ASGI worker process on one host, stored in a
+SQLite file, for deployments without Redis.
+
+Messages and group memberships are rows in two tables. A send is one INSERT
+and a group_send is one transaction whatever the group size. Each process
+runs a single poller per event loop that collects messages for all of its
+listening channels in one query and hands them to the waiting receive()
+calls, so a thousand idle sockets cost one indexed SELECT per poll rather
+than a thousand.
+
+Messages expire after `expiry` seconds and group memberships after
+`group_expiry`, as in the in-memory and Redis layers. Message bodies are
+JSON, with bytes values base64-encoded.
+"""
+import asyncio
+import base64
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS channel_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    body TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channel_messages_channel ON channel_messages (channel, id);
+CREATE INDEX IF NOT EXISTS channel_messages_expires ON channel_messages (expires);
+CREATE TABLE IF NOT EXISTS channel_groups (
+    group_name TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (group_name, channel)
+);
+"""
+
+MAX_SQL_PARAMS = 900  # stay well under SQLite's bound-parameter limit
+
+
+def encode(message):
+    def default(value):
+        if isinstance(value, (bytes, bytearray)):
+            return {'__bytes__': base64.b64encode(value).decode('ascii')}
+        raise TypeError(f"Channel messages must be JSON-serialisable, not {type(value).__name__}")
+    return json.dumps(message, default=default, separators=(',', ':'))
+
+
+def decode(body):
+    def object_hook(value):
+        if len(value) == 1 and '__bytes__' in value:
+            return base64.b64decode(value['__bytes__'])
+        return value
+    return json.loads(body, object_hook=object_hook)
+
+
+def chunked(items, size=MAX_SQL_PARAMS):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class LoopState:
+    """Receive queues and the poller task belonging to one event loop."""
+
+    def __init__(self):
+        self.queues = {}
+        self.poller = None
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        path='channels.sqlite3',
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        poll_interval=0.05,
+        batch_size=500,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        # A private pool keeps each thread's connection alive across event
+        # loops (async_to_sync starts a new loop per call)
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='sqlite-channel-layer')
+        self._local = threading.local()
+        self._loops = weakref.WeakKeyDictionary()
+        self._last_cleanup = 0
+
+    # --- Database access (runs on the layer's thread pool) ---
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def write(self, func, *args):
+        """Run func(conn, *args) in a write transaction."""
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = func(conn, *args)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+    def in_thread(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def run(self, func, *args):
+        return self.in_thread(self.write, func, *args)
+
+    def _send(self, conn, channel, body, now):
+        count, = conn.execute(
+            'SELECT COUNT(*) FROM channel_messages WHERE channel = ? AND expires > ?', (channel, now)
+        ).fetchone()
+        if count >= self.get_capacity(channel):
+            raise ChannelFull(channel)
+        conn.execute(
+            'INSERT INTO channel_messages (channel, body, expires) VALUES (?, ?, ?)',
+            (channel, body, now + self.expiry),
+        )
+
+    def _group_send(self, conn, group, body, now):
+        members = [row[0] for row in conn.execute(
+            'SELECT channel FROM channel_groups WHERE group_name = ? AND expires > ?', (group, now)
+        )]
+        queued = {}
+        for chunk in chunked(members):
+            queued.update(conn.execute(
+                f"SELECT channel, COUNT(*) FROM channel_messages WHERE channel IN ({','.join('?' * len(chunk))})"
+                " AND expires > ? GROUP BY channel",
+                (*chunk, now),
+            ))
+        # Like the other layers, a full member channel just misses the message
+        conn.executemany(
+            'INSERT INTO channel_messages (channel, body, expires) VALUES (?, ?, ?)',
+            [(channel, body, now + self.expiry) for channel in members
+             if queued.get(channel, 0) < self.get_capacity(channel)],
+        )
+
+    def _group_send_many(self, conn, messages, now):
+        for group, body in messages:
+            self._group_send(conn, group, body, now)
+
+    def _take(self, channels, now):
+        """Remove and return up to batch_size pending messages for `channels`, oldest first."""
+        conn = self.connection()
+        ids = []
+        for chunk in chunked(channels):
+            ids += [row[0] for row in conn.execute(
+                f"SELECT id FROM channel_messages WHERE channel IN ({','.join('?' * len(chunk))})"
+                " AND expires > ? ORDER BY id LIMIT ?",
+                (*chunk, now, self.batch_size),
+            )]
+        if now - self._last_cleanup > self.expiry:
+            self._last_cleanup = now
+            self.write(self._clean, now)
+        if not ids:
+            return []
+        ids = sorted(ids)[:self.batch_size]
+        # RETURNING hands back only the rows this call deleted, so no message is delivered twice
+        return self.write(lambda conn: sorted(conn.execute(
+            f"DELETE FROM channel_messages WHERE id IN ({','.join('?' * len(ids))}) RETURNING id, channel, body",
+            ids,
+        ).fetchall()))
+
+    def _flush(self, conn):
+        conn.execute('DELETE FROM channel_messages')
+        conn.execute('DELETE FROM channel_groups')
+
+    def _clean(self, conn, now):
+        conn.execute('DELETE FROM channel_messages WHERE expires <= ?', (now,))
+        conn.execute('DELETE FROM channel_groups WHERE expires <= ?', (now,))
+
+    # --- Channel layer API ---
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_channel_name(channel)
+        await self.run(self._send, channel, encode(message), time.time())
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        state = self.loop_state()
+        queue = state.queues.get(channel)
+        if queue is None:
+            queue = state.queues[channel] = asyncio.Queue()
+        if state.poller is None or state.poller.done():
+            state.poller = asyncio.get_running_loop().create_task(self.poll(state))
+        try:
+            return await queue.get()
+        except asyncio.CancelledError:
+            if queue.empty():
+                state.queues.pop(channel, None)
+            raise
+
+    async def new_channel(self, prefix='specific'):
+        return f"{prefix}.sqlite!{uuid.uuid4().hex}"
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self.run(lambda conn: conn.execute(
+            'INSERT OR REPLACE INTO channel_groups (group_name, channel, expires) VALUES (?, ?, ?)',
+            (group, channel, time.time() + self.group_expiry),
+        ))
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        await self.run(lambda conn: conn.execute(
+            'DELETE FROM channel_groups WHERE group_name = ? AND channel = ?', (group, channel)
+        ))
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        await self.run(self._group_send, group, encode(message), time.time())
+
+    async def group_send_many(self, messages):
+        """group_send() for a list of (group, message) pairs in one transaction."""
+        encoded = []
+        for group, message in messages:
+            assert isinstance(message, dict), "Message is not a dict"
+            self.require_valid_group_name(group)
+            encoded.append((group, encode(message)))
+        await self.run(self._group_send_many, encoded, time.time())
+
+    async def flush(self):
+        await self.run(self._flush)
+        self._loops.clear()
+
+    async def close(self):
+        pass
+
+    # --- Delivery ---
+
+    def loop_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            state = self._loops[loop] = LoopState()
+        return state
+
+    async def poll(self, state):
+        """Deliver messages to this loop's receivers until none are left listening."""
+        while state.queues:
+            rows = await self.in_thread(self._take, list(state.queues), time.time())
+            for _, channel, body in rows:
+                queue = state.queues.get(channel)
+                if queue is not None:
+                    queue.put_nowait(decode(body))
+            if len(rows) < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
@@ -1,14 +1,85 @@
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from urllib.parse import parse_qs
 import json
 
+from .models import Notification
+from . import stats
+
+# A reconnecting client that missed more than this many notifications is told
+# to reload the page rather than being sent the whole backlog
+REPLAY_LIMIT = 100
+
+
+def user_group(user_id):
+    return f"user_{user_id}"
+
+
+def missed_notifications(user_id, last_seen_id, limit):
+    """
+    The user's notifications newer than last_seen_id, oldest first, and their
+    unread count. Reads at most limit + 1 rows off the (user, id) index, so the
+    caller can tell whether anything was left out.
+    """
+    missed = list(
+        Notification.objects.filter(user_id=user_id, id__gt=last_seen_id).order_by('id')
+        .values('id', 'message', 'type')[:limit + 1]
+    )
+    return missed, stats.unread_count(user_id)
+
+
 class NotificationConsumer(AsyncWebsocketConsumer):
+    """
+    Pushes a signed-in user's own notifications, each with their unread
+    count. Staff are notified the same way: tasks.notify_staff gives every
+    staff user a notification of their own. Anonymous connections are
+    refused.
+
+    A client reconnecting with ?last_seen_id=<id> is first sent the
+    notifications it missed while disconnected, marked "replayed".
+    """
+
     async def connect(self):
-        self.group_name = "notifications"
-        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+        self.group_names = [user_group(user.pk)]
+        # Join before reading the backlog so nothing falls between the two;
+        # the client drops anything it sees twice by id
+        for group_name in self.group_names:
+            await self.channel_layer.group_add(group_name, self.channel_name)
         await self.accept()
 
+        last_seen_id = self.last_seen_id()
+        if last_seen_id is not None:
+            await self.replay(user.pk, last_seen_id)
+
+    def last_seen_id(self):
+        query = parse_qs(self.scope.get("query_string", b"").decode("latin-1"))
+        try:
+            return int(query["last_seen_id"][0])
+        except (KeyError, ValueError):
+            return None
+
+    async def replay(self, user_id, last_seen_id):
+        missed, unread = await database_sync_to_async(missed_notifications)(user_id, last_seen_id, REPLAY_LIMIT)
+        if len(missed) > REPLAY_LIMIT:
+            await self.send(text_data=json.dumps({"resync": True, "unread": unread}))
+            return
+        for notification in missed:
+            await self.send(text_data=json.dumps({
+                "id": notification["id"],
+                "message": notification["message"],
+                "notification_type": notification["type"],
+                "unread": unread,
+                "replayed": True,
+            }))
+
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        for group_name in getattr(self, "group_names", []):
+            await self.channel_layer.group_discard(group_name, self.channel_name)
 
     async def send_notification(self, event):
-        await self.send(text_data=json.dumps({'message': event['message']}))
+        payload = {key: event[key] for key in ("id", "message", "notification_type", "unread") if key in event}
+        await self.send(text_data=json.dumps(payload))
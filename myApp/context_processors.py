@@ -1,25 +1,36 @@
-
-from django.contrib.auth.models import User
+from django.utils.functional import SimpleLazyObject, new_method_proxy
 from .models import Booking
+from . import stats
+
+# Counters and sums come from the stats cache, so rendering a page normally
+# costs no aggregate queries; see stats.py for how they are kept current.
+# Every value is wrapped in LazyValue: nothing is looked up until a template
+# actually uses it, and then only once per request.
+
+class LazyValue(SimpleLazyObject):
+    """
+    SimpleLazyObject that also proxies format(), which Django's number
+    localization calls when a lazy int or Decimal is rendered.
+    """
+    __format__ = new_method_proxy(format)
+
 
 def total_users(request):
-    return {'total_users': User.objects.count()}
+    return {'total_users': LazyValue(stats.total_users)}
 
 def total_bookings(request):
-    return {'total_bookings': Booking.objects.count()}
+    return {'total_bookings': LazyValue(stats.total_bookings)}
 
 def total_amount(request):
     """
-    Returns the total amount payable for the authenticated user's bookings.
-    Sums Booking.amount_required for all their bookings.
+    Returns the total amount payable across all bookings.
+    Sums the stored Booking.total_amount column (cached).
     """
-    total = 0
-    if request.user.is_authenticated:
-        # Filter bookings for the all/current user
-        bookings = Booking.objects.all()#filter(user=request.user)
-        # Sum the dynamic amount_required property
-        total = sum(booking.amount_required for booking in bookings)
-    return {'total_amount': total}
+    def get_total():
+        if request.user.is_authenticated:
+            return stats.total_revenue()
+        return 0
+    return {'total_amount': LazyValue(get_total)}
 
 # all user bookings and their total amount per user all bookings
 def total_cost(request):
@@ -27,22 +38,21 @@ def total_cost(request):
     Provides all bookings and related totals for the logged-in user.
     Includes activities, packages, rooms, food, tours, and amount calculations.
     """
-    if not request.user.is_authenticated:
-        return {
-            'user_bookings': [],
-            'user_total_amount': 0,
-        }
-
-    # Fetch all bookings for the logged-in user with related data
-    bookings = Booking.objects.filter(user=request.user).prefetch_related(
-        'activities', 'packages', 'rooms', 'food', 'tours'
-    )
-
-    # Calculate total payable amount for all bookings
-    total_amount = sum(b.amount_required for b in bookings)
+    def get_bookings():
+        if not request.user.is_authenticated:
+            return []
+        # Fetch all bookings for the logged-in user with related data
+        return Booking.objects.filter(user=request.user).prefetch_related(
+            'activities', 'packages', 'rooms', 'food', 'tours'
+        )
+
+    def get_total_amount():
+        if not request.user.is_authenticated:
+            return 0
+        # Total payable amount for all bookings (cached)
+        return stats.user_total_amount(request.user.pk)
 
     return {
-        'user_bookings': bookings,
-        'user_total_amount': total_amount,
+        'user_bookings': LazyValue(get_bookings),
+        'user_total_amount': LazyValue(get_total_amount),
     }
-    
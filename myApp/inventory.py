@@ -0,0 +1,236 @@
+"""
+Per-night room inventory.
+
+RoomInventory keeps one row per (room type, night) holding the number of
+rooms of that type booked that night, counting both Booking.rooms and
+RoomBooking. The signal handlers in signals.py adjust it inside the same
+transaction as the booking change; rebuild() recomputes it from scratch.
+
+A stay occupies the nights from check-in up to (not including) check-out.
+Same-day stays occupy one night, matching Booking.nights_spent.
+"""
+from collections import Counter, namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Max, Q
+from django.utils.dateparse import parse_date
+
+from .models import Booking, Room, RoomBooking, RoomInventory, RoomType
+
+
+def as_date(value):
+    if isinstance(value, str):
+        return parse_date(value)
+    return value
+
+
+def stay_nights(check_in, check_out):
+    """List of nights occupied by a stay; empty when either date is missing."""
+    check_in, check_out = as_date(check_in), as_date(check_out)
+    if not check_in or not check_out:
+        return []
+    nights = max((check_out - check_in).days, 1)
+    return [check_in + timedelta(days=i) for i in range(nights)]
+
+
+def room_type_counts(room_ids):
+    """Counter of room_type_id -> number of the given rooms of that type."""
+    return Counter(Room.objects.filter(pk__in=room_ids).values_list('room_type_id', flat=True))
+
+
+def booking_room_counts(booking_id):
+    return Counter(
+        Booking.rooms.through.objects.filter(booking_id=booking_id)
+        .values_list('room__room_type_id', flat=True)
+    )
+
+
+def adjust(counts, check_in, check_out, sign=1):
+    """Add (sign=1) or remove (sign=-1) `counts` rooms per type over a stay."""
+    nights = stay_nights(check_in, check_out)
+    counts = {room_type: n for room_type, n in counts.items() if n}
+    if not nights or not counts:
+        return
+    with transaction.atomic():
+        RoomInventory.objects.bulk_create(
+            [RoomInventory(room_type_id=room_type, date=night) for room_type in counts for night in nights],
+            ignore_conflicts=True,
+        )
+        for room_type, n in counts.items():
+            RoomInventory.objects.filter(
+                room_type_id=room_type, date__gte=nights[0], date__lte=nights[-1]
+            ).update(booked=F('booked') + sign * n)
+
+
+def rooms_free(room_type, check_in, check_out, exclude_booking=None):
+    """
+    Rooms of `room_type` free on every night of the stay. `exclude_booking`
+    leaves that booking's own rooms out, for validating an edit.
+    """
+    nights = stay_nights(check_in, check_out)
+    if not nights:
+        return room_type.total_rooms
+    ledger = RoomInventory.objects.filter(
+        room_type=room_type, date__gte=nights[0], date__lte=nights[-1]
+    )
+    if exclude_booking is None:
+        booked = ledger.aggregate(booked=Max('booked'))['booked'] or 0
+        return room_type.total_rooms - booked
+
+    per_night = dict(ledger.values_list('date', 'booked'))
+    own = booking_room_counts(exclude_booking.pk)[room_type.pk]
+    for night in stay_nights(*exclude_booking.stored_stay()):
+        if night in per_night:
+            per_night[night] -= own
+    return room_type.total_rooms - max(per_night.values(), default=0)
+
+
+# One room that could not be reserved; `reason` is a user-facing sentence
+RoomConflict = namedtuple('RoomConflict', ['room_id', 'room', 'reason'])
+
+
+class Availability:
+    """
+    Result of check_rooms().
+
+    `occupancy` maps room_type_id to a dict with the room type, the rooms of
+    that type requested, and how many are free on the busiest night.
+    `failures` lists a RoomConflict for every room that does not fit.
+    """
+
+    def __init__(self, occupancy, failures):
+        self.occupancy = occupancy
+        self.failures = failures
+
+    @property
+    def ok(self):
+        return not self.failures
+
+    def messages(self):
+        return [failure.reason for failure in self.failures]
+
+
+def check_rooms(room_ids, check_in, check_out, exclude_booking=None):
+    """
+    Check a whole selection of rooms for a stay with two queries: one for
+    the rooms and their types, one grouped over the ledger. `exclude_booking`
+    leaves that booking's own rooms out, for validating an edit.
+    """
+    room_ids = [int(pk) for pk in room_ids]
+    rooms = {room.pk: room for room in Room.objects.filter(pk__in=room_ids).select_related('room_type')}
+    failures = [
+        RoomConflict(pk, None, f"Room #{pk} does not exist.") for pk in room_ids if pk not in rooms
+    ]
+
+    requested = Counter(rooms[pk].room_type_id for pk in room_ids if pk in rooms)
+    nights = stay_nights(check_in, check_out)
+    busiest = {}
+    if nights and requested:
+        ledger = RoomInventory.objects.filter(
+            room_type_id__in=requested, date__gte=nights[0], date__lte=nights[-1]
+        )
+        if exclude_booking is None:
+            busiest = dict(
+                ledger.order_by().values('room_type').annotate(booked=Max('booked'))
+                .values_list('room_type', 'booked')
+            )
+        else:
+            own = booking_room_counts(exclude_booking.pk)
+            own_nights = set(stay_nights(*exclude_booking.stored_stay()))
+            for room_type, night, booked in ledger.values_list('room_type', 'date', 'booked'):
+                if night in own_nights:
+                    booked -= own[room_type]
+                busiest[room_type] = max(busiest.get(room_type, 0), booked)
+
+    room_types = {room.room_type_id: room.room_type for room in rooms.values()}
+    occupancy = {
+        room_type_id: {
+            'room_type': room_types[room_type_id],
+            'requested': count,
+            'free': room_types[room_type_id].total_rooms - busiest.get(room_type_id, 0),
+        }
+        for room_type_id, count in requested.items()
+    }
+
+    for pk in room_ids:
+        room = rooms.get(pk)
+        if room is not None and occupancy[room.room_type_id]['requested'] > occupancy[room.room_type_id]['free']:
+            failures.append(RoomConflict(pk, room, f"Room '{room.name}' is fully booked for the selected dates."))
+    return Availability(occupancy, failures)
+
+
+def overlapping(start, end, prefix=''):
+    """Q for stays occupying at least one night in [start, end)."""
+    return Q(**{f'{prefix}check_in__lt': end}) & (
+        Q(**{f'{prefix}check_out__gt': start}) | Q(**{f'{prefix}check_in__gte': start})
+    )
+
+
+def availability_window(start, days):
+    """
+    Free rooms of every room type on each of `days` nights from `start`, as a
+    JSON-ready dict. Computed with a sweep over the stays that overlap the
+    window (+1 on the first night, -1 after the last) rather than per night.
+    """
+    end = start + timedelta(days=days)
+    stays = list(
+        Booking.rooms.through.objects.filter(overlapping(start, end, 'booking__'))
+        .values_list('booking__check_in', 'booking__check_out', 'room__room_type_id')
+    )
+    stays += RoomBooking.objects.filter(overlapping(start, end)).values_list('check_in', 'check_out', 'room_type_id')
+
+    changes = {}
+    for check_in, check_out, room_type in stays:
+        if not check_in or not check_out:
+            continue  # no nights, as in stay_nights()
+        first = max(check_in, start)
+        stop = min(max(check_out, check_in + timedelta(days=1)), end)
+        if first < stop:
+            delta = changes.setdefault(room_type, [0] * (days + 1))
+            delta[(first - start).days] += 1
+            delta[(stop - start).days] -= 1
+
+    room_ids = {}
+    for room_id, room_type in Room.objects.order_by('pk').values_list('pk', 'room_type_id'):
+        room_ids.setdefault(room_type, []).append(room_id)
+
+    room_types = []
+    for room_type in RoomType.objects.order_by('name'):
+        booked, free = 0, []
+        for delta in changes.get(room_type.pk, [0] * days)[:days]:
+            booked += delta
+            free.append(room_type.total_rooms - booked)
+        room_types.append({
+            'id': room_type.pk,
+            'name': room_type.name,
+            'total_rooms': room_type.total_rooms,
+            'available': room_type.available,
+            'rooms': room_ids.get(room_type.pk, []),
+            'free': free,
+        })
+    return {'start': start.isoformat(), 'days': days, 'room_types': room_types}
+
+
+def rebuild(batch_size=1000):
+    """Recompute the whole ledger from Booking and RoomBooking rows. Returns the row count."""
+    booked = Counter()
+    stays = Booking.rooms.through.objects.values_list(
+        'booking__check_in', 'booking__check_out', 'room__room_type_id'
+    )
+    for check_in, check_out, room_type in stays.iterator(chunk_size=batch_size):
+        for night in stay_nights(check_in, check_out):
+            booked[room_type, night] += 1
+    stays = RoomBooking.objects.values_list('check_in', 'check_out', 'room_type_id')
+    for check_in, check_out, room_type in stays.iterator(chunk_size=batch_size):
+        for night in stay_nights(check_in, check_out):
+            booked[room_type, night] += 1
+
+    with transaction.atomic():
+        RoomInventory.objects.all().delete()
+        RoomInventory.objects.bulk_create(
+            (RoomInventory(room_type_id=room_type, date=night, booked=n)
+             for (room_type, night), n in booked.items()),
+            batch_size=batch_size,
+        )
+    return len(booked)
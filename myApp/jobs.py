@@ -0,0 +1,170 @@
+"""
+Background jobs backed by the Job table; no broker needed.
+
+Tasks register with @task(name) and take the running Job as their first
+argument (for set_progress()) plus the keyword arguments given to enqueue().
+`manage.py run_jobs` claims queued jobs in priority order and runs them on a
+thread pool. A failing job is retried with exponential backoff until it has
+used max_attempts, then left as failed with the traceback in Job.error.
+A job still running after STALE_AFTER seconds is presumed to have lost its
+worker (or its outcome failed to save) and is claimed again.
+
+Views enqueue and return at once; the work is done by run_jobs. For
+development without a worker, JOBS_EAGER = True makes enqueue() run the
+cheap tasks (those registered with eager=True, such as notifications)
+in-process as soon as the current transaction commits. Reports, backups
+and the like always wait for run_jobs.
+"""
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Job
+
+TASKS = {}
+
+RETRY_BACKOFF = getattr(settings, 'JOBS_RETRY_BACKOFF', 10)  # seconds, doubled per attempt
+STALE_AFTER = getattr(settings, 'JOBS_STALE_AFTER', 3600)  # seconds before a running job is presumed dead
+
+
+class UnknownTask(Exception):
+    pass
+
+
+def task(name, max_attempts=3, priority=0, eager=False):
+    """
+    Register `func` as the task `name`, with its default retry budget and
+    priority. `eager` tasks are cheap enough to run in-process under JOBS_EAGER.
+    """
+    def register(func):
+        TASKS[name] = {'func': func, 'max_attempts': max_attempts, 'priority': priority, 'eager': eager}
+        return func
+    return register
+
+
+def files_dir(*parts):
+    """Private directory for files written by jobs, created on demand."""
+    path = os.path.join(getattr(settings, 'JOBS_FILES_DIR', settings.BASE_DIR / 'jobfiles'), *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def enqueue(name, priority=None, user=None, run_after=None, **kwargs):
+    """Queue the task `name` with JSON-serialisable `kwargs`; returns the Job."""
+    if name not in TASKS:
+        raise UnknownTask(name)
+    spec = TASKS[name]
+    job = Job.objects.create(
+        task=name,
+        kwargs=kwargs,
+        priority=spec['priority'] if priority is None else priority,
+        max_attempts=spec['max_attempts'],
+        run_after=run_after or timezone.now(),
+        user=user,
+    )
+    if spec['eager'] and getattr(settings, 'JOBS_EAGER', False):
+        # Robust: the caller's transaction has committed by then, so an error
+        # here (say, the database is busy) is logged and the job left queued
+        # for run_jobs rather than raised into code that would retry its work
+        transaction.on_commit(lambda: run(claim_job(job.pk, 'eager')), robust=True)
+    return job
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def claimable():
+    """Q for the jobs a worker may take: queued and due, or running for longer than STALE_AFTER."""
+    now = timezone.now()
+    return (
+        Q(status=Job.QUEUED, run_after__lte=now)
+        | Q(status=Job.RUNNING, started_at__lt=now - timedelta(seconds=STALE_AFTER))
+    )
+
+
+def claim_job(pk, worker):
+    """Mark job `pk` as running for `worker` if it is still claimable; returns it or None."""
+    claimed = Job.objects.filter(claimable(), pk=pk).update(
+        status=Job.RUNNING, worker=worker, started_at=timezone.now(),
+    )
+    return Job.objects.get(pk=pk) if claimed else None
+
+
+def claim(worker):
+    """
+    Claim the most urgent job that is due. The conditional UPDATE in
+    claim_job() means two workers can never run the same job.
+    """
+    while True:
+        pk = (
+            Job.objects.filter(claimable())
+            .order_by('-priority', 'run_after', 'pk')
+            .values_list('pk', flat=True)
+            .first()
+        )
+        if pk is None:
+            return None
+        job = claim_job(pk, worker)
+        if job is not None:
+            return job
+
+
+def run(job):
+    """Run a claimed job and record the outcome, scheduling a retry on failure."""
+    if job is None:
+        return None
+    job.attempts += 1
+    try:
+        if job.task not in TASKS:
+            raise UnknownTask(job.task)
+        result = TASKS[job.task]['func'](job, **job.kwargs)
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_after = timezone.now() + timedelta(seconds=RETRY_BACKOFF * 2 ** (job.attempts - 1))
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+        job.save(update_fields=['attempts', 'error', 'status', 'run_after', 'finished_at'])
+        return job
+
+    job.status = Job.DONE
+    job.result = result
+    job.progress = 100
+    job.finished_at = timezone.now()
+    job.save(update_fields=['attempts', 'status', 'result', 'progress', 'finished_at'])
+    return job
+
+
+def work_off(worker=None, limit=None):
+    """Run due jobs one after another until none are left (or `limit` ran); returns the count."""
+    worker = worker or worker_name()
+    done = 0
+    while limit is None or done < limit:
+        try:
+            job = claim(worker)
+        except OperationalError:
+            # Database locked by another writer; let the caller poll again
+            break
+        if job is None:
+            break
+        run(job)
+        done += 1
+    return done
+
+
+def requeue_stale(older_than=STALE_AFTER):
+    """Put back jobs whose worker died mid-run; returns how many were requeued."""
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    return Job.objects.filter(status=Job.RUNNING, started_at__lt=cutoff).update(
+        status=Job.QUEUED, worker='', run_after=timezone.now(),
+    )
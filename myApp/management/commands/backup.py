@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from myApp import backups, changes
+
+
+class Command(BaseCommand):
+    help = (
+        "Write a compressed backup of the database: JSON lines of every model, "
+        "which loaddata can read, or for SQLite a binary snapshot. With --since, "
+        "only the rows changed after that checkpoint; see the restore command."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'output', nargs='?',
+            help="File to write (default: backup_<timestamp> in the current directory).",
+        )
+        parser.add_argument('--kind', choices=list(backups.KINDS), default='ndjson')
+        parser.add_argument('--compression', choices=list(backups.COMPRESSIONS), default='gzip')
+        parser.add_argument(
+            '--chunk-size', type=int, default=backups.CHUNK_SIZE,
+            help="Rows read per query (JSON lines only).",
+        )
+        parser.add_argument(
+            '--since', type=int,
+            help="Write only the changes after this checkpoint, as printed by the previous backup.",
+        )
+        parser.add_argument(
+            '--prune', action='store_true',
+            help="Afterwards, drop the change log entries before the checkpoint this backup ends at.",
+        )
+
+    def handle(self, *args, **options):
+        kind, compression = options['kind'], options['compression']
+        try:
+            backups.check_options(kind, compression)
+        except ValueError as error:
+            raise CommandError(error)
+        since = options['since']
+        if since is not None and kind != 'ndjson':
+            raise CommandError("--since only works for JSON lines backups.")
+        path = options['output'] or (
+            f"backup_{timezone.localtime().strftime('%Y%m%d_%H%M%S')}{backups.file_suffix(kind, compression)}"
+        )
+
+        reported = [-10]
+
+        def report(percent):
+            if percent >= reported[0] + 10:
+                reported[0] = percent
+                self.stderr.write(f"{percent}%")
+
+        # Progress costs a COUNT per model up front, so it is only shown when asked for (-v 2)
+        progress = report if options['verbosity'] > 1 else None
+
+        # Anything changed while a full backup runs is in the next incremental one as well
+        checkpoint = changes.checkpoint()
+        if kind == 'sqlite':
+            pages = backups.snapshot(path, compression, progress=progress)
+            self.stdout.write(self.style.SUCCESS(f"Copied {pages} pages to {path}."))
+        elif since is None:
+            count = backups.write_dump(path, compression, chunk_size=options['chunk_size'], progress=progress)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {count} objects to {path}."))
+        else:
+            count, checkpoint = backups.write_changes(
+                path, since, compression, chunk_size=options['chunk_size'], progress=progress,
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Wrote {count} objects changed after checkpoint {since} to {path}."
+            ))
+        self.stdout.write(f"Checkpoint {checkpoint}: pass --since {checkpoint} to back up the changes after this.")
+        if options['prune']:
+            removed = changes.prune(checkpoint)
+            self.stdout.write(f"Pruned {removed} change log entries.")
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from myApp.benchmarks import SCENARIOS, throwaway_database
+
+
+class Command(BaseCommand):
+    help = "Run a performance benchmark against a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument(
+            '--size', type=int, default=None,
+            help="Number of rows to seed (each scenario has its own default).",
+        )
+
+    def handle(self, *args, **options):
+        run = SCENARIOS[options['scenario']]
+        kwargs = {} if options['size'] is None else {'size': options['size']}
+        with throwaway_database():
+            run(self.stdout, **kwargs)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from myApp import retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Archive (or delete) read notifications older than the retention period "
+        "set in System Settings. Safe to run from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help="Override the retention period, in days.",
+        )
+        archive = parser.add_mutually_exclusive_group()
+        archive.add_argument(
+            '--archive', dest='archive', action='store_true', default=None,
+            help="Move pruned notifications to the archive table.",
+        )
+        archive.add_argument(
+            '--delete', dest='archive', action='store_false',
+            help="Delete pruned notifications outright.",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Rows moved per transaction.",
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help="Seconds to sleep between batches.",
+        )
+
+    def handle(self, *args, **options):
+        removed = retention.prune_notifications(
+            days=options['days'],
+            archive=options['archive'],
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+        )
+        self.stdout.write(self.style.SUCCESS(f"Pruned {removed} notifications."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from myApp.models import Booking
+
+
+class Command(BaseCommand):
+    help = "Recalculate the stored total and per-category subtotals of every booking."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=2000,
+            help="Number of bookings repriced per UPDATE statement.",
+        )
+
+    def handle(self, *args, **options):
+        updated = Booking.objects.order_by('pk').refresh_totals(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt totals for {updated} bookings."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from myApp import inventory
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-night room inventory ledger from all bookings."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Rows read and written per batch.",
+        )
+
+    def handle(self, *args, **options):
+        rows = inventory.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} room inventory rows."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from myApp import popularity
+
+
+class Command(BaseCommand):
+    help = "Recompute the catalog item popularity counters from all booking selections."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Rows written per INSERT.",
+        )
+
+    def handle(self, *args, **options):
+        rows = popularity.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt popularity counters ({rows} daily rows)."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from myApp import rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily revenue rollup from all bookings and food orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Rows written per INSERT.",
+        )
+
+    def handle(self, *args, **options):
+        rows = rollups.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} daily revenue rollup rows."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myApp import backups
+
+
+class Command(BaseCommand):
+    help = (
+        "Restore JSON lines backups: a full backup followed by the incremental "
+        "ones taken after it, oldest first, in one transaction. Rows are "
+        "inserted in bulk with signals muted, and the derived tables rebuilt "
+        "at the end. On a database restored from a SQLite snapshot, pass just "
+        "the incremental ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('backups', nargs='+', help="Backup files, oldest first.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=backups.CHUNK_SIZE,
+            help="Objects parsed and inserted per batch.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            saved, deleted = backups.restore(options['backups'], chunk_size=options['chunk_size'])
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(f"Restored {saved} objects and removed {deleted}."))
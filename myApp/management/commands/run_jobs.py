@@ -0,0 +1,59 @@
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+from myApp import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs on a pool of worker threads."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=getattr(settings, 'JOBS_WORKER_THREADS', 4),
+            help="Jobs run at the same time.",
+        )
+        parser.add_argument(
+            '--poll', type=float, default=getattr(settings, 'JOBS_POLL_INTERVAL', 1.0),
+            help="Seconds an idle thread waits before looking for work again.",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Run every job that is due, then exit instead of polling.",
+        )
+
+    def handle(self, *args, **options):
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} jobs left running by a dead worker.")
+
+        stop = threading.Event()
+        if not options['once'] and threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *_: stop.set())
+
+        def work():
+            done = 0
+            try:
+                while not stop.is_set():
+                    try:
+                        ran = jobs.work_off()
+                    except OperationalError:
+                        ran = 0  # database busy; the job is retried or requeued later
+                    done += ran
+                    if not ran:
+                        if options['once']:
+                            break
+                        stop.wait(options['poll'])
+            finally:
+                connection.close()
+            return done
+
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            futures = [pool.submit(work) for _ in range(options['threads'])]
+            total = sum(future.result() for future in futures)
+        self.stdout.write(self.style.SUCCESS(f"Ran {total} jobs."))
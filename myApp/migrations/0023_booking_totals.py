@@ -0,0 +1,97 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:40
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def populate_booking_totals(apps, schema_editor):
+    """Price existing bookings the same way Booking.calculate_totals() does."""
+    Booking = apps.get_model('myApp', 'Booking')
+    bookings = Booking.objects.prefetch_related(
+        'rooms__room_type', 'activities', 'packages', 'food', 'tours'
+    )
+    batch = []
+    for booking in bookings.iterator(chunk_size=500):
+        pax = booking.pax or 1
+        details = booking.pax_details or {}
+
+        def pax_for(category):
+            return details[category].get('pax', pax) if category in details else pax
+
+        nights = 1
+        if booking.check_in and booking.check_out:
+            nights = max((booking.check_out - booking.check_in).days, 1)
+
+        booking.rooms_total = sum(
+            (r.room_type.price_per_night * pax_for('rooms') * nights for r in booking.rooms.all()),
+            Decimal('0'),
+        )
+        booking.activities_total = sum(
+            (a.price_per_person * pax_for('activities') for a in booking.activities.all()), Decimal('0')
+        )
+        booking.packages_total = sum(
+            (p.price_per_person * pax_for('packages') for p in booking.packages.all()), Decimal('0')
+        )
+        booking.food_total = sum(
+            (f.price_per_person * pax_for('food') for f in booking.food.all()), Decimal('0')
+        )
+        booking.tours_total = sum(
+            (t.price_per_person * pax_for('tours') for t in booking.tours.all()), Decimal('0')
+        )
+        booking.total_amount = (
+            booking.rooms_total + booking.activities_total + booking.packages_total
+            + booking.food_total + booking.tours_total
+        )
+        batch.append(booking)
+        if len(batch) >= 500:
+            Booking.objects.bulk_update(batch, TOTAL_FIELDS)
+            batch = []
+    if batch:
+        Booking.objects.bulk_update(batch, TOTAL_FIELDS)
+
+
+TOTAL_FIELDS = [
+    'rooms_total', 'activities_total', 'packages_total', 'food_total', 'tours_total', 'total_amount',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myApp', '0022_foodorder_check_in'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='activities_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='food_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='packages_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='rooms_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='total_amount',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='tours_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(populate_booking_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:45
+
+from collections import Counter
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_inventory(apps, schema_editor):
+    """Build the ledger the same way myApp.inventory.rebuild() does."""
+    Booking = apps.get_model('myApp', 'Booking')
+    RoomBooking = apps.get_model('myApp', 'RoomBooking')
+    RoomInventory = apps.get_model('myApp', 'RoomInventory')
+
+    booked = Counter()
+    stays = list(Booking.rooms.through.objects.values_list(
+        'booking__check_in', 'booking__check_out', 'room__room_type_id'
+    ))
+    stays += list(RoomBooking.objects.values_list('check_in', 'check_out', 'room_type_id'))
+    for check_in, check_out, room_type in stays:
+        if check_in and check_out:
+            for i in range(max((check_out - check_in).days, 1)):
+                booked[room_type, check_in + timedelta(days=i)] += 1
+    RoomInventory.objects.bulk_create(
+        [RoomInventory(room_type_id=room_type, date=night, booked=n) for (room_type, night), n in booked.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myApp', '0023_booking_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomInventory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('booked', models.IntegerField(default=0)),
+                ('room_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory', to='myApp.roomtype')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('room_type', 'date'), name='unique_room_type_night')],
+            },
+        ),
+        migrations.RunPython(populate_inventory, migrations.RunPython.noop),
+    ]
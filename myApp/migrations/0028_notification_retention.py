@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myApp', '0027_notification_inbox_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemsetting',
+            name='archive_notifications',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='systemsetting',
+            name='notification_retention_days',
+            field=models.PositiveIntegerField(default=90),
+        ),
+        migrations.CreateModel(
+            name='NotificationArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('message', models.CharField(max_length=255)),
+                ('type', models.CharField(choices=[('booking', 'Booking'), ('registration', 'Registration')], default='booking', max_length=50)),
+                ('created_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
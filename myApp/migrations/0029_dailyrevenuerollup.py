@@ -0,0 +1,92 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:13
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+
+BOOKING_CATEGORIES = {
+    'rooms': 'rooms_total',
+    'activities': 'activities_total',
+    'packages': 'packages_total',
+    'food': 'food_total',
+    'tours': 'tours_total',
+}
+
+
+def populate_rollups(apps, schema_editor):
+    """Fill the table the same way myApp.rollups.rebuild() does."""
+    Booking = apps.get_model('myApp', 'Booking')
+    FoodOrder = apps.get_model('myApp', 'FoodOrder')
+    DailyRevenueRollup = apps.get_model('myApp', 'DailyRevenueRollup')
+
+    per_category = {}
+    for category, field in BOOKING_CATEGORIES.items():
+        used = Q(**{f'{field}__gt': 0})
+        per_category[f'{category}_bookings'] = Count('id', filter=used)
+        per_category[f'{category}_pax'] = Sum('pax', filter=used)
+        per_category[f'{category}_revenue'] = Sum(field)
+    rows = []
+    booking_days = (
+        Booking.objects.annotate(day=TruncDate('created_at')).values('day').order_by('day')
+        .annotate(count=Count('id'), guests=Sum('pax'), revenue=Sum('total_amount'), **per_category)
+    )
+    for totals in booking_days:
+        rows.append(DailyRevenueRollup(
+            date=totals['day'], category='bookings',
+            bookings=totals['count'], pax=totals['guests'] or 0, revenue=totals['revenue'] or 0,
+        ))
+        for category in BOOKING_CATEGORIES:
+            if totals[f'{category}_bookings']:
+                rows.append(DailyRevenueRollup(
+                    date=totals['day'], category=category, bookings=totals[f'{category}_bookings'],
+                    pax=totals[f'{category}_pax'] or 0, revenue=totals[f'{category}_revenue'] or 0,
+                ))
+    order_days = (
+        FoodOrder.objects.annotate(day=TruncDate('created_at')).values('day').order_by('day')
+        .annotate(
+            count=Count('id'),
+            guests=Sum('quantity'),
+            revenue=Sum(ExpressionWrapper(F('food__price_per_person') * F('quantity'), output_field=DecimalField())),
+        )
+    )
+    for totals in order_days:
+        rows.append(DailyRevenueRollup(
+            date=totals['day'], category='food_orders',
+            bookings=totals['count'], pax=totals['guests'] or 0, revenue=totals['revenue'] or 0,
+        ))
+    DailyRevenueRollup.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myApp', '0028_notification_retention'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='foodorder',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='DailyRevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('category', models.CharField(choices=[('bookings', 'All Bookings'), ('rooms', 'Rooms'), ('activities', 'Activities'), ('packages', 'Packages'), ('food', 'Food'), ('tours', 'Tours'), ('food_orders', 'Food Orders')], max_length=20)),
+                ('bookings', models.PositiveIntegerField(default=0)),
+                ('pax', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'category'), name='unique_rollup_day_category')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
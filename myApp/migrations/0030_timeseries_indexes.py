@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myApp', '0029_dailyrevenuerollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['check_in', 'pax', 'total_amount'], name='booking_check_in_totals_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='foodorder',
+            index=models.Index(fields=['check_in', 'food', 'quantity'], name='foodorder_check_in_idx'),
+        ),
+    ]
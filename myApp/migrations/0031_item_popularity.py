@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-17 23:34
+
+from django.db import migrations, models
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+
+# Booking relation -> the item's foreign key on its through table
+RELATIONS = {
+    'activities': 'activity',
+    'packages': 'package',
+    'rooms': 'room',
+    'tours': 'tour',
+}
+
+
+def populate_popularity(apps, schema_editor):
+    """Fill the tables the same way myApp.popularity.rebuild() does."""
+    Booking = apps.get_model('myApp', 'Booking')
+    ItemPopularity = apps.get_model('myApp', 'ItemPopularity')
+    DailyItemPopularity = apps.get_model('myApp', 'DailyItemPopularity')
+
+    totals, daily = [], []
+    for category, item in RELATIONS.items():
+        rows = getattr(Booking, category).through.objects.values(item=F(f'{item}_id'))
+        for row in rows.order_by().annotate(count=Count('id')):
+            totals.append(ItemPopularity(category=category, item_id=row['item'], bookings=row['count']))
+        per_day = rows.annotate(day=TruncDate('booking__created_at')).values('item', 'day')
+        for row in per_day.order_by().annotate(count=Count('id')):
+            daily.append(DailyItemPopularity(
+                category=category, item_id=row['item'], date=row['day'], bookings=row['count'],
+            ))
+    ItemPopularity.objects.bulk_create(totals, batch_size=1000)
+    DailyItemPopularity.objects.bulk_create(daily, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myApp', '0030_timeseries_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyItemPopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('activities', 'Activities'), ('packages', 'Packages'), ('rooms', 'Rooms'), ('tours', 'Tours')], max_length=20)),
+                ('item_id', models.PositiveIntegerField()),
+                ('date', models.DateField()),
+                ('bookings', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', 'date', 'item_id', 'bookings'], name='popularity_window_idx')],
+                'constraints': [models.UniqueConstraint(fields=('category', 'item_id', 'date'), name='unique_popularity_item_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ItemPopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(choices=[('activities', 'Activities'), ('packages', 'Packages'), ('rooms', 'Rooms'), ('tours', 'Tours')], max_length=20)),
+                ('item_id', models.PositiveIntegerField()),
+                ('bookings', models.IntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['category', '-bookings'], name='popularity_top_idx')],
+                'constraints': [models.UniqueConstraint(fields=('category', 'item_id'), name='unique_popularity_item')],
+            },
+        ),
+        migrations.RunPython(populate_popularity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myApp', '0032_changelog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyRollupDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+            ],
+        ),
+    ]
@@ -1,7 +1,11 @@
 from django.db import models
+from django.db.models import ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.fields.json import KeyTextTransform, KeyTransform
+from django.db.models.functions import Cast, Coalesce, Greatest, NullIf
 from django.utils import timezone
 from django.contrib.auth.models import User
 from decimal import Decimal
+import copy
 
 # Create your models here.
 
@@ -54,15 +58,10 @@ class RoomType(models.Model):
     available = models.BooleanField(default=True)
 
     def available_rooms(self):
-        """Calculate how many rooms are free right now."""
+        """Calculate how many rooms are free tonight."""
+        from .inventory import rooms_free
         today = timezone.now().date()
-        # Count all bookings that overlap today
-        booked = RoomBooking.objects.filter(
-            room_type=self,
-            check_in__lte=today,
-            check_out__gte=today
-        ).count()
-        return self.total_rooms - booked
+        return rooms_free(self, today, today)
 
     def __str__(self):
         return f"{self.name} - {self.capacity} - {self.price_per_night}" #({self.available_rooms()} available)
@@ -93,10 +92,39 @@ class RoomBooking(models.Model):
         """Check if this booking overlaps a given date range."""
         return not (check_out <= self.check_in or check_in >= self.check_out)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored stay so the inventory handlers can move it on edit
+        instance._loaded_stay = instance.stay_snapshot()
+        return instance
+
+    def stay_snapshot(self):
+        return (self.__dict__.get('room_type_id'), self.__dict__.get('check_in'), self.__dict__.get('check_out'))
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_stay = self.stay_snapshot()
+
     def __str__(self):
         return f"{self.customer_name} - {self.room_type.name} - ({self.check_in} - {self.check_out})"
 
 
+class RoomInventory(models.Model):
+    """Number of rooms of a type booked on one night; maintained by myApp.inventory."""
+    room_type = models.ForeignKey(RoomType, on_delete=models.CASCADE, related_name='inventory')
+    date = models.DateField()
+    booked = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room_type', 'date'], name='unique_room_type_night'),
+        ]
+
+    def __str__(self):
+        return f"{self.room_type.name} - {self.date} - {self.booked} booked"
+
+
 class Food(models.Model):
     name = models.CharField(max_length=100)
     price_per_person = models.DecimalField(max_digits=10, decimal_places=2)
@@ -177,7 +205,117 @@ class Tour(models.Model):
 #     def __str__(self):
 #         return f"Booking #{self.id} - {self.customer_name or self.user.username} - {self.check_in} - {self.amount_required} - {self.pax}"
 
+class DaysBetween(models.Func):
+    """Whole days from the second date expression to the first."""
+    arg_joiner = ' - '
+    template = '(%(expressions)s)'
+    output_field = models.IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(',
+            **extra_context
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='DATEDIFF(%(expressions)s)', arg_joiner=', ', **extra_context
+        )
+
+
+# (through-table item field, price lookup, pax_details category) per subtotal
+BOOKING_PRICE_SOURCES = {
+    'rooms_total': ('rooms', 'room__room_type__price_per_night', 'rooms'),
+    'activities_total': ('activities', 'activity__price_per_person', 'activities'),
+    'packages_total': ('packages', 'package__price_per_person', 'packages'),
+    'food_total': ('food', 'food__price_per_person', 'food'),
+    'tours_total': ('tours', 'tour__price_per_person', 'tours'),
+}
+
+
+def booking_price_expressions():
+    """
+    SQL expressions matching Booking.calculate_totals(), keyed by TOTAL_FIELDS.
+    Each subtotal is a correlated Subquery over the M2M through table, so they
+    can be used in annotate() as well as update().
+    """
+    money = models.DecimalField(max_digits=12, decimal_places=2)
+    base_pax = Coalesce(NullIf(F('pax'), Value(0)), Value(1))
+    nights = Greatest(Coalesce(DaysBetween('check_out', 'check_in'), Value(1)), Value(1))
+
+    expressions = {}
+    for field, (relation, price, category) in BOOKING_PRICE_SOURCES.items():
+        through = getattr(Booking, relation).through
+        price_sum = (
+            through.objects.filter(booking=OuterRef('pk'))
+            .order_by()
+            .values('booking')
+            .annotate(total=Sum(price))
+            .values('total')
+        )
+        pax = Coalesce(
+            Cast(KeyTextTransform('pax', KeyTransform(category, 'pax_details')), models.IntegerField()),
+            base_pax,
+        )
+        subtotal = Coalesce(Subquery(price_sum, output_field=money), Value(Decimal('0')), output_field=money) * pax
+        if field == 'rooms_total':
+            subtotal = subtotal * nights
+        expressions[field] = ExpressionWrapper(subtotal, output_field=money)
+
+    subtotals = list(expressions.values())
+    total = subtotals[0]
+    for subtotal in subtotals[1:]:
+        total = total + subtotal
+    expressions['total_amount'] = ExpressionWrapper(total, output_field=money)
+    return expressions
+
+
+class BookingQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Annotate each booking with priced_<subtotal>, priced_total and
+        priced_balance, computed entirely in the database.
+        """
+        expressions = booking_price_expressions()
+        total = expressions.pop('total_amount')
+        return self.annotate(
+            **{f"priced_{field.removesuffix('_total')}": expr for field, expr in expressions.items()},
+            priced_total=total,
+        ).annotate(
+            priced_balance=ExpressionWrapper(
+                F('priced_total') - F('paid'),
+                output_field=models.DecimalField(max_digits=12, decimal_places=2),
+            )
+        )
+
+    def refresh_totals(self, batch_size=2000):
+        """
+        Recalculate and store the pricing columns for every booking in the queryset,
+        one UPDATE per batch of ids, and log them in the ChangeLog. Returns the
+        number of bookings updated.
+        """
+        ids = list(self.order_by('pk').values_list('pk', flat=True).distinct())
+        expressions = booking_price_expressions()
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            updated += Booking.objects.filter(pk__in=batch).update(**expressions)
+            ChangeLog.record(Booking, batch)
+        return updated
+
+
 class Booking(models.Model):
+    # Fields that feed into the price; changing any of them reprices the booking
+    PRICING_FIELDS = ('check_in', 'check_out', 'pax', 'pax_details')
+    # Stored pricing columns, maintained by the handlers in signals.py
+    TOTAL_FIELDS = (
+        'rooms_total', 'activities_total', 'packages_total',
+        'food_total', 'tours_total', 'total_amount',
+    )
+
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     customer_name = models.CharField(max_length=100, blank=True, null=True)
     customer_email = models.EmailField(blank=True, null=True)
@@ -195,9 +333,52 @@ class Booking(models.Model):
     # New field to store pax details for each selection
     pax_details = models.JSONField(blank=True, null=True)  # Works with Django 3.1+
 
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     paid = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    # Per-category subtotals and the overall total (see calculate_totals)
+    rooms_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    activities_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    packages_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    food_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    tours_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, db_index=True)
+
+    objects = BookingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Covers the check-in time series (timeseries.py): bucket, guests and revenue
+            models.Index(fields=['check_in', 'pax', 'total_amount'], name='booking_check_in_totals_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the pricing inputs so post_save can tell whether they changed
+        instance._loaded_pricing = instance.pricing_snapshot()
+        return instance
+
+    def pricing_snapshot(self):
+        # Deep copy so in-place edits to pax_details still register as a change
+        return copy.deepcopy({
+            name: self.__dict__.get(name) for name in self.PRICING_FIELDS
+        })
+
+    def pricing_changed(self):
+        loaded = getattr(self, '_loaded_pricing', None)
+        return loaded is None or loaded != self.pricing_snapshot()
+
+    def stored_stay(self):
+        """(check_in, check_out) as last saved to or loaded from the database."""
+        loaded = getattr(self, '_loaded_pricing', None) or self.pricing_snapshot()
+        return loaded['check_in'], loaded['check_out']
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # post_save handlers have compared against the old values; remember the new ones
+        self._loaded_pricing = self.pricing_snapshot()
+
     @property
     def nights_spent(self):
         if self.check_in and self.check_out:
@@ -205,12 +386,12 @@ class Booking(models.Model):
             return nights if nights > 0 else 1  # Minimum of 1 night for same-day bookings
         return 1
 
-    @property
-    def amount_required(self):
+    def calculate_totals(self):
         """
-        Dynamically calculate total cost:
+        Price the booking from its current selections:
         - Rooms: price × pax × nights
         - Activities/Packages/Food/Tours: price × pax
+        Returns a dict keyed by TOTAL_FIELDS.
         """
         pax = self.pax or 1
 
@@ -220,24 +401,40 @@ class Booking(models.Model):
                 return self.pax_details[category].get('pax', pax)
             return pax
 
-        room_cost = sum(
-            room.room_type.price_per_night * get_pax_value('rooms') * self.nights_spent
-            for room in self.rooms.all()
-        )
-        activity_cost = sum(
-            a.price_per_person * get_pax_value('activities') for a in self.activities.all()
-        )
-        package_cost = sum(
-            p.price_per_person * get_pax_value('packages') for p in self.packages.all()
-        )
-        food_cost = sum(
-            f.price_per_person * get_pax_value('food') for f in self.food.all()
-        )
-        tour_cost = sum(
-            t.price_per_person * get_pax_value('tours') for t in self.tours.all()
-        )
+        totals = {
+            'rooms_total': sum(
+                (room.room_type.price_per_night * get_pax_value('rooms') * self.nights_spent
+                 for room in self.rooms.all()),
+                Decimal('0'),
+            ),
+            'activities_total': sum(
+                (a.price_per_person * get_pax_value('activities') for a in self.activities.all()),
+                Decimal('0'),
+            ),
+            'packages_total': sum(
+                (p.price_per_person * get_pax_value('packages') for p in self.packages.all()),
+                Decimal('0'),
+            ),
+            'food_total': sum(
+                (f.price_per_person * get_pax_value('food') for f in self.food.all()),
+                Decimal('0'),
+            ),
+            'tours_total': sum(
+                (t.price_per_person * get_pax_value('tours') for t in self.tours.all()),
+                Decimal('0'),
+            ),
+        }
+        totals['total_amount'] = sum(totals.values(), Decimal('0'))
+        return totals
 
-        return room_cost + activity_cost + package_cost + food_cost + tour_cost
+    @property
+    def amount_required(self):
+        """
+        Total cost of the booking. Querysets built with with_totals() carry a
+        priced_total computed in SQL; otherwise the stored total_amount is used.
+        Use calculate_totals() to price the current selections from scratch.
+        """
+        return getattr(self, 'priced_total', self.total_amount)
 
     @property
     def balance(self):
@@ -258,6 +455,20 @@ class Booking(models.Model):
     def __str__(self):
         return f"Booking #{self.id} - {self.display_customer} - {self.check_in} - {self.amount_required} - {self.pax}"
 
+class NotificationQuerySet(models.QuerySet):
+    def mark_read(self):
+        """
+        Mark the unread notifications in the queryset read with one UPDATE and
+        return how many changed. Signals do not fire, so the caller clears
+        the cached unread counts (stats.invalidate_unread); the change log
+        is written here.
+        """
+        ids = list(self.filter(is_read=False).values_list('pk', flat=True))
+        updated = Notification.objects.filter(pk__in=ids, is_read=False).update(is_read=True)
+        ChangeLog.record(Notification, ids)
+        return updated
+
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = [
         ('booking', 'Booking'),
@@ -269,10 +480,38 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    objects = NotificationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset reads of one user's notifications after a given id (socket replay)
+            models.Index(fields=['user', 'id'], name='notification_user_id_idx'),
+            # A user's inbox and unread count
+            models.Index(fields=['user', 'is_read', 'created_at'], name='notification_inbox_idx'),
+            # The staff view of every notification, newest first (pagination.newest_first)
+            models.Index(fields=['created_at', 'id'], name='notification_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.message} ({'Read' if self.is_read else 'Unread'})"
 
 
+class NotificationArchive(models.Model):
+    """
+    Read notifications moved out of the live table by retention.prune_notifications,
+    keeping their original id.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_notifications')
+    message = models.CharField(max_length=255)
+    type = models.CharField(max_length=50, choices=Notification.NOTIFICATION_TYPES, default='booking')
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.message} (Archived)"
+
+
 class SystemSetting(models.Model):
     site_name = models.CharField(max_length=100, default="EpicTrail Adventures")
     support_email = models.EmailField(default="support@epictrail.co.ke")
@@ -281,6 +520,8 @@ class SystemSetting(models.Model):
     enable_stripe = models.BooleanField(default=False)  # Toggle Stripe payments
     max_daily_bookings = models.PositiveIntegerField(default=100)  # Limit per day
     discount_rate = models.DecimalField(max_digits=5, decimal_places=2, default=0)  # Global discount %
+    notification_retention_days = models.PositiveIntegerField(default=90)  # Read notifications older than this are pruned
+    archive_notifications = models.BooleanField(default=True)  # Move pruned notifications to the archive instead of deleting
 
     def __str__(self):
         return "System Settings"
@@ -298,7 +539,13 @@ class FoodOrder(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     check_in = models.DateField(blank=True, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Covers the check-in time series (timeseries.py) up to the join to the food price
+            models.Index(fields=['check_in', 'food', 'quantity'], name='foodorder_check_in_idx'),
+        ]
 
     def total_price(self):
         return self.food.price_per_person * self.quantity
@@ -306,6 +553,104 @@ class FoodOrder(models.Model):
     def __str__(self):
         return f"{self.food.name} x{self.quantity} by {self.user.username}"
 
+class DailyRevenueRollup(models.Model):
+    """
+    Bookings, guests and revenue per day and category, kept current by
+    rollups.py so the analytics page reads a few rows per day instead of
+    every booking and order.
+
+    The "bookings" category covers every booking (revenue is total_amount);
+    each booking category counts the bookings with a non-zero subtotal for
+    it; "food_orders" counts orders, with quantity as pax.
+    """
+    CATEGORY_CHOICES = [
+        ('bookings', 'All Bookings'),
+        ('rooms', 'Rooms'),
+        ('activities', 'Activities'),
+        ('packages', 'Packages'),
+        ('food', 'Food'),
+        ('tours', 'Tours'),
+        ('food_orders', 'Food Orders'),
+    ]
+
+    date = models.DateField()
+    category = models.CharField(max_length=20, choices=CATEGORY_CHOICES)
+    bookings = models.PositiveIntegerField(default=0)
+    pax = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'category'], name='unique_rollup_day_category'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.category} - KSh {self.revenue}"
+
+
+class DirtyRollupDay(models.Model):
+    """
+    A day whose DailyRevenueRollup rows are out of date. Written in the same
+    transaction as the change, and cleared in the one that recomputes the
+    day, so a recompute that fails is picked up by the next (see rollups.py).
+    """
+    date = models.DateField(unique=True)
+
+    def __str__(self):
+        return f"{self.date} (dirty)"
+
+
+class ItemPopularity(models.Model):
+    """
+    Number of bookings that include a catalog item, kept current by
+    popularity.py from the Booking selection signals. `item_id` is the pk of
+    the Activity, Package, Room or Tour named by `category`.
+    """
+    CATEGORY_CHOICES = [
+        ('activities', 'Activities'),
+        ('packages', 'Packages'),
+        ('rooms', 'Rooms'),
+        ('tours', 'Tours'),
+    ]
+
+    category = models.CharField(max_length=20, choices=CATEGORY_CHOICES)
+    item_id = models.PositiveIntegerField()
+    bookings = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'item_id'], name='unique_popularity_item'),
+        ]
+        indexes = [
+            # Top-N lists: the first rows of one category, most booked first
+            models.Index(fields=['category', '-bookings'], name='popularity_top_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.category} #{self.item_id} - {self.bookings} bookings"
+
+class DailyItemPopularity(models.Model):
+    """
+    ItemPopularity split by the day the bookings were made, for top-N lists
+    over a rolling window of recent days.
+    """
+    category = models.CharField(max_length=20, choices=ItemPopularity.CATEGORY_CHOICES)
+    item_id = models.PositiveIntegerField()
+    date = models.DateField()
+    bookings = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'item_id', 'date'], name='unique_popularity_item_day'),
+        ]
+        indexes = [
+            # Covers the rolling-window sums: one category's recent days
+            models.Index(fields=['category', 'date', 'item_id', 'bookings'], name='popularity_window_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.category} #{self.item_id} - {self.bookings} bookings"
+
 class Duty(models.Model):
     staff = models.ForeignKey(User, on_delete=models.CASCADE, limit_choices_to={'is_staff': True})
     title = models.CharField(max_length=100)
@@ -315,4 +660,71 @@ class Duty(models.Model):
     completed = models.BooleanField(default=False)
 
     def __str__(self):
-        return f"{self.title} → {self.staff.username}"
\ No newline at end of file
+        return f"{self.title} → {self.staff.username}"
+
+
+class ChangeLog(models.Model):
+    """
+    A saved or deleted row of one of the models changes.py tracks, one entry
+    per change. Ids only grow, so the latest id is a checkpoint that an
+    incremental backup exports the changes after (see backups.py).
+    """
+    model = models.CharField(max_length=100)  # app_label.model_name
+    object_id = models.BigIntegerField()
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def record(cls, model, pks):
+        """Log a change to each `model` row in `pks`, with one INSERT."""
+        label = model._meta.label_lower
+        cls.objects.bulk_create([cls(model=label, object_id=pk) for pk in pks])
+
+    def __str__(self):
+        return f"#{self.id} {self.model} {self.object_id}"
+
+
+class Job(models.Model):
+    """A unit of background work, run by `manage.py run_jobs` (see jobs.py)."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    task = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    priority = models.IntegerField(default=0, help_text="Higher runs first")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    progress = models.PositiveSmallIntegerField(default=0, help_text="Percent complete")
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-priority', 'run_after'], name='job_queue_idx'),
+        ]
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    def set_progress(self, percent):
+        """Record progress from inside a running task; written straight to the row."""
+        self.progress = max(0, min(100, int(percent)))
+        Job.objects.filter(pk=self.pk).update(progress=self.progress)
+
+    def __str__(self):
+        return f"Job #{self.id} {self.task} ({self.status})"
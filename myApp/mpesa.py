@@ -0,0 +1,46 @@
+"""
+M-Pesa STK push. Called from the `mpesa_stk_push` job (tasks.py) so the
+Safaricom round trips never hold up a request.
+"""
+import base64
+from datetime import datetime
+
+import requests
+from django.conf import settings
+
+TIMEOUT = 30  # seconds per Safaricom API call
+
+
+def initiate_stk_push(phone, amount, account_reference="EpicTrail Adventures", transaction_desc="Booking Payment"):
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    password = base64.b64encode(
+        f"{settings.MPESA_SHORTCODE}{settings.MPESA_PASSKEY}{timestamp}".encode('utf-8')
+    ).decode('utf-8')
+
+    # Get OAuth token
+    token_url = f"https://{settings.MPESA_ENVIRONMENT}.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
+    response = requests.get(token_url, auth=(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET), timeout=TIMEOUT)
+    response.raise_for_status()
+    access_token = response.json()['access_token']
+
+    # STK Push URL
+    stk_url = f"https://{settings.MPESA_ENVIRONMENT}.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
+    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+
+    payload = {
+        "BusinessShortCode": settings.MPESA_SHORTCODE,
+        "Password": password,
+        "Timestamp": timestamp,
+        "TransactionType": "CustomerPayBillOnline",
+        "Amount": amount,
+        "PartyA": phone,
+        "PartyB": settings.MPESA_SHORTCODE,
+        "PhoneNumber": phone,
+        "CallBackURL": settings.CALLBACK_URL,
+        "AccountReference": account_reference,
+        "TransactionDesc": transaction_desc,
+    }
+
+    res = requests.post(stk_url, json=payload, headers=headers, timeout=TIMEOUT)
+    res.raise_for_status()
+    return res.json()
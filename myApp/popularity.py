@@ -0,0 +1,148 @@
+"""
+Catalog item popularity.
+
+ItemPopularity counts the bookings that include each activity, package, room
+and tour; DailyItemPopularity splits the same counts by the day the booking
+was made, so top-N lists can also cover the last 7, 30 or 90 days. The signal
+handlers in signals.py adjust both inside the same transaction as the
+selection change, the way inventory.py keeps its ledger, so reading a top-N
+list is one indexed query instead of a COUNT over a whole through table.
+rebuild() recomputes both tables from the through tables.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import Activity, Booking, DailyItemPopularity, ItemPopularity, Package, Room, Tour
+from .rollups import local_day
+
+# Category (the Booking relation name) -> catalog model
+CATEGORIES = {
+    'activities': Activity,
+    'packages': Package,
+    'rooms': Room,
+    'tours': Tour,
+}
+# Rolling windows offered by top(), in days
+WINDOWS = (7, 30, 90)
+
+
+def through_model(category):
+    return getattr(Booking, category).through
+
+
+def item_field(category):
+    """Name of the catalog item's foreign key on the through table, e.g. 'activity'."""
+    return CATEGORIES[category]._meta.model_name
+
+
+def selection_counts(category, **filters):
+    """Counter of (item id, booking day) -> selections, over the through rows matching `filters`."""
+    rows = through_model(category).objects.filter(**filters).values_list(
+        f'{item_field(category)}_id', 'booking__created_at',
+    )
+    return Counter((item, local_day(created_at)) for item, created_at in rows)
+
+
+def grouped(counts):
+    """{n: [keys with count n]}, so each distinct count costs one UPDATE."""
+    groups = defaultdict(list)
+    for key, n in counts.items():
+        groups[n].append(key)
+    return groups
+
+
+def adjust(category, counts, sign=1):
+    """Add (sign=1) or remove (sign=-1) `counts` bookings, keyed by (item id, booking day)."""
+    counts = {key: n for key, n in counts.items() if n}
+    if not counts:
+        return
+    totals = Counter()
+    for (item, _), n in counts.items():
+        totals[item] += n
+    daily = {(item, day): n for (item, day), n in counts.items() if day is not None}
+
+    with transaction.atomic():
+        ItemPopularity.objects.bulk_create(
+            [ItemPopularity(category=category, item_id=item) for item in totals], ignore_conflicts=True,
+        )
+        for n, items in grouped(totals).items():
+            ItemPopularity.objects.filter(category=category, item_id__in=items).update(
+                bookings=F('bookings') + sign * n,
+            )
+        DailyItemPopularity.objects.bulk_create(
+            [DailyItemPopularity(category=category, item_id=item, date=day) for item, day in daily],
+            ignore_conflicts=True,
+        )
+        by_day = defaultdict(Counter)
+        for (item, day), n in daily.items():
+            by_day[day][item] = n
+        for day, day_counts in by_day.items():
+            for n, items in grouped(day_counts).items():
+                DailyItemPopularity.objects.filter(category=category, date=day, item_id__in=items).update(
+                    bookings=F('bookings') + sign * n,
+                )
+
+
+def forget(category, item_id):
+    """Drop the counters of a deleted catalog item."""
+    ItemPopularity.objects.filter(category=category, item_id=item_id).delete()
+    DailyItemPopularity.objects.filter(category=category, item_id=item_id).delete()
+
+
+def top(category, n=5, window=None):
+    """
+    The `n` most booked items of `category`, each with a `num_bookings`
+    attribute, counting all bookings or only those made in the last `window`
+    days. Items nobody has booked are left out.
+    """
+    if window is None:
+        ranked = (
+            ItemPopularity.objects.filter(category=category, bookings__gt=0)
+            .order_by('-bookings', 'item_id').values_list('item_id', 'bookings')
+        )
+    else:
+        since = timezone.localdate() - timedelta(days=window - 1)
+        ranked = (
+            DailyItemPopularity.objects.filter(category=category, date__gte=since)
+            .values('item_id').order_by().annotate(total=Sum('bookings')).filter(total__gt=0)
+            .order_by('-total', 'item_id').values_list('item_id', 'total')
+        )
+    ranked = list(ranked[:n])
+    items = CATEGORIES[category].objects.in_bulk([item for item, _ in ranked])
+    found = []
+    for item, count in ranked:
+        if item in items:
+            items[item].num_bookings = count
+            found.append(items[item])
+    return found
+
+
+def with_popularity(queryset, category):
+    """`queryset` annotated with num_bookings from the all-time counters, 0 if never booked."""
+    bookings = ItemPopularity.objects.filter(category=category, item_id=OuterRef('pk')).values('bookings')
+    return queryset.annotate(num_bookings=Coalesce(Subquery(bookings), Value(0), output_field=IntegerField()))
+
+
+def rebuild(batch_size=1000):
+    """Recompute both tables from the through tables. Returns the number of daily rows."""
+    totals, daily = [], []
+    for category in CATEGORIES:
+        rows = through_model(category).objects.values(item=F(f'{item_field(category)}_id'))
+        for row in rows.order_by().annotate(count=Count('id')):
+            totals.append(ItemPopularity(category=category, item_id=row['item'], bookings=row['count']))
+        per_day = rows.annotate(day=TruncDate('booking__created_at')).values('item', 'day')
+        for row in per_day.order_by().annotate(count=Count('id')):
+            daily.append(DailyItemPopularity(
+                category=category, item_id=row['item'], date=row['day'], bookings=row['count'],
+            ))
+    with transaction.atomic():
+        ItemPopularity.objects.all().delete()
+        DailyItemPopularity.objects.all().delete()
+        ItemPopularity.objects.bulk_create(totals, batch_size=batch_size)
+        DailyItemPopularity.objects.bulk_create(daily, batch_size=batch_size)
+    return len(daily)
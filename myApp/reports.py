@@ -0,0 +1,295 @@
+"""
+CSV and PDF analytics exports.
+
+The CSV report is produced row by row by csv_rows(), which reads bookings and
+food orders in chunks, so export_report_csv can stream any amount of history
+in constant memory. The PDF report is built by the `export_report` job
+(tasks.py) rather than inside the request, reading rows the same way and
+summarising the bookings as it lists them (analytics.BookingSummary).
+
+Built reports are stored once per (parameters, report data version) under a
+name derived from both (artifact_key), so asking again for a report whose
+data has not changed serves the stored file instead of building it again.
+"""
+import csv
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Q
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from .jobs import files_dir
+from .models import Booking, FoodOrder
+from .rollups import day_range
+from . import analytics, stats
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'pdf': 'application/pdf',
+}
+# Sections of the CSV report, selectable with ?category=
+EXPORT_CATEGORIES = ('bookings', 'food_orders')
+CSV_CHUNK_SIZE = 2000  # rows fetched per query and written per streamed chunk
+
+
+ARTIFACT_MAX_AGE = 7 * 24 * 3600  # seconds a superseded report file is kept
+
+
+def export_filename(export_format):
+    return f"EpicTrail-Report_{datetime.now().strftime('%Y%m%d')}.{export_format}"
+
+
+def artifact_key(export_format, **params):
+    """Name for the report built from `params` against the current report data."""
+    spec = {'format': export_format, 'params': params, 'version': stats.report_data_version()}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+
+def artifact_name(key, export_format):
+    return f"report-{key}.{export_format}"
+
+
+def artifact_path(key, export_format):
+    """Where the report `key` is stored (in the private job files directory)."""
+    return os.path.join(files_dir(), artifact_name(key, export_format))
+
+
+def prune_artifacts(max_age=ARTIFACT_MAX_AGE):
+    """Delete stored reports not written for `max_age` seconds; returns how many."""
+    cutoff = time.time() - max_age
+    removed = 0
+    with os.scandir(files_dir()) as entries:
+        for entry in entries:
+            if entry.name.startswith('report-') and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+    return removed
+
+
+def orders_with_total():
+    return FoodOrder.objects.select_related('food', 'user').annotate(
+        order_total=ExpressionWrapper(
+            F("food__price_per_person") * F("quantity"),
+            output_field=DecimalField()
+        )
+    )
+
+
+def report_progress(progress, done, total):
+    if progress is not None and total:
+        progress(100 * done // total)
+
+
+def created_between(start=None, end=None):
+    """Q for rows created on local days from `start` to `end`, both inclusive and optional."""
+    q = Q()
+    if start:
+        q &= Q(created_at__gte=day_range(start)[0])
+    if end:
+        q &= Q(created_at__lt=day_range(end)[1])
+    return q
+
+
+def csv_rows(start=None, end=None, categories=EXPORT_CATEGORIES, chunk_size=CSV_CHUNK_SIZE, progress=None):
+    """
+    Yield the rows of the bookings and food orders report, optionally limited
+    to rows created between `start` and `end` and to some `categories`.
+    Rows are read as plain tuples `chunk_size` at a time, using the stored
+    booking totals, so memory use does not grow with the size of the report.
+    """
+    created = created_between(start, end)
+    bookings = (
+        Booking.objects.filter(created).order_by('created_at', 'pk')
+        .values_list('customer_name', 'user__username', 'created_at', 'pax', 'total_amount')
+    )
+    orders = (
+        orders_with_total().filter(created).order_by('created_at', 'pk')
+        .values_list('user__username', 'created_at', 'food__name', 'quantity', 'order_total')
+    )
+    total_rows = done = 0
+    if progress is not None:
+        total_rows = (
+            (bookings.count() if 'bookings' in categories else 0)
+            + (orders.count() if 'food_orders' in categories else 0)
+        )
+
+    if 'bookings' in categories:
+        # --- Bookings Report ---
+        yield ["--- BOOKINGS REPORT ---"]
+        yield ["Customer", "Booking Date", "Guests", "Revenue (KSh)"]
+        bookings_total = 0
+        for customer_name, username, created_at, pax, amount in bookings.iterator(chunk_size=chunk_size):
+            revenue = round(amount, 2)
+            bookings_total += revenue
+            yield [customer_name or username or "Anonymous", created_at.strftime('%Y-%m-%d'), pax, revenue]
+            done += 1
+            if done % 500 == 0:
+                report_progress(progress, done, total_rows)
+        yield ["", "", "Total Bookings Revenue", bookings_total]
+        yield []
+
+    if 'food_orders' in categories:
+        # --- Food Orders Report ---
+        yield ["--- FOOD ORDERS REPORT ---"]
+        yield ["Customer", "Order Date", "Food Item", "Quantity", "Revenue (KSh)"]
+        food_total = 0
+        for username, created_at, food_name, quantity, order_total in orders.iterator(chunk_size=chunk_size):
+            revenue = round(order_total, 2)
+            food_total += revenue
+            yield [username or "Guest", created_at.strftime('%Y-%m-%d'), food_name, quantity, revenue]
+            done += 1
+            if done % 500 == 0:
+                report_progress(progress, done, total_rows)
+        yield ["", "", "", "Total Food Revenue", food_total]
+
+
+def write_csv(out, progress=None, **filters):
+    """Write the bookings and food orders report as CSV to the text file `out`."""
+    csv.writer(out).writerows(csv_rows(progress=progress, **filters))
+
+
+class Echo:
+    """A file whose write() hands back what it was given, so csv.writer returns each line."""
+
+    def write(self, value):
+        return value
+
+
+def csv_chunks(rows, chunk_size=CSV_CHUNK_SIZE):
+    """Encode the CSV lines for `rows` as UTF-8 chunks of `chunk_size` lines, for streaming responses."""
+    writer = csv.writer(Echo())
+    lines = []
+    for row in rows:
+        lines.append(writer.writerow(row))
+        if len(lines) >= chunk_size:
+            yield ''.join(lines).encode()
+            lines = []
+    if lines:
+        yield ''.join(lines).encode()
+
+
+def write_pdf(out, progress=None):
+    """
+    Write the bookings and food orders report as a PDF to the binary file
+    `out`, ending with a summary gathered while the bookings are listed.
+    Rows are read as plain tuples in chunks, as for the CSV report.
+    """
+    bookings = analytics.booking_rows(
+        Booking.objects.order_by('created_at', 'pk'), 'customer_name', 'user__username', 'created_at',
+    )
+    orders = (
+        orders_with_total().order_by('created_at', 'pk')
+        .values_list('user__username', 'created_at', 'food__name', 'order_total')
+    )
+    total_rows = bookings.count() + orders.count()
+    done = 0
+    summary = analytics.BookingSummary()
+
+    p = canvas.Canvas(out, pagesize=A4)
+    width, height = A4
+
+    # Title
+    p.setFont("Helvetica-Bold", 18)
+    p.drawString(50, height - 50, "EpicTrail Adventures - Analytics Report")
+    p.setFont("Helvetica", 10)
+    p.drawString(50, height - 70, f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
+
+    # --- Bookings Section ---
+    y = height - 110
+    p.setFont("Helvetica-Bold", 14)
+    p.drawString(50, y, "Bookings Report")
+    y -= 30
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(50, y, "Customer")
+    p.drawString(200, y, "Booking Date")
+    p.drawString(350, y, "Revenue (KSh)")
+    p.setFont("Helvetica", 10)
+
+    for customer_name, username, created_at, month, pax, total, *category_totals in bookings.iterator(
+        chunk_size=CSV_CHUNK_SIZE,
+    ):
+        summary.add(month, pax, total, *category_totals)
+        y -= 20
+        if y < 80:
+            p.showPage()
+            y = height - 50
+        p.drawString(50, y, customer_name or username or "Anonymous")
+        p.drawString(200, y, created_at.strftime('%Y-%m-%d'))
+        p.drawString(350, y, f"KSh {round(total, 2):,.2f}")
+        done += 1
+        if done % 200 == 0:
+            report_progress(progress, done, total_rows)
+
+    y -= 30
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(50, y, f"Total Bookings Revenue: KSh {summary.revenue:,.2f}")
+
+    # --- Food Orders Section ---
+    y -= 60
+    p.setFont("Helvetica-Bold", 14)
+    p.drawString(50, y, "Food Orders Report")
+    y -= 30
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(50, y, "Customer")
+    p.drawString(200, y, "Order Date")
+    p.drawString(300, y, "Food Item")
+    p.drawString(450, y, "Revenue (KSh)")
+    p.setFont("Helvetica", 10)
+
+    food_total = 0
+    for username, created_at, food_name, order_total in orders.iterator(chunk_size=CSV_CHUNK_SIZE):
+        y -= 20
+        if y < 80:
+            p.showPage()
+            y = height - 50
+        revenue = round(order_total, 2)
+        food_total += revenue
+        p.drawString(50, y, username or "Guest")
+        p.drawString(200, y, created_at.strftime('%Y-%m-%d'))
+        p.drawString(300, y, food_name)
+        p.drawString(450, y, f"KSh {revenue:,.2f}")
+        done += 1
+        if done % 200 == 0:
+            report_progress(progress, done, total_rows)
+
+    y -= 30
+    p.setFont("Helvetica-Bold", 12)
+    p.drawString(50, y, f"Total Food Revenue: KSh {food_total:,.2f}")
+
+    # --- Summary Section ---
+    p.showPage()
+    y = height - 50
+    p.setFont("Helvetica-Bold", 14)
+    p.drawString(50, y, "Bookings Summary")
+    p.setFont("Helvetica", 10)
+    lines = [
+        f"Bookings: {summary.bookings:,}",
+        f"Guests: {summary.guests:,}",
+        f"Revenue: KSh {summary.revenue:,.2f}",
+        "",
+        *(f"{category.title()} revenue: KSh {amount:,.2f}" for category, amount in summary.category_revenue.items()),
+        "",
+        "Party size: bookings",
+        *(f"{pax} guest{'s' if pax != 1 else ''}: {count:,}" for pax, count in sorted(summary.pax_distribution.items())),
+        "",
+        "Month: bookings, guests, revenue",
+        *(
+            f"{month:%b %Y}: {count:,}, {guests:,}, KSh {revenue:,.2f}"
+            for month, (count, guests, revenue) in sorted(summary.monthly.items())
+        ),
+    ]
+    y -= 10
+    for line in lines:
+        y -= 15
+        if y < 80:
+            p.showPage()
+            p.setFont("Helvetica", 10)
+            y = height - 50
+        p.drawString(50, y, line)
+
+    p.showPage()
+    p.save()
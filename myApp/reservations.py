@@ -0,0 +1,132 @@
+"""
+Overbooking-safe reservations.
+
+Every view that creates or changes a booking goes through this module. A
+reservation runs in one transaction: the booking and its rooms are written
+(the inventory handlers in signals.py bump RoomInventory as they go), then the
+nights the booking occupies are checked against each room type's capacity and
+the whole transaction is rolled back if any of them is over.
+
+Because the ledger rows are incremented before they are checked, concurrent
+reservations for the same room type serialise on those rows (row locks, or
+SQLite's single writer) and the later one always sees the earlier one's
+rooms. A reservation that is full fails straight away with RoomUnavailable;
+lock contention is retried a few times with backoff and then surfaces as
+ReservationBusy rather than waiting indefinitely.
+"""
+import copy
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.models import F
+
+from .models import Booking, RoomBooking, RoomInventory
+from . import inventory
+
+RETRY_ATTEMPTS = getattr(settings, 'RESERVATION_RETRY_ATTEMPTS', 5)
+RETRY_BACKOFF = getattr(settings, 'RESERVATION_RETRY_BACKOFF', 0.05)  # seconds, doubled per attempt
+
+BOOKING_RELATIONS = ('rooms', 'activities', 'packages', 'food', 'tours')
+
+
+class RoomUnavailable(Exception):
+    """A room type has no capacity left on at least one night of the stay."""
+
+    def __init__(self, room_type):
+        self.room_type = room_type
+        super().__init__(f"{room_type.name} is fully booked for the selected dates.")
+
+
+class ReservationBusy(Exception):
+    """The reservation could not get the database lock within the retry budget."""
+
+
+def is_lock_error(exc):
+    message = str(exc).lower()
+    return 'locked' in message or 'deadlock' in message or 'could not serialize' in message
+
+
+def run_reservation(reserve):
+    """Run reserve() in a transaction, retrying it when the database is locked."""
+    for attempt in range(RETRY_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return reserve()
+        except OperationalError as exc:
+            if not is_lock_error(exc):
+                raise
+            if attempt == RETRY_ATTEMPTS - 1:
+                raise ReservationBusy("The booking system is busy, please try again.") from exc
+            time.sleep(RETRY_BACKOFF * (2 ** attempt) * (1 + random.random()))
+
+
+def check_capacity(room_type_ids, check_in, check_out):
+    """Raise RoomUnavailable if any of the room types is over capacity during the stay."""
+    nights = inventory.stay_nights(check_in, check_out)
+    if not nights or not room_type_ids:
+        return
+    over = (
+        RoomInventory.objects
+        .filter(room_type_id__in=room_type_ids, date__gte=nights[0], date__lte=nights[-1])
+        .filter(booked__gt=F('room_type__total_rooms'))
+        .select_related('room_type')
+        .first()
+    )
+    if over is not None:
+        raise RoomUnavailable(over.room_type)
+
+
+def set_relations(booking, selections):
+    for relation in BOOKING_RELATIONS:
+        if relation in selections:
+            getattr(booking, relation).set(selections[relation])
+
+
+def create_booking(selections=None, **fields):
+    """
+    Create a Booking from `fields` with the M2M ids in `selections`
+    (keys from BOOKING_RELATIONS), refusing it if any room type is full.
+    """
+    selections = selections or {}
+
+    def reserve():
+        booking = Booking.objects.create(**fields)
+        set_relations(booking, selections)
+        check_capacity(inventory.booking_room_counts(booking.pk), booking.check_in, booking.check_out)
+        return booking
+
+    return run_reservation(reserve)
+
+
+def update_booking(booking, selections=None, **fields):
+    """Apply `fields` and `selections` to an existing booking under the same guarantees."""
+    selections = selections or {}
+    # save() moves _loaded_pricing to the new values even if the attempt is
+    # then rolled back, so each attempt starts again from the booking as it was
+    # loaded; otherwise a retried date change would leave the ledger behind
+    original = copy.deepcopy({name: booking.__dict__.get(name) for name in fields})
+    loaded_pricing = copy.deepcopy(getattr(booking, '_loaded_pricing', None))
+
+    def reserve():
+        booking.__dict__.update(copy.deepcopy(original))
+        booking._loaded_pricing = copy.deepcopy(loaded_pricing)
+        for name, value in fields.items():
+            setattr(booking, name, value)
+        booking.save()
+        set_relations(booking, selections)
+        check_capacity(inventory.booking_room_counts(booking.pk), booking.check_in, booking.check_out)
+        return booking
+
+    return run_reservation(reserve)
+
+
+def book_room_type(room_type, **fields):
+    """Create a RoomBooking for one room of `room_type`, refusing it if the type is full."""
+    def reserve():
+        room_booking = RoomBooking.objects.create(room_type=room_type, **fields)
+        check_capacity([room_type.pk], room_booking.check_in, room_booking.check_out)
+        return room_booking
+
+    return run_reservation(reserve)
@@ -0,0 +1,77 @@
+"""
+Notification retention.
+
+Every booking and registration leaves one notification per staff user, so the
+table grows with bookings × staff. prune_notifications() moves read
+notifications older than SystemSetting.notification_retention_days into
+NotificationArchive, or deletes them if archiving is off. Unread notifications
+are never touched.
+
+The work is done in batches of `batch_size` rows, oldest first, each in its
+own short transaction. A long prune never holds the write lock for more than
+one batch, and it can be stopped and rerun at any point.
+"""
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChangeLog, Notification, NotificationArchive, SystemSetting
+
+DEFAULT_RETENTION_DAYS = 90
+
+
+def retention_policy():
+    """(retention days, archive?) from the SystemSetting row, or the defaults without one."""
+    setting = SystemSetting.objects.only('notification_retention_days', 'archive_notifications').first()
+    if setting is None:
+        return DEFAULT_RETENTION_DAYS, True
+    return setting.notification_retention_days, setting.archive_notifications
+
+
+def prune_notifications(days=None, archive=None, batch_size=1000, pause=0, progress=None):
+    """
+    Archive or delete read notifications created more than `days` days ago.
+    Arguments left as None come from retention_policy(). `pause` seconds are
+    slept between batches to leave room for other writers. Returns the number
+    of notifications removed from the live table.
+    """
+    policy_days, policy_archive = retention_policy()
+    days = policy_days if days is None else days
+    archive = policy_archive if archive is None else archive
+    cutoff = timezone.now() - timedelta(days=days)
+
+    expired = (
+        Notification.objects.filter(is_read=True, created_at__lt=cutoff)
+        .order_by('created_at', 'id')
+    )
+    total = expired.count() if progress is not None else None
+    removed = 0
+    while True:
+        with transaction.atomic():
+            batch = list(expired.values('id', 'user_id', 'message', 'type', 'created_at')[:batch_size])
+            if not batch:
+                break
+            ids = [row['id'] for row in batch]
+            if archive:
+                NotificationArchive.objects.bulk_create(
+                    [NotificationArchive(**row) for row in batch], ignore_conflicts=True,
+                )
+                ChangeLog.record(NotificationArchive, ids)
+            # QuerySet.delete() would send the delete signals row by row. That
+            # is safe to skip here: nothing has a foreign key to Notification,
+            # so there is nothing to cascade, and the only receivers log the row
+            # to the change log (done below for the whole batch) and invalidate
+            # the unread count (read rows never change it). _raw_delete() then
+            # removes the batch in one statement.
+            ChangeLog.record(Notification, ids)
+            Notification.objects.filter(pk__in=ids)._raw_delete(Notification.objects.db)
+        removed += len(batch)
+        if total:
+            progress(min(100, 100 * removed // total))
+        if len(batch) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return removed
@@ -0,0 +1,171 @@
+"""
+Daily revenue rollup.
+
+DailyRevenueRollup holds one row per (day, category) with the number of
+bookings, guests and revenue for that day, so reports read a few rows per day
+instead of every booking and food order. Days are in the current time zone.
+
+The signal handlers in signals.py call mark_dirty() with the days a change
+touches, which records them as DirtyRollupDay rows in the same transaction.
+Once it commits, each dirty day is recomputed from its bookings and orders,
+so any number of changes to one day in a transaction cost one recompute.
+The rows outlive a recompute that fails (say, on a locked database): the
+next flush, from any thread or process, picks those days up again.
+rebuild() recomputes the whole table.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import stats
+from .models import Booking, DailyRevenueRollup, DirtyRollupDay, FoodOrder
+
+ALL_BOOKINGS = 'bookings'
+FOOD_ORDERS = 'food_orders'
+# Rollup category -> the Booking subtotal it sums
+BOOKING_CATEGORIES = {
+    'rooms': 'rooms_total',
+    'activities': 'activities_total',
+    'packages': 'packages_total',
+    'food': 'food_total',
+    'tours': 'tours_total',
+}
+
+def local_day(moment):
+    return timezone.localtime(moment).date() if moment else None
+
+
+def day_range(day):
+    """Aware datetimes bounding `day` in the current time zone."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def on_days(days, field='created_at'):
+    """Q matching rows whose `field` falls on any of `days`, as index-friendly ranges."""
+    q = Q()
+    for day in days:
+        start, end = day_range(day)
+        q |= Q(**{f'{field}__gte': start, f'{field}__lt': end})
+    return q
+
+
+def touched_days(queryset, field='created_at'):
+    """The distinct local days `field` falls on in `queryset`, from one query."""
+    return {moment.date() for moment in queryset.datetimes(field, 'day')}
+
+
+def compute(days=None):
+    """Unsaved rollup rows for `days`, or for all history when days is None."""
+    bookings = Booking.objects.all()
+    orders = FoodOrder.objects.all()
+    if days is not None:
+        if not days:
+            return []
+        bookings = bookings.filter(on_days(days))
+        orders = orders.filter(on_days(days))
+
+    per_category = {}
+    for category, field in BOOKING_CATEGORIES.items():
+        used = Q(**{f'{field}__gt': 0})
+        per_category[f'{category}_bookings'] = Count('id', filter=used)
+        per_category[f'{category}_pax'] = Sum('pax', filter=used)
+        per_category[f'{category}_revenue'] = Sum(field)
+    booking_days = (
+        bookings.annotate(day=TruncDate('created_at')).values('day').order_by('day')
+        .annotate(count=Count('id'), guests=Sum('pax'), revenue=Sum('total_amount'), **per_category)
+    )
+
+    rows = []
+    for totals in booking_days:
+        rows.append(DailyRevenueRollup(
+            date=totals['day'], category=ALL_BOOKINGS,
+            bookings=totals['count'], pax=totals['guests'] or 0, revenue=totals['revenue'] or 0,
+        ))
+        for category in BOOKING_CATEGORIES:
+            if totals[f'{category}_bookings']:
+                rows.append(DailyRevenueRollup(
+                    date=totals['day'], category=category,
+                    bookings=totals[f'{category}_bookings'],
+                    pax=totals[f'{category}_pax'] or 0,
+                    revenue=totals[f'{category}_revenue'] or 0,
+                ))
+
+    order_days = (
+        orders.annotate(day=TruncDate('created_at')).values('day').order_by('day')
+        .annotate(
+            count=Count('id'),
+            guests=Sum('quantity'),
+            revenue=Sum(ExpressionWrapper(F('food__price_per_person') * F('quantity'), output_field=DecimalField())),
+        )
+    )
+    for totals in order_days:
+        rows.append(DailyRevenueRollup(
+            date=totals['day'], category=FOOD_ORDERS,
+            bookings=totals['count'], pax=totals['guests'] or 0, revenue=totals['revenue'] or 0,
+        ))
+    return rows
+
+
+def refresh(days, chunk_size=100):
+    """Recompute the rollup rows for `days`, `chunk_size` days per query."""
+    days = sorted(set(days))
+    for start in range(0, len(days), chunk_size):
+        chunk = days[start:start + chunk_size]
+        with transaction.atomic():
+            # Delete first: the write lock makes a concurrent refresh of the same day wait,
+            # and a day marked dirty again after this commits stays marked
+            DirtyRollupDay.objects.filter(date__in=chunk).delete()
+            DailyRevenueRollup.objects.filter(date__in=chunk).delete()
+            DailyRevenueRollup.objects.bulk_create(compute(chunk))
+    # Report caches read before the refresh finished hold the old rows
+    stats.bump_report_data_version()
+
+
+def mark_dirty(days):
+    """Recompute `days` once the current transaction commits."""
+    days = {day for day in days if day is not None}
+    if not days:
+        return
+    DirtyRollupDay.objects.bulk_create([DirtyRollupDay(date=day) for day in days], ignore_conflicts=True)
+    # Every call registers a flush; later ones find nothing left to do. A failed
+    # flush is logged rather than raised, since the change itself has already
+    # committed, and its days stay marked for the next one.
+    transaction.on_commit(flush, robust=True)
+
+
+def flush():
+    """Recompute every day marked dirty, including those an earlier flush failed on."""
+    days = list(DirtyRollupDay.objects.values_list('date', flat=True))
+    if days:
+        refresh(days)
+
+
+def rebuild(batch_size=1000):
+    """Recompute the whole table from Booking and FoodOrder rows. Returns the row count."""
+    rows = compute()
+    with transaction.atomic():
+        DirtyRollupDay.objects.all().delete()
+        DailyRevenueRollup.objects.all().delete()
+        DailyRevenueRollup.objects.bulk_create(rows, batch_size=batch_size)
+    stats.bump_report_data_version()
+    return len(rows)
+
+
+def totals(rows=None):
+    """{category: {'bookings', 'pax', 'revenue'}} summed over `rows` (default: all of them)."""
+    rows = DailyRevenueRollup.objects.all() if rows is None else rows
+    summed = {
+        category: {'bookings': 0, 'pax': 0, 'revenue': 0}
+        for category, _ in DailyRevenueRollup.CATEGORY_CHOICES
+    }
+    for entry in rows.values('category').order_by('category').annotate(
+        bookings_sum=Sum('bookings'), pax_sum=Sum('pax'), revenue_sum=Sum('revenue'),
+    ):
+        summed[entry['category']] = {
+            'bookings': entry['bookings_sum'], 'pax': entry['pax_sum'], 'revenue': entry['revenue_sum'],
+        }
+    return summed
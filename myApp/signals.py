@@ -1,47 +1,477 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Booking, Notification
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from .models import Booking, Notification, Activity, Package, Room, RoomType, Food, FoodOrder, Tour, RoomBooking, ChangeLog
+from . import changes, inventory, jobs, popularity, rollups, stats
+from .tasks import push_notifications
+
 
 @receiver(post_save, sender=Booking)
-def notify_booking(sender, instance, created, **kwargs):
-    if created:
-        # Notify booking user
-        Notification.objects.create(
-            user=instance.user,
-            message=f"Your booking #{instance.id} has been created.",
-            type='booking'
-        )
-        # Notify all staff/admins
-        admins = User.objects.filter(is_staff=True)
-        for admin in admins:
-            Notification.objects.create(
-                user=admin,
-                message=f"New booking #{instance.id} by {instance.user.username}",
+def notify_booking(sender, instance, created, raw=False, **kwargs):
+    # Bookings loaded from a backup or fixture were notified about when first made
+    if created and not raw:
+        # Notify booking user (guest bookings have no account to notify)
+        if instance.user:
+            notification = Notification.objects.create(
+                user=instance.user,
+                message=f"Your booking #{instance.id} has been created.",
                 type='booking'
             )
-        # Push to WebSocket group
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            "notifications",
-            {"type": "send_notification", "message": f"New booking #{instance.id}"}
+            push_notifications([notification])
+        # Notify all staff/admins, and push to their sockets, from the job queue
+        jobs.enqueue('notify_staff', message=f"New booking #{instance.id} by {instance.display_customer}", type='booking')
+
+@receiver(post_save, sender=User)
+def notify_registration(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        jobs.enqueue('notify_staff', message=f"New user registered: {instance.username}", type='registration')
+
+
+# --- Cached staff ids (see stats.staff_ids) ---
+
+@receiver(post_init, sender=User)
+def remember_staff_flag(sender, instance, **kwargs):
+    # Read from __dict__ so a deferred is_staff does not cost a query
+    instance._loaded_is_staff = instance.__dict__.get('is_staff')
+
+
+@receiver(post_save, sender=User)
+def invalidate_staff_ids_on_save(sender, instance, created, **kwargs):
+    changed = instance.is_staff if created else instance.is_staff != instance._loaded_is_staff
+    if changed:
+        stats.invalidate(stats.STAFF_IDS)
+    instance._loaded_is_staff = instance.is_staff
+
+
+@receiver(post_delete, sender=User)
+def invalidate_staff_ids_on_delete(sender, instance, **kwargs):
+    if instance.__dict__.get('is_staff', True):
+        stats.invalidate(stats.STAFF_IDS)
+
+
+# --- Cached unread notification counts (see stats.unread_counts) ---
+# Bulk inserts and updates skip these, so notify_staff and mark_read callers
+# invalidate for themselves.
+
+@receiver(post_save, sender=Notification)
+def invalidate_unread_on_save(sender, instance, **kwargs):
+    stats.invalidate_unread(instance.user_id)
+
+
+@receiver(post_delete, sender=Notification)
+def invalidate_unread_on_delete(sender, instance, **kwargs):
+    if not instance.is_read:
+        stats.invalidate_unread(instance.user_id)
+
+
+# --- Stored booking totals ---
+# Booking.total_amount and the per-category subtotals are recalculated only when
+# something that feeds into the price changes.
+
+def reprice_bookings(bookings, instance=None):
+    """Refresh stored totals, copying the new values onto `instance` if given."""
+    bookings.refresh_totals()
+    user_ids = bookings.exclude(user=None).values_list('user_id', flat=True).distinct()
+    stats.invalidate(stats.TOTAL_REVENUE, *(stats.user_total_key(pk) for pk in user_ids))
+    if instance is not None:
+        instance.refresh_from_db(fields=Booking.TOTAL_FIELDS)
+        rollups.mark_dirty([rollups.local_day(instance.created_at)])
+    else:
+        rollups.mark_dirty(rollups.touched_days(bookings))
+
+
+@receiver(post_save, sender=Booking)
+def reprice_booking_on_save(sender, instance, created, **kwargs):
+    # A new booking has no selections yet; m2m_changed prices it once they are set
+    if not created and instance.pricing_changed():
+        reprice_bookings(Booking.objects.filter(pk=instance.pk), instance)
+
+
+def reprice_booking_selections(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            reprice_bookings(Booking.objects.filter(pk=instance.pk), instance)
+        return
+
+    # Reverse side, e.g. activity.booking_set.add(...): pk_set holds booking ids
+    if action == 'pre_clear':
+        instance._repriced_booking_ids = list(
+            sender.objects.filter(**{type(instance)._meta.model_name: instance})
+            .values_list('booking_id', flat=True)
         )
+    elif action in ('post_add', 'post_remove'):
+        reprice_bookings(Booking.objects.filter(pk__in=pk_set))
+    elif action == 'post_clear':
+        reprice_bookings(Booking.objects.filter(pk__in=instance._repriced_booking_ids))
+
+
+for relation in ('rooms', 'activities', 'packages', 'food', 'tours'):
+    m2m_changed.connect(
+        reprice_booking_selections,
+        sender=getattr(Booking, relation).through,
+        dispatch_uid=f"reprice_booking_{relation}",
+    )
+
+
+# Catalog items whose price (or room type) changes reprice every booking using them
+CATALOG_BOOKING_LOOKUPS = {
+    RoomType: 'rooms__room_type',
+    Room: 'rooms',
+    Activity: 'activities',
+    Package: 'packages',
+    Food: 'food',
+    Tour: 'tours',
+}
+
+
+def bookings_using(instance):
+    lookup = CATALOG_BOOKING_LOOKUPS[type(instance)]
+    return Booking.objects.filter(**{lookup: instance}).distinct()
+
+
+# The fields of each catalog model that feed into booking prices
+CATALOG_PRICING_FIELDS = {
+    RoomType: ('price_per_night',),
+    Room: ('room_type_id',),
+    Activity: ('price_per_person',),
+    Package: ('price_per_person',),
+    Food: ('price_per_person',),
+    Tour: ('price_per_person',),
+}
+
+
+def catalog_pricing(instance):
+    # Read from __dict__ so deferred fields do not cost a query
+    return tuple(instance.__dict__.get(name) for name in CATALOG_PRICING_FIELDS[type(instance)])
+
+
+def remember_catalog_pricing(sender, instance, **kwargs):
+    instance._loaded_pricing = catalog_pricing(instance)
+
+
+def reprice_bookings_on_catalog_save(sender, instance, created, **kwargs):
+    # Renames and other edits leave booking prices alone; repricing every
+    # booking that uses the item is left to the job queue
+    if not created and catalog_pricing(instance) != instance._loaded_pricing:
+        jobs.enqueue('reprice_catalog_item', model=sender._meta.label_lower, pk=instance.pk)
+    instance._loaded_pricing = catalog_pricing(instance)
+
+
+def remember_bookings_on_catalog_delete(sender, instance, **kwargs):
+    # The M2M rows are gone by post_delete, so collect the affected ids first
+    instance._repriced_booking_ids = list(bookings_using(instance).values_list('pk', flat=True))
+
+
+def reprice_bookings_on_catalog_delete(sender, instance, **kwargs):
+    reprice_bookings(Booking.objects.filter(pk__in=instance._repriced_booking_ids))
+
+
+# Connected per model rather than for every sender: a receiver without a
+# sender would stop Django from fast-deleting any model, the derived tables
+# and the change log included.
+for model in CATALOG_BOOKING_LOOKUPS:
+    label = model._meta.model_name
+    post_init.connect(remember_catalog_pricing, sender=model, dispatch_uid=f"reprice_{label}_init")
+    post_save.connect(reprice_bookings_on_catalog_save, sender=model, dispatch_uid=f"reprice_{label}_save")
+    pre_delete.connect(remember_bookings_on_catalog_delete, sender=model, dispatch_uid=f"reprice_{label}_pre_delete")
+    post_delete.connect(reprice_bookings_on_catalog_delete, sender=model, dispatch_uid=f"reprice_{label}_delete")
+
+
+# --- Cached counters (see stats.py) ---
+
+def booking_stat_keys(booking):
+    keys = [stats.TOTAL_BOOKINGS, stats.TOTAL_REVENUE]
+    if booking.user_id:
+        keys.append(stats.user_total_key(booking.user_id))
+    return keys
+
+
+# Price changes are covered by reprice_bookings; only the row count moves here
+@receiver(post_save, sender=Booking)
+def invalidate_stats_on_booking_create(sender, instance, created, **kwargs):
+    if created:
+        stats.invalidate(*booking_stat_keys(instance))
+
+
+@receiver(post_delete, sender=Booking)
+def invalidate_stats_on_booking_delete(sender, instance, **kwargs):
+    stats.invalidate(*booking_stat_keys(instance))
+
 
 @receiver(post_save, sender=User)
-def notify_registration(sender, instance, created, **kwargs):
+def invalidate_stats_on_user_create(sender, instance, created, **kwargs):
     if created:
-        admins = User.objects.filter(is_staff=True)
-        for admin in admins:
-            Notification.objects.create(
-                user=admin,
-                message=f"New user registered: {instance.username}",
-                type='registration'
+        stats.invalidate(stats.TOTAL_USERS)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_stats_on_user_delete(sender, instance, **kwargs):
+    stats.invalidate(stats.TOTAL_USERS)
+
+
+# --- Room inventory ledger (see inventory.py) ---
+
+def booking_rooms_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # room.booking_set changes: instance is a Room, pk_set holds booking ids
+        if action == 'pre_clear':
+            pk_set = set(sender.objects.filter(room=instance).values_list('booking_id', flat=True))
+        elif action == 'pre_remove':
+            # remove() passes on ids that were never added; release only the linked ones
+            pk_set = set(
+                sender.objects.filter(room=instance, booking_id__in=pk_set).values_list('booking_id', flat=True)
             )
-        # WebSocket push
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            "notifications",
-            {"type": "send_notification", "message": f"New user registered: {instance.username}"}
+        elif action != 'post_add':
+            return
+        sign = 1 if action == 'post_add' else -1
+        for check_in, check_out in Booking.objects.filter(pk__in=pk_set).values_list('check_in', 'check_out'):
+            inventory.adjust({instance.room_type_id: 1}, check_in, check_out, sign)
+        return
+
+    # The ledger follows the stay as stored; post_save moves it if the dates change
+    check_in, check_out = instance.stored_stay()
+    if action == 'post_add':
+        inventory.adjust(inventory.room_type_counts(pk_set), check_in, check_out)
+    elif action == 'pre_remove':
+        linked = sender.objects.filter(booking=instance, room_id__in=pk_set).values_list('room_id', flat=True)
+        inventory.adjust(inventory.room_type_counts(linked), check_in, check_out, -1)
+    elif action == 'pre_clear':
+        inventory.adjust(inventory.booking_room_counts(instance.pk), check_in, check_out, -1)
+
+
+m2m_changed.connect(booking_rooms_changed, sender=Booking.rooms.through, dispatch_uid='inventory_booking_rooms')
+
+
+@receiver(post_save, sender=Booking)
+def move_booking_inventory(sender, instance, created, **kwargs):
+    old_stay = instance.stored_stay()
+    new_stay = (instance.check_in, instance.check_out)
+    if created or inventory.stay_nights(*old_stay) == inventory.stay_nights(*new_stay):
+        return
+    counts = inventory.booking_room_counts(instance.pk)
+    inventory.adjust(counts, *old_stay, sign=-1)
+    inventory.adjust(counts, *new_stay)
+
+
+@receiver(pre_delete, sender=Booking)
+def release_booking_inventory(sender, instance, **kwargs):
+    inventory.adjust(inventory.booking_room_counts(instance.pk), *instance.stored_stay(), sign=-1)
+
+
+def move_room_nights(room, room_type_id, sign):
+    """Add (sign=1) or remove (sign=-1) the nights booked in `room` under `room_type_id`."""
+    for check_in, check_out in Booking.objects.filter(rooms=room).values_list('check_in', 'check_out'):
+        inventory.adjust({room_type_id: 1}, check_in, check_out, sign)
+
+
+@receiver(post_init, sender=Room)
+def remember_room_type(sender, instance, **kwargs):
+    instance._loaded_room_type_id = instance.__dict__.get('room_type_id')
+
+
+@receiver(post_save, sender=Room)
+def move_room_inventory(sender, instance, created, **kwargs):
+    # A room moved to another type takes its booked nights along
+    old_type = instance._loaded_room_type_id
+    if not created and old_type is not None and old_type != instance.room_type_id:
+        move_room_nights(instance, old_type, -1)
+        move_room_nights(instance, instance.room_type_id, 1)
+    instance._loaded_room_type_id = instance.room_type_id
+
+
+@receiver(pre_delete, sender=Room)
+def release_room_inventory(sender, instance, **kwargs):
+    # Its Booking.rooms rows are cascade-deleted without m2m_changed
+    move_room_nights(instance, instance._loaded_room_type_id or instance.room_type_id, -1)
+
+
+@receiver(post_save, sender=RoomBooking)
+def move_room_booking_inventory(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_stay', None)
+    if not created and loaded is not None:
+        old_type, old_in, old_out = loaded
+        unchanged = (
+            old_type == instance.room_type_id
+            and inventory.stay_nights(old_in, old_out) == inventory.stay_nights(instance.check_in, instance.check_out)
         )
+        if unchanged:
+            return
+        inventory.adjust({old_type: 1}, old_in, old_out, -1)
+    inventory.adjust({instance.room_type_id: 1}, instance.check_in, instance.check_out)
+
+
+@receiver(post_delete, sender=RoomBooking)
+def release_room_booking_inventory(sender, instance, **kwargs):
+    room_type, check_in, check_out = getattr(instance, '_loaded_stay', None) or instance.stay_snapshot()
+    inventory.adjust({room_type: 1}, check_in, check_out, -1)
+
+
+# --- Booking data version (see stats.booking_data_version) ---
+
+VERSIONED_MODELS = (Booking, RoomBooking, Room, RoomType)
+
+
+def bump_booking_data_version(sender, **kwargs):
+    stats.bump_booking_data_version()
+
+
+for model in VERSIONED_MODELS:
+    for signal in (post_save, post_delete):
+        signal.connect(bump_booking_data_version, sender=model, dispatch_uid=f"booking_data_version_{model._meta.model_name}")
+
+
+def bump_booking_data_version_on_rooms(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        stats.bump_booking_data_version()
+
+
+m2m_changed.connect(
+    bump_booking_data_version_on_rooms, sender=Booking.rooms.through, dispatch_uid='booking_data_version_rooms'
+)
+
+
+# --- Report data version (see stats.report_data_version) ---
+
+REPORTED_MODELS = (Booking, FoodOrder, Food, Activity, Package, Tour, Room, RoomType)
+
+
+def bump_report_data_version(sender, **kwargs):
+    stats.bump_report_data_version()
+
+
+for model in REPORTED_MODELS:
+    for signal in (post_save, post_delete):
+        signal.connect(bump_report_data_version, sender=model, dispatch_uid=f"report_data_version_{model._meta.model_name}")
+
+
+def bump_report_data_version_on_selections(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        stats.bump_report_data_version()
+
+
+for relation in ('rooms', 'activities', 'packages', 'food', 'tours'):
+    m2m_changed.connect(
+        bump_report_data_version_on_selections,
+        sender=getattr(Booking, relation).through,
+        dispatch_uid=f"report_data_version_{relation}",
+    )
+
+
+# --- Daily revenue rollup (see rollups.py) ---
+# Price changes reach it through reprice_bookings; these cover rows coming and going.
+
+@receiver(post_save, sender=Booking)
+def mark_rollup_day_on_booking_create(sender, instance, created, **kwargs):
+    if created:
+        rollups.mark_dirty([rollups.local_day(instance.created_at)])
+
+
+@receiver(post_delete, sender=Booking)
+@receiver(post_save, sender=FoodOrder)
+@receiver(post_delete, sender=FoodOrder)
+def mark_rollup_day(sender, instance, **kwargs):
+    rollups.mark_dirty([rollups.local_day(instance.created_at)])
+
+
+@receiver(post_save, sender=Food)
+def mark_rollup_days_on_food_price(sender, instance, created, **kwargs):
+    # Food order revenue is priced live, so a price change moves every day with an order
+    if not created:
+        rollups.mark_dirty(rollups.touched_days(FoodOrder.objects.filter(food=instance)))
+
+
+# --- Catalog item popularity (see popularity.py) ---
+
+SELECTION_CATEGORIES = {popularity.through_model(category): category for category in popularity.CATEGORIES}
+
+
+def count_booking_selections(sender, instance, action, reverse, pk_set, **kwargs):
+    category = SELECTION_CATEGORIES[sender]
+    item = popularity.item_field(category)
+    # The through rows the change covers; on the reverse side pk_set holds booking ids
+    owner = {item: instance} if reverse else {'booking': instance}
+    others = 'booking_id__in' if reverse else f'{item}_id__in'
+    if action == 'post_add' and not reverse:
+        day = rollups.local_day(instance.created_at)
+        popularity.adjust(category, {(pk, day): 1 for pk in pk_set})
+    elif action == 'post_add':
+        popularity.adjust(category, popularity.selection_counts(category, **owner, **{others: pk_set}))
+    elif action == 'pre_remove':
+        # Read from the rows themselves: remove() passes on ids that were never added
+        popularity.adjust(category, popularity.selection_counts(category, **owner, **{others: pk_set}), -1)
+    elif action == 'pre_clear':
+        popularity.adjust(category, popularity.selection_counts(category, **owner), -1)
+
+
+for through in SELECTION_CATEGORIES:
+    m2m_changed.connect(
+        count_booking_selections, sender=through, dispatch_uid=f"popularity_{SELECTION_CATEGORIES[through]}",
+    )
+
+
+@receiver(pre_delete, sender=Booking)
+def uncount_booking_selections(sender, instance, **kwargs):
+    # The through rows are deleted without m2m_changed
+    for category in popularity.CATEGORIES:
+        popularity.adjust(category, popularity.selection_counts(category, booking=instance), -1)
+
+
+CATALOG_CATEGORIES = {model: category for category, model in popularity.CATEGORIES.items()}
+
+
+def forget_popularity_on_catalog_delete(sender, instance, **kwargs):
+    popularity.forget(CATALOG_CATEGORIES[sender], instance.pk)
+
+
+for model, category in CATALOG_CATEGORIES.items():
+    post_delete.connect(forget_popularity_on_catalog_delete, sender=model, dispatch_uid=f"popularity_forget_{category}")
+
+
+# --- Change log for incremental backups (see changes.py) ---
+
+def record_change_on_save(sender, instance, raw=False, **kwargs):
+    # Rows loaded from a backup are already in it
+    if not raw:
+        ChangeLog.record(sender, [instance.pk])
+
+
+def record_change_on_delete(sender, instance, **kwargs):
+    ChangeLog.record(sender, [instance.pk])
+
+
+for model in changes.TRACKED_MODELS:
+    post_save.connect(record_change_on_save, sender=model, dispatch_uid=f"change_log_{model._meta.label_lower}_save")
+    post_delete.connect(record_change_on_delete, sender=model, dispatch_uid=f"change_log_{model._meta.label_lower}_delete")
+
+
+# Through table -> the many-to-many field; its rows are backed up with the owning model
+TRACKED_RELATIONS = {
+    field.remote_field.through: field
+    for model in changes.TRACKED_MODELS for field in model._meta.many_to_many
+}
+
+
+def record_change_on_relation(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            ChangeLog.record(type(instance), [instance.pk])
+        return
+
+    # Reverse side, e.g. activity.booking_set.add(...): pk_set holds the owners' ids
+    field = TRACKED_RELATIONS[sender]
+    if action == 'pre_clear':
+        instance._changed_owner_ids = list(
+            sender.objects.filter(**{field.m2m_reverse_field_name(): instance})
+            .values_list(f'{field.m2m_field_name()}_id', flat=True)
+        )
+    elif action in ('post_add', 'post_remove'):
+        ChangeLog.record(model, pk_set)
+    elif action == 'post_clear':
+        ChangeLog.record(model, instance._changed_owner_ids)
+
+
+for through, field in TRACKED_RELATIONS.items():
+    m2m_changed.connect(
+        record_change_on_relation, sender=through,
+        dispatch_uid=f"change_log_{field.model._meta.label_lower}_{field.name}",
+    )
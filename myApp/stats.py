@@ -0,0 +1,189 @@
+"""
+Cached counters used by the template context processors and notification
+pushes.
+
+Values are kept in two tiers: a per-process dict with a short TTL in front of
+the "shared" cache, which every worker process can see. The signal handlers in
+signals.py call invalidate() when the underlying rows change; the TTLs bound
+how stale a value can get if an invalidation is ever missed.
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .models import Booking, Notification
+
+SHARED_CACHE = getattr(settings, 'STATS_CACHE_ALIAS', 'shared')
+SHARED_TTL = getattr(settings, 'STATS_SHARED_TTL', 300)  # seconds
+LOCAL_TTL = getattr(settings, 'STATS_LOCAL_TTL', 5)  # seconds
+LOCAL_MAX_ENTRIES = 1000
+
+TOTAL_USERS = 'stats:total_users'
+TOTAL_BOOKINGS = 'stats:total_bookings'
+TOTAL_REVENUE = 'stats:total_revenue'
+BOOKING_DATA_VERSION = 'stats:booking_data_version'
+REPORT_DATA_VERSION = 'stats:report_data_version'
+STAFF_IDS = 'stats:staff_ids'
+
+_missing = object()
+_local = {}
+
+
+def user_total_key(user_id):
+    return f'stats:user_total:{user_id}'
+
+
+def unread_key(user_id):
+    return f'stats:unread:{user_id}'
+
+
+def cached(key, compute):
+    """Return the value stored under `key`, calling compute() on a miss in both tiers."""
+    now = time.monotonic()
+    entry = _local.get(key)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+
+    shared = caches[SHARED_CACHE]
+    value = shared.get(key, _missing)
+    if value is _missing:
+        value = compute()
+        shared.set(key, value, SHARED_TTL)
+
+    if len(_local) >= LOCAL_MAX_ENTRIES:
+        _local.clear()
+    _local[key] = (now + LOCAL_TTL, value)
+    return value
+
+
+def invalidate(*keys):
+    """Drop `keys` from both tiers once the current transaction commits."""
+    def clear():
+        for key in keys:
+            _local.pop(key, None)
+        caches[SHARED_CACHE].delete_many(keys)
+
+    transaction.on_commit(clear)
+
+
+def staff_ids():
+    """
+    Ids of staff users, the recipients of staff notifications. A stale id
+    here would point a notification at a missing user, so the list skips the
+    local tier and is only cached once the transaction that read it commits.
+    """
+    shared = caches[SHARED_CACHE]
+    ids = shared.get(STAFF_IDS)
+    if ids is None:
+        ids = list(User.objects.filter(is_staff=True).order_by('pk').values_list('pk', flat=True))
+        transaction.on_commit(lambda: shared.set(STAFF_IDS, ids, SHARED_TTL))
+    return ids
+
+
+def unread_counts(user_ids):
+    """
+    Unread notification counts keyed by user id, with one grouped query for
+    whichever users are not cached. Like staff_ids() this skips the local tier,
+    so a badge never lags a mark-read made in another worker, and only caches
+    counts once the transaction that read them commits.
+    """
+    shared = caches[SHARED_CACHE]
+    keys = {unread_key(pk): pk for pk in user_ids}
+    counts = {keys[key]: count for key, count in shared.get_many(keys).items()}
+    missing = [pk for pk in keys.values() if pk not in counts]
+    if missing:
+        found = dict(
+            Notification.objects.filter(user_id__in=missing, is_read=False)
+            .values('user').annotate(count=Count('id')).values_list('user', 'count')
+        )
+        computed = {pk: found.get(pk, 0) for pk in missing}
+        transaction.on_commit(lambda: shared.set_many(
+            {unread_key(pk): count for pk, count in computed.items()}, SHARED_TTL
+        ))
+        counts.update(computed)
+    return counts
+
+
+def unread_count(user_id):
+    return unread_counts([user_id])[user_id]
+
+
+def invalidate_unread(*user_ids):
+    invalidate(*(unread_key(pk) for pk in user_ids))
+
+
+def data_version(key):
+    """
+    Token stored under `key` that changes whenever bump_data_version(key) is
+    called, for keying caches of derived data. Read from the shared tier only
+    so every worker sees a bump straight away.
+    """
+    shared = caches[SHARED_CACHE]
+    version = shared.get(key)
+    if version is None:
+        shared.add(key, uuid.uuid4().hex, None)
+        version = shared.get(key)
+    return version
+
+
+def bump_data_version(key):
+    """Give the data under `key` a new version once the current transaction commits."""
+    transaction.on_commit(lambda: caches[SHARED_CACHE].set(key, uuid.uuid4().hex, None))
+
+
+def booking_data_version():
+    """Version of bookings, rooms and room types (availability)."""
+    return data_version(BOOKING_DATA_VERSION)
+
+
+def bump_booking_data_version():
+    bump_data_version(BOOKING_DATA_VERSION)
+
+
+def report_data_version():
+    """Version of everything the analytics reports show: bookings, orders and catalog prices."""
+    return data_version(REPORT_DATA_VERSION)
+
+
+def bump_report_data_version():
+    bump_data_version(REPORT_DATA_VERSION)
+
+
+def clear_local():
+    _local.clear()
+
+
+def clear():
+    """Drop every cached value in both tiers once the current transaction commits, e.g. after a restore."""
+    def clear_all():
+        _local.clear()
+        caches[SHARED_CACHE].clear()
+
+    transaction.on_commit(clear_all)
+
+
+def total_users():
+    return cached(TOTAL_USERS, User.objects.count)
+
+
+def total_bookings():
+    return cached(TOTAL_BOOKINGS, Booking.objects.count)
+
+
+def total_revenue():
+    return cached(
+        TOTAL_REVENUE,
+        lambda: Booking.objects.aggregate(total=Sum('total_amount'))['total'] or 0,
+    )
+
+
+def user_total_amount(user_id):
+    return cached(
+        user_total_key(user_id),
+        lambda: Booking.objects.filter(user_id=user_id).aggregate(total=Sum('total_amount'))['total'] or 0,
+    )
@@ -0,0 +1,170 @@
+"""
+Background tasks run by the job queue (see jobs.py).
+
+Each task takes the running Job first and returns a JSON-serialisable result.
+Tasks that produce a file write it under jobs.files_dir() and return its
+name, which job_download serves to the user who asked for it.
+"""
+import os
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.apps import apps
+from django.db import transaction
+from django.utils import timezone
+
+from .consumers import user_group
+from .jobs import files_dir, task
+from .models import ChangeLog, Job, Notification
+from . import backups, changes, mpesa, reports, retention, stats
+
+
+def push_notifications(notifications):
+    """
+    Once the current transaction commits, push each notification to its
+    recipient's own group with their unread count; nobody else's sockets see it.
+    """
+    def send():
+        unread = stats.unread_counts({notification.user_id for notification in notifications})
+        messages = [
+            (user_group(notification.user_id), {
+                "type": "send_notification",
+                "id": notification.pk,
+                "message": notification.message,
+                "notification_type": notification.type,
+                "unread": unread.get(notification.user_id, 0),
+            })
+            for notification in notifications
+        ]
+        channel_layer = get_channel_layer()
+        if hasattr(channel_layer, 'group_send_many'):
+            async_to_sync(channel_layer.group_send_many)(messages)
+        else:
+            async_to_sync(group_send_each)(channel_layer, messages)
+
+    if notifications:
+        transaction.on_commit(send)
+
+
+async def group_send_each(channel_layer, messages):
+    for group, message in messages:
+        await channel_layer.group_send(group, message)
+
+
+def notify_staff(message, type):
+    """One INSERT for a notification to every staff user; returns the notifications."""
+    staff_ids = stats.staff_ids()
+    notifications = Notification.objects.bulk_create(
+        [Notification(user_id=pk, message=message, type=type) for pk in staff_ids]
+    )
+    ChangeLog.record(Notification, [notification.pk for notification in notifications])
+    stats.invalidate_unread(*staff_ids)
+    return notifications
+
+
+def file_result(path, filename, content_type):
+    return {'file': os.path.basename(path), 'filename': filename, 'content_type': content_type}
+
+
+@task('notify_staff', priority=10, eager=True)
+def notify_staff_task(job, message, type):
+    # The result is stored with the notifications, so a rerun of a job whose
+    # notifications were committed (its outcome never saved) sends nothing
+    if job.result is not None:
+        return job.result
+    with transaction.atomic():
+        notifications = notify_staff(message, type)
+        job.result = {'notified': len(notifications)}
+        Job.objects.filter(pk=job.pk).update(result=job.result)
+        push_notifications(notifications)
+    return job.result
+
+
+@task('reprice_catalog_item', priority=5)
+def reprice_catalog_item(job, model, pk):
+    """Reprice every booking using catalog item `pk` of `model` after a price change."""
+    from .signals import bookings_using, reprice_bookings
+
+    instance = apps.get_model(model)._default_manager.filter(pk=pk).first()
+    if instance is not None:  # a delete reprices for itself
+        with transaction.atomic():
+            reprice_bookings(bookings_using(instance))
+
+
+@task('export_report')
+def export_report(job, export_format, key=None):
+    """
+    Build a report. With `key` (reports.artifact_key) it is stored under that
+    name, and a report another job already stored there is reused.
+    """
+    content_type = reports.EXPORT_FORMATS[export_format]
+    filename = reports.export_filename(export_format)
+    if key is None:
+        path = os.path.join(files_dir(), f"report-{job.pk}.{export_format}")
+    else:
+        path = reports.artifact_path(key, export_format)
+        if os.path.exists(path):
+            return file_result(path, filename, content_type)
+
+    # Written under a temporary name, so a half-built file is never served
+    partial = f"{path}.{job.pk}.partial"
+    if export_format == 'csv':
+        with open(partial, 'w', newline='', encoding='utf-8') as out:
+            reports.write_csv(out, progress=job.set_progress)
+    else:
+        with open(partial, 'wb') as out:
+            reports.write_pdf(out, progress=job.set_progress)
+    os.replace(partial, path)
+    reports.prune_artifacts()
+    return file_result(path, filename, content_type)
+
+
+def last_full_backup_checkpoint():
+    """The checkpoint the most recent finished full backup job covers, if any."""
+    finished = (
+        Job.objects.filter(task='backup_data', status=Job.DONE).exclude(kwargs__has_key='since')
+        .order_by('-finished_at', '-pk')
+    )
+    result = finished.values_list('result', flat=True).first()
+    return result.get('checkpoint') if result else None
+
+
+@task('backup_data', max_attempts=1)
+def backup_data(job, kind='ndjson', compression='gzip', since=None):
+    """
+    Back up the database (see backups.py): JSON lines of every model, or of
+    the rows changed after checkpoint `since`, or for SQLite a binary
+    snapshot, compressed with `compression`. The result records the
+    checkpoint the next incremental backup starts from.
+    """
+    backups.check_options(kind, compression)
+    suffix = backups.file_suffix(kind, compression)
+    path = os.path.join(files_dir(), f"backup-{job.pk}{suffix}")
+    partial = f"{path}.partial"
+    checkpoint = changes.checkpoint()
+    if kind == 'sqlite':
+        backups.snapshot(partial, compression, progress=job.set_progress)
+    elif since is None:
+        backups.write_dump(partial, compression, progress=job.set_progress)
+    else:
+        _, checkpoint = backups.write_changes(partial, since, compression, progress=job.set_progress)
+    os.replace(partial, path)
+    # Every restore starts from a full backup, so the entries before the latest one are done with
+    full = checkpoint if since is None else last_full_backup_checkpoint()
+    if full:
+        changes.prune(full)
+    covered = 'full' if since is None else f'since{since}'
+    filename = f"backup_{timezone.localtime().strftime('%Y%m%d_%H%M%S')}_{covered}{suffix}"
+    return {**file_result(path, filename, backups.content_type(kind, compression)), 'checkpoint': checkpoint}
+
+
+@task('prune_notifications', max_attempts=1, priority=-10)
+def prune_notifications(job):
+    return {'removed': retention.prune_notifications(progress=job.set_progress)}
+
+
+# One attempt only: a push whose response was lost may still have prompted
+# the customer, and a retry would prompt them again
+@task('mpesa_stk_push', max_attempts=1, priority=20)
+def mpesa_stk_push(job, phone, amount, **kwargs):
+    return mpesa.initiate_stk_push(phone, amount, **kwargs)
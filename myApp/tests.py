@@ -1,3 +1,1310 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models.deletion import Collector
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import (
+    Activity, Booking, ChangeLog, DailyItemPopularity, DailyRevenueRollup, DirtyRollupDay, Food, FoodOrder,
+    ItemPopularity, Job, Notification, NotificationArchive, Package, Room, RoomBooking, RoomInventory, RoomType,
+    SystemSetting, Tour,
+)
+from . import analytics, backups, changes, inventory, jobs, popularity, reports, reservations, retention, rollups, stats, timeseries, views
+from .channel_layers import SQLiteChannelLayer
+from .consumers import NotificationConsumer, user_group
 
 # Create your tests here.
+
+class CatalogMixin:
+    """Creates one priced item per booking category."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='guest', password='pass12345')
+        self.room_type = RoomType.objects.create(
+            name='Double', capacity=2, price_per_night=Decimal('1000'), total_rooms=2
+        )
+        self.room = Room.objects.create(name='R1', room_type=self.room_type)
+        self.activity = Activity.objects.create(name='Archery', description='', price_per_person=Decimal('200'))
+        self.package = Package.objects.create(name='Combo', description='', price_per_person=Decimal('500'))
+        self.food = Food.objects.create(name='Lunch', price_per_person=Decimal('150'))
+        self.tour = Tour.objects.create(name='Falls', description='', price_per_person=Decimal('300'))
+
+    def make_booking(self, **kwargs):
+        fields = {
+            'user': self.user,
+            'check_in': date(2025, 1, 10),
+            'check_out': date(2025, 1, 12),
+            'pax': 2,
+        }
+        fields.update(kwargs)
+        booking = Booking.objects.create(**fields)
+        booking.rooms.set([self.room])
+        booking.activities.set([self.activity])
+        booking.packages.set([self.package])
+        booking.food.set([self.food])
+        booking.tours.set([self.tour])
+        return booking
+
+
+class BookingTotalsTests(CatalogMixin, TestCase):
+    def test_totals_follow_selections(self):
+        booking = self.make_booking()
+        # Rooms: 1000 × 2 pax × 2 nights, the rest price × 2 pax
+        self.assertEqual(booking.rooms_total, Decimal('4000'))
+        self.assertEqual(booking.total_amount, Decimal('6300'))
+        booking.tours.clear()
+        booking.refresh_from_db()
+        self.assertEqual(booking.total_amount, Decimal('5700'))
+
+    def test_pricing_fields_and_pax_details(self):
+        booking = self.make_booking()
+        booking = Booking.objects.get(pk=booking.pk)
+        booking.check_out = date(2025, 1, 11)
+        booking.pax_details = {'activities': {'ids': [self.activity.pk], 'pax': 5}}
+        booking.save()
+        booking.refresh_from_db()
+        self.assertEqual(booking.rooms_total, Decimal('2000'))
+        self.assertEqual(booking.activities_total, Decimal('1000'))
+        self.assertEqual(booking.total_amount, booking.calculate_totals()['total_amount'])
+
+    def test_catalog_price_change_reprices_bookings(self):
+        booking = self.make_booking()
+        self.room_type.price_per_night = Decimal('1500')
+        self.room_type.save()
+        jobs.work_off()
+        booking.refresh_from_db()
+        self.assertEqual(booking.rooms_total, Decimal('6000'))
+        # Edits that leave the price alone queue no reprice
+        self.room_type.name = 'Renamed'
+        self.room_type.save()
+        self.tour.description = 'Longer walk'
+        self.tour.save()
+        self.assertEqual(Job.objects.filter(task='reprice_catalog_item').count(), 1)
+        self.tour.delete()
+        booking.refresh_from_db()
+        self.assertEqual(booking.tours_total, Decimal('0'))
+
+    def test_rebuild_command(self):
+        booking = self.make_booking()
+        Booking.objects.filter(pk=booking.pk).update(total_amount=0)
+        call_command('rebuild_booking_totals', stdout=StringIO())
+        booking.refresh_from_db()
+        self.assertEqual(booking.total_amount, Decimal('6300'))
+
+
+class BookingPricingSQLTests(CatalogMixin, TestCase):
+    def test_with_totals_matches_python_pricing(self):
+        self.make_booking()
+        self.make_booking(
+            check_out=date(2025, 1, 10), pax=0,
+            pax_details={'rooms': {'pax': 3}, 'tours': {'pax': 4}},
+        )
+        self.make_booking(check_in=None, check_out=None, pax=3)
+        for booking in Booking.objects.with_totals():
+            expected = booking.calculate_totals()
+            self.assertEqual(booking.priced_total, expected['total_amount'])
+            self.assertEqual(booking.priced_rooms, expected['rooms_total'])
+            self.assertEqual(booking.priced_balance, expected['total_amount'] - booking.paid)
+
+    def test_booking_list_sorts_by_amount(self):
+        cheap = self.make_booking(pax=1)
+        dear = self.make_booking(pax=4)
+        admin = User.objects.create_superuser(username='boss', password='pass12345')
+        self.client.force_login(admin)
+        response = self.client.get('/bookings/?sort=-amount')
+        self.assertEqual([b.pk for b in response.context['bookings']], [dear.pk, cheap.pk])
+
+    def test_booking_cards_skip_package_activities(self):
+        self.make_booking()
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/bookings/')
+        self.assertFalse([q for q in queries if 'myApp_package_activities' in q['sql']])
+
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'stats-tests'},
+}
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def setUpModule():
+    # Keep every test off the file cache and the SQLite channel layer under BASE_DIR
+    overrides = override_settings(CACHES=LOCMEM_CACHES, CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+    overrides.enable()
+    unittest.addModuleCleanup(overrides.disable)
+
+
+class StatsCacheTests(CatalogMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['shared'].clear()
+        stats.clear_local()
+
+    def test_steady_state_costs_no_queries(self):
+        stats.total_users()
+        stats.total_bookings()
+        stats.total_revenue()
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.total_users(), 1)
+            self.assertEqual(stats.total_bookings(), 0)
+            self.assertEqual(stats.total_revenue(), 0)
+
+    def test_signals_invalidate_counters(self):
+        self.assertEqual(stats.total_bookings(), 0)
+        self.assertEqual(stats.user_total_amount(self.user.pk), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = self.make_booking()
+        self.assertEqual(stats.total_bookings(), 1)
+        self.assertEqual(stats.total_revenue(), Decimal('6300'))
+        self.assertEqual(stats.user_total_amount(self.user.pk), Decimal('6300'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.delete()
+            User.objects.create_user(username='second', password='pass12345')
+        self.assertEqual(stats.total_bookings(), 0)
+        self.assertEqual(stats.total_revenue(), 0)
+        self.assertEqual(stats.total_users(), 2)
+
+    def test_shared_tier_is_used_when_local_copy_expires(self):
+        stats.total_users()
+        stats.clear_local()
+        with self.assertNumQueries(0):
+            stats.total_users()
+
+    def test_context_processors_are_lazy(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/user-dashboard/')
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql'] or 'SUM(' in q['sql']])
+
+        admin = User.objects.create_superuser(username='boss', password='pass12345')
+        self.client.force_login(admin)
+        response = self.client.get('/admin-dashboard/')
+        self.assertContains(response, '<i class="fas fa-users me-2"></i> 2</strong>', html=False)
+
+
+class RoomInventoryTests(CatalogMixin, TestCase):
+    def ledger(self):
+        return dict(
+            RoomInventory.objects.filter(booked__gt=0).values_list('date', 'booked')
+        )
+
+    def assertLedgerMatchesRebuild(self):
+        live = self.ledger()
+        inventory.rebuild()
+        self.assertEqual(live, self.ledger())
+
+    def test_ledger_follows_bookings(self):
+        booking = self.make_booking()
+        RoomBooking.objects.create(
+            room_type=self.room_type, customer_name='Walk-in', customer_email='w@example.com',
+            check_in=date(2025, 1, 11), check_out=date(2025, 1, 13), guests=1,
+        )
+        self.assertEqual(self.ledger(), {date(2025, 1, 10): 1, date(2025, 1, 11): 2, date(2025, 1, 12): 1})
+        self.assertLedgerMatchesRebuild()
+
+        booking = Booking.objects.get(pk=booking.pk)
+        booking.check_in = '2025-01-20'
+        booking.check_out = '2025-01-21'
+        booking.save()
+        self.assertLedgerMatchesRebuild()
+        self.assertEqual(self.ledger()[date(2025, 1, 20)], 1)
+
+        second = Room.objects.create(name='R2', room_type=self.room_type)
+        booking.rooms.add(second)
+        self.assertEqual(self.ledger()[date(2025, 1, 20)], 2)
+        booking.rooms.clear()
+        self.assertLedgerMatchesRebuild()
+        booking.rooms.set([second])
+        booking.delete()
+        self.assertLedgerMatchesRebuild()
+
+    def test_removing_an_unlinked_room_releases_nothing(self):
+        booking = self.make_booking()
+        other = Room.objects.create(name='R2', room_type=self.room_type)
+        booking.rooms.remove(other)
+        other.booking_set.remove(booking)
+        self.assertEqual(inventory.rooms_free(self.room_type, date(2025, 1, 10), date(2025, 1, 12)), 1)
+        self.assertLedgerMatchesRebuild()
+
+    def test_rooms_moved_or_deleted_take_their_nights_along(self):
+        self.make_booking()
+        suite = RoomType.objects.create(name='Suite', capacity=4, price_per_night=Decimal('3000'), total_rooms=2)
+        room = Room.objects.get(pk=self.room.pk)
+        room.room_type = suite
+        room.save()
+        self.assertEqual(inventory.rooms_free(self.room_type, date(2025, 1, 10), date(2025, 1, 12)), 2)
+        self.assertEqual(inventory.rooms_free(suite, date(2025, 1, 10), date(2025, 1, 12)), 1)
+        self.assertLedgerMatchesRebuild()
+
+        room.delete()
+        self.assertEqual(inventory.rooms_free(suite, date(2025, 1, 10), date(2025, 1, 12)), 2)
+        self.assertLedgerMatchesRebuild()
+
+    def test_rooms_free_uses_busiest_night(self):
+        booking = self.make_booking()
+        self.make_booking(check_in=date(2025, 1, 11), check_out=date(2025, 1, 14))
+        self.assertEqual(inventory.rooms_free(self.room_type, date(2025, 1, 9), date(2025, 1, 11)), 1)
+        self.assertEqual(inventory.rooms_free(self.room_type, date(2025, 1, 11), date(2025, 1, 12)), 0)
+        self.assertEqual(
+            inventory.rooms_free(self.room_type, date(2025, 1, 11), date(2025, 1, 12), exclude_booking=booking), 1
+        )
+        self.assertEqual(self.room_type.available_rooms(), 2)
+
+    def test_check_rooms_reports_every_failure_in_two_queries(self):
+        booking = self.make_booking()
+        second = Room.objects.create(name='R2', room_type=self.room_type)
+        suite = RoomType.objects.create(name='Suite', capacity=4, price_per_night=Decimal('3000'), total_rooms=1)
+        spare = Room.objects.create(name='S1', room_type=suite)
+
+        with CaptureQueriesContext(connection) as queries:
+            result = inventory.check_rooms([self.room.pk, second.pk, spare.pk], '2025-01-11', '2025-01-12')
+        self.assertEqual(len(queries), 2)
+        self.assertFalse(result.ok)
+        self.assertEqual([failure.room for failure in result.failures], [self.room, second])
+        self.assertEqual(result.occupancy[self.room_type.pk]['free'], 1)
+        self.assertEqual(result.occupancy[suite.pk]['free'], 1)
+
+        self.assertTrue(inventory.check_rooms([self.room.pk, second.pk], '2025-01-11', '2025-01-12',
+                                              exclude_booking=booking).ok)
+        missing = inventory.check_rooms([999], '2025-01-11', '2025-01-12')
+        self.assertEqual(missing.failures[0].room_id, 999)
+
+    def test_create_booking_rejects_full_room_type(self):
+        self.make_booking()
+        self.make_booking()
+        self.client.force_login(self.user)
+        response = self.client.post('/bookings/new/', {
+            'check_in': '2025-01-11', 'check_out': '2025-01-12', 'pax': 1, 'rooms': [self.room.pk],
+        })
+        self.assertRedirects(response, '/bookings/new/', fetch_redirect_response=False)
+        self.assertEqual(Booking.objects.count(), 2)
+
+
+class AvailabilityWindowTests(CatalogMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['shared'].clear()
+
+    def test_sweep_matches_ledger(self):
+        self.make_booking()
+        self.make_booking(check_in=date(2025, 1, 11), check_out=date(2025, 1, 11))
+        RoomBooking.objects.create(
+            room_type=self.room_type, customer_name='Walk-in', customer_email='w@example.com',
+            check_in=date(2025, 1, 5), check_out=date(2025, 1, 11), guests=1,
+        )
+        window = inventory.availability_window(date(2025, 1, 8), 6)
+        free = window['room_types'][0]['free']
+        self.assertEqual(free, [1, 1, 0, 0, 2, 2])
+        for offset, night in enumerate(inventory.stay_nights(date(2025, 1, 8), date(2025, 1, 14))):
+            self.assertEqual(free[offset], inventory.rooms_free(self.room_type, night, night))
+
+    def test_endpoint_is_cached_until_bookings_change(self):
+        today = timezone.localdate()
+        monday = today + timedelta(days=7 - today.weekday())
+        url = f'/bookings/availability/?start={monday.isoformat()}&days=3'
+        payload = self.client.get(url).json()
+        self.assertEqual((payload['start'], payload['days']), (monday.isoformat(), 7))
+        self.assertEqual(payload['room_types'][0]['free'][:3], [2, 2, 2])
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_booking(check_in=monday, check_out=monday + timedelta(days=2))
+        self.assertEqual(self.client.get(url).json()['room_types'][0]['free'][:3], [1, 1, 2])
+        self.assertEqual(self.client.get('/bookings/availability/?days=0').status_code, 400)
+
+    def test_endpoint_serves_a_bounded_set_of_windows(self):
+        today = timezone.localdate()
+        payload = self.client.get('/bookings/availability/?start=1990-01-01&days=999').json()
+        earliest = today - timedelta(days=views.AVAILABILITY_PAST_DAYS)
+        self.assertEqual(payload['start'], (earliest - timedelta(days=earliest.weekday())).isoformat())
+        self.assertEqual(payload['days'], views.AVAILABILITY_WINDOWS[-1])
+        # A mid-week start is served from its Monday, long enough to cover the nights asked for
+        wednesday = today + timedelta(days=9 - today.weekday())
+        payload = self.client.get(f'/bookings/availability/?start={wednesday.isoformat()}&days=6').json()
+        self.assertEqual((payload['start'], payload['days']), ((wednesday - timedelta(days=2)).isoformat(), 30))
+
+    def test_stays_without_dates_are_skipped(self):
+        self.make_booking(check_in=timezone.localdate(), check_out=None)
+        response = self.client.get('/bookings/availability/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['room_types'][0]['free']), {2})
+
+
+class RevenueRollupTests(CatalogMixin, TestCase):
+    def stored(self):
+        return sorted(
+            DailyRevenueRollup.objects.values_list('date', 'category', 'bookings', 'pax', 'revenue')
+        )
+
+    def live(self):
+        return sorted((r.date, r.category, r.bookings, r.pax, r.revenue) for r in rollups.compute())
+
+    def test_rollup_follows_bookings_and_orders(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.make_booking()
+            second = self.make_booking(pax=3)
+            second.activities.clear()
+            FoodOrder.objects.create(user=self.user, food=self.food, quantity=4)
+        self.assertEqual(self.stored(), self.live())
+        summary = rollups.totals()
+        self.assertEqual(summary['bookings']['bookings'], 2)
+        self.assertEqual(summary['bookings']['revenue'], first.total_amount + second.total_amount)
+        self.assertEqual(summary['activities']['bookings'], 1)
+        self.assertEqual(summary['food_orders']['revenue'], Decimal('600'))
+
+        # Price changes reprice every day they touch; deletions drop out
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room_type.price_per_night = Decimal('2000')
+            self.room_type.save()
+            self.food.price_per_person = Decimal('100')
+            self.food.save()
+        self.assertEqual(self.stored(), self.live())
+        self.assertEqual(rollups.totals()['food_orders']['revenue'], Decimal('400'))
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(self.stored(), self.live())
+        self.assertEqual(rollups.totals()['bookings']['bookings'], 1)
+
+    def test_changes_to_one_day_are_recomputed_once_per_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.make_booking()
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        refreshes = [q for q in queries if q['sql'].startswith('INSERT INTO "myApp_dailyrevenuerollup"')]
+        self.assertEqual(len(refreshes), 1)
+
+    def test_days_a_failed_flush_missed_are_recomputed_by_the_next(self):
+        self.make_booking()  # its own flush never runs: the test's transaction does not commit
+        with mock.patch.object(rollups, 'compute', side_effect=OperationalError('database table is locked')):
+            with self.assertRaises(OperationalError):
+                rollups.flush()
+        self.assertFalse(DailyRevenueRollup.objects.exists())
+        self.assertTrue(DirtyRollupDay.objects.exists())
+
+        rollups.flush()
+        self.assertEqual(self.stored(), self.live())
+        self.assertFalse(DirtyRollupDay.objects.exists())
+
+    def test_analytics_page_matches_live_totals(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = self.make_booking()
+        DailyRevenueRollup.objects.all().delete()
+        call_command('rebuild_revenue_rollups', stdout=StringIO())
+        self.client.force_login(User.objects.create_superuser('boss', password='pass12345'))
+        response = self.client.get('/reports/')
+        self.assertEqual(response.context['total_bookings'], 1)
+        self.assertEqual(response.context['total_revenue'], booking.total_amount)
+        self.assertEqual(response.context['revenue_rooms'], booking.rooms_total)
+        self.assertEqual(sum(response.context['chart_revenue']), float(booking.total_amount))
+
+
+class TimeSeriesTests(CatalogMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['shared'].clear()
+
+    def booking_made_on(self, day, **kwargs):
+        booking = self.make_booking(**kwargs)
+        Booking.objects.filter(pk=booking.pk).update(created_at=rollups.day_range(day)[0])
+        return booking
+
+    def test_same_month_in_different_years_stays_apart(self):
+        first = self.booking_made_on(date(2025, 1, 15))
+        self.booking_made_on(date(2026, 1, 20), pax=3)
+        rollups.rebuild()
+        series = timeseries.series(date(2025, 1, 1), date(2026, 1, 31), 'month')
+        self.assertEqual(len(series), 13)
+        self.assertEqual(series.display_labels[0], 'Jan 2025')
+        self.assertEqual(series.display_labels[-1], 'Jan 2026')
+        self.assertEqual(list(series.bookings), [1] + [0] * 11 + [1])
+        self.assertEqual(series.pax[0], 2)
+        self.assertEqual(series.revenue[0], float(first.total_amount))
+        self.assertEqual(list(timeseries.series(date(2025, 1, 1), date(2026, 12, 31), 'year').bookings), [1, 1])
+
+    def test_check_in_buckets_by_week(self):
+        self.make_booking(check_in=date(2025, 1, 10))  # a Friday
+        self.make_booking(check_in=date(2025, 1, 13), check_out=date(2025, 1, 14))
+        FoodOrder.objects.create(user=self.user, food=self.food, quantity=2, check_in=date(2025, 1, 14))
+        series = timeseries.series(date(2025, 1, 1), date(2025, 1, 31), 'week', field='check_in')
+        self.assertEqual(series.labels[:3], [date(2024, 12, 30), date(2025, 1, 6), date(2025, 1, 13)])
+        self.assertEqual(list(series.bookings[:3]), [0, 1, 1])
+        self.assertEqual(list(series.food_orders[:3]), [0, 0, 1])
+        self.assertEqual(series.food_revenue[2], 300.0)
+
+    def test_series_is_cached_until_the_report_data_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_booking()
+        today = timezone.localdate()
+        self.assertEqual(sum(timeseries.series(today, today, 'day').bookings), 1)
+        with self.assertNumQueries(0):
+            timeseries.series(today, today, 'day')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_booking()
+        self.assertEqual(sum(timeseries.series(today, today, 'day').bookings), 2)
+
+    def test_analytics_chart_options(self):
+        self.make_booking(check_in=date(2025, 3, 1))
+        self.client.force_login(User.objects.create_superuser('boss', password='pass12345'))
+        response = self.client.get('/reports/?granularity=year&field=check_in&start=2024-06-01&end=2025-12-31')
+        self.assertEqual(response.context['chart_labels'], ['2024', '2025'])
+        self.assertEqual(response.context['chart_bookings'], [0, 1])
+        self.assertEqual(len(self.client.get('/reports/?granularity=week').context['chart_labels']), 12)
+        self.assertEqual(self.client.get('/reports/?granularity=hour').status_code, 400)
+        self.assertEqual(self.client.get('/reports/?start=2025-02-30').status_code, 400)
+        self.assertEqual(self.client.get('/reports/?granularity=day&start=2000-01-01').status_code, 400)
+
+
+class BookingSummaryTests(CatalogMixin, TestCase):
+    def test_one_pass_matches_the_rollup(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.make_booking()
+            second = self.make_booking(pax=3)
+            second.activities.clear()
+            third = self.make_booking(pax=3)
+        Booking.objects.filter(pk=third.pk).update(created_at=timezone.now() - timedelta(days=70))
+        rollups.rebuild()
+
+        # Rows are read as tuples; no Booking instance is ever built
+        with mock.patch.object(Booking, 'from_db', side_effect=AssertionError):
+            summary = analytics.summarize_bookings(chunk_size=2)
+        rolled = rollups.totals()
+        self.assertEqual(summary.bookings, 3)
+        self.assertEqual(summary.guests, 8)
+        self.assertEqual(summary.revenue, rolled['bookings']['revenue'])
+        for category in rollups.BOOKING_CATEGORIES:
+            self.assertEqual(summary.category_revenue[category], rolled[category]['revenue'])
+        self.assertEqual(summary.pax_distribution, {2: 1, 3: 2})
+
+        this_month = timezone.localdate().replace(day=1)
+        self.assertEqual(summary.monthly[this_month][:2], [2, 5])
+        series = summary.series()
+        self.assertIn(len(series), (3, 4))
+        self.assertEqual(series.labels[-1], this_month)
+        self.assertEqual(sum(series.bookings), 3)
+        self.assertEqual(sum(series.revenue), float(first.total_amount + second.total_amount + third.total_amount))
+
+    def test_pdf_report_reads_rows_once(self):
+        self.make_booking()
+        FoodOrder.objects.create(user=self.user, food=self.food, quantity=2)
+        out = BytesIO()
+        with mock.patch.object(Booking, 'from_db', side_effect=AssertionError):
+            reports.write_pdf(out)
+        self.assertTrue(out.getvalue().startswith(b'%PDF'))
+
+
+class PopularityTests(CatalogMixin, TestCase):
+    def stored(self):
+        # Counters that drop back to zero are kept; the rebuild only writes non-zero ones
+        return (
+            sorted(ItemPopularity.objects.exclude(bookings=0).values_list('category', 'item_id', 'bookings')),
+            sorted(DailyItemPopularity.objects.exclude(bookings=0).values_list('category', 'item_id', 'date', 'bookings')),
+        )
+
+    def rebuilt(self):
+        popularity.rebuild()
+        return self.stored()
+
+    def counts(self, category):
+        return {item.pk: item.num_bookings for item in popularity.top(category)}
+
+    def test_counters_follow_selection_changes(self):
+        other = Activity.objects.create(name='Hiking', description='', price_per_person=Decimal('100'))
+        first = self.make_booking()
+        second = self.make_booking()
+        second.activities.add(other)
+        self.assertEqual(self.counts('activities'), {self.activity.pk: 2, other.pk: 1})
+        self.assertEqual([a.pk for a in popularity.top('activities')], [self.activity.pk, other.pk])
+
+        second.activities.remove(self.activity, self.activity)
+        first.activities.remove(other)  # never selected: no change
+        self.assertEqual(self.counts('activities'), {self.activity.pk: 1, other.pk: 1})
+        other.booking_set.add(first)
+        other.booking_set.remove(second)
+        self.assertEqual(self.counts('activities'), {self.activity.pk: 1, other.pk: 1})
+        self.tour.booking_set.clear()
+        first.rooms.clear()
+        self.assertEqual(self.counts('tours'), {})
+        self.assertEqual(self.counts('rooms'), {self.room.pk: 1})
+
+        stored = self.stored()
+        self.assertEqual(stored, self.rebuilt())
+        second.delete()
+        other.delete()
+        self.assertEqual(self.counts('rooms'), {})
+        stored = self.stored()
+        self.assertEqual(stored, self.rebuilt())
+
+    def test_rolling_windows_count_recent_bookings_only(self):
+        self.make_booking()
+        old = self.make_booking()
+        Booking.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=40))
+        popularity.rebuild()
+        self.assertEqual(popularity.top('packages', window=30)[0].num_bookings, 1)
+        self.assertEqual(popularity.top('packages', window=90)[0].num_bookings, 2)
+        self.assertEqual(popularity.top('packages')[0].num_bookings, 2)
+
+    def test_pages_read_the_counters(self):
+        quiet = Tour.objects.create(name='Aardvark walk', description='', price_per_person=Decimal('10'))
+        self.make_booking()
+        response = self.client.get('/explore/')
+        self.assertEqual([t.pk for t in response.context['tours']], [self.tour.pk, quiet.pk])
+
+        self.client.force_login(User.objects.create_superuser('boss', password='pass12345'))
+        response = self.client.get('/reports/?top_window=7')
+        self.assertEqual([(r.pk, r.num_bookings) for r in response.context['popular_rooms']], [(self.room.pk, 1)])
+        self.assertEqual(self.client.get('/reports/?top_window=5').status_code, 400)
+
+
+class NotificationFanOutTests(CatalogMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        caches['shared'].clear()
+
+    def test_fan_out_is_one_insert_whatever_the_staff_count(self):
+        User.objects.bulk_create(User(username=f'staff{i}', is_staff=True) for i in range(30))
+        Job.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            booking = self.make_booking()
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "myApp_notification"')]
+        self.assertEqual(len(inserts), 1)  # the booking user's own; staff are notified by a job
+        self.assertEqual(Job.objects.get().task, 'notify_staff')
+
+        with CaptureQueriesContext(connection) as queries:
+            jobs.work_off()
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "myApp_notification"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Notification.objects.filter(message__startswith=f"New booking #{booking.pk}").count(), 30)
+
+    def test_staff_ids_follow_is_staff(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            admin = User.objects.create_user('admin', is_staff=True)
+        self.assertEqual(stats.staff_ids(), [admin.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(stats.staff_ids(), [admin.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_staff = True
+            self.user.save()
+        self.assertEqual(stats.staff_ids(), sorted([admin.pk, self.user.pk]))
+        with self.captureOnCommitCallbacks(execute=True):
+            admin.delete()
+        self.assertEqual(stats.staff_ids(), [self.user.pk])
+
+    def test_push_reaches_only_recipients_with_unread_count(self):
+        staff = User.objects.create_user('staff1', is_staff=True)
+        User.objects.create_user('bystander')
+        Job.objects.all().delete()
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):  # a fresh layer
+            layer = get_channel_layer()
+
+            async def join(user_ids):
+                channels = {}
+                for user_id in user_ids:
+                    channels[user_id] = await layer.new_channel()
+                    await layer.group_add(user_group(user_id), channels[user_id])
+                return channels
+
+            channels = async_to_sync(join)(list(User.objects.values_list('pk', flat=True)))
+            with self.captureOnCommitCallbacks(execute=True):
+                booking = self.make_booking()
+            with self.captureOnCommitCallbacks(execute=True):
+                jobs.work_off()
+
+            async def drain():
+                pushed = {}
+                for user_id, channel in channels.items():
+                    while True:
+                        try:
+                            message = await asyncio.wait_for(layer.receive(channel), 0.05)
+                        except asyncio.TimeoutError:
+                            break
+                        pushed.setdefault(user_id, []).append((message['message'], message['unread']))
+                return pushed
+
+            self.assertEqual(async_to_sync(drain)(), {
+                self.user.pk: [(f"Your booking #{booking.pk} has been created.", 1)],
+                staff.pk: [(f"New booking #{booking.pk} by guest", 1)],
+            })
+
+    def test_websocket_push_waits_for_commit(self):
+        User.objects.create_user('staff1', is_staff=True)
+        self.make_booking()
+        with mock.patch('myApp.tasks.async_to_sync') as async_to_sync:
+            with self.captureOnCommitCallbacks() as callbacks:
+                jobs.work_off()
+            async_to_sync.assert_not_called()
+            for callback in callbacks:
+                callback()
+            async_to_sync.assert_called()
+
+
+class NotificationInboxTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        self.admin = User.objects.create_superuser('admin', password='pass12345')
+        self.guest = User.objects.create_user('guest')
+        self.client.force_login(self.admin)
+
+    def test_keyset_pages_cover_every_notification_once(self):
+        created = timezone.now()
+        Notification.objects.bulk_create(
+            Notification(user=self.admin if n % 2 else self.guest, message=f'#{n}') for n in range(7)
+        )
+        # Ties on created_at are broken by id, so no row is skipped or repeated
+        Notification.objects.update(created_at=created)
+        seen = []
+        query = {}
+        with mock.patch('myApp.views.NOTIFICATIONS_PER_PAGE', 3):
+            while query is not None:
+                response = self.client.get('/notifications/', query)
+                seen += [n.message for n in response.context['notifications']]
+                older = response.context['older_query']
+                query = dict(part.split('=') for part in older.split('&')) if older else None
+        self.assertEqual(seen, [f'#{n}' for n in reversed(range(7))])
+
+    def test_bulk_mark_read_is_one_update(self):
+        mine = Notification.objects.bulk_create(
+            Notification(user=self.admin, message=f'#{n}') for n in range(3)
+        )
+        theirs = Notification.objects.create(user=self.guest, message='Guest')
+        self.assertEqual(stats.unread_count(self.admin.pk), 3)
+
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/notifications/read/', {'ids': [mine[0].pk, theirs.pk]})
+        updates = [q for q in queries if q['sql'].startswith('UPDATE "myApp_notification"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(stats.unread_count(self.admin.pk), 2)
+        self.assertEqual(stats.unread_count(self.guest.pk), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/notifications/read/', {'all': '1'})
+        self.assertEqual(stats.unread_count(self.admin.pk), 0)
+
+    def test_unread_count_is_cached_until_notifications_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(user=self.guest, message='One')
+            self.assertEqual(stats.unread_count(self.guest.pk), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(stats.unread_counts([self.guest.pk]), {self.guest.pk: 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(user=self.guest, message='Two')
+        self.assertEqual(stats.unread_count(self.guest.pk), 2)
+
+
+class NotificationRetentionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('guest')
+        old = timezone.now() - timedelta(days=100)
+        self.old_read = [
+            Notification.objects.create(user=self.user, message=f'Old #{n}', is_read=True) for n in range(3)
+        ]
+        self.old_unread = Notification.objects.create(user=self.user, message='Old unread')
+        Notification.objects.filter(pk__in=[n.pk for n in self.old_read] + [self.old_unread.pk]).update(created_at=old)
+        self.recent_read = Notification.objects.create(user=self.user, message='Recent', is_read=True)
+
+    def test_old_read_notifications_move_to_the_archive_in_batches(self):
+        since = changes.checkpoint()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(retention.prune_notifications(batch_size=2), 3)
+        deletes = [q for q in queries if q['sql'].startswith('DELETE FROM "myApp_notification"')]
+        self.assertEqual(len(deletes), 2)
+        self.assertEqual(
+            sorted(Notification.objects.values_list('pk', flat=True)),
+            [self.old_unread.pk, self.recent_read.pk],
+        )
+        archived = NotificationArchive.objects.order_by('pk')
+        self.assertEqual([a.pk for a in archived], [n.pk for n in self.old_read])
+        self.assertEqual(retention.prune_notifications(), 0)
+        # One change log INSERT per batch and table, not one per row
+        logged = [q for q in queries if q['sql'].startswith('INSERT INTO "myApp_changelog"')]
+        self.assertEqual(len(logged), 4)
+        # prune_notifications() skips the cascade collector, which is only
+        # safe while nothing references Notification
+        self.assertEqual(Notification._meta.related_objects, ())
+        self.assertEqual(
+            changes.changed_since(since, changes.checkpoint()),
+            {Notification: {n.pk for n in self.old_read}, NotificationArchive: {n.pk for n in self.old_read}},
+        )
+
+    def test_policy_comes_from_system_settings(self):
+        SystemSetting.objects.create(notification_retention_days=365, archive_notifications=False)
+        self.assertEqual(retention.prune_notifications(), 0)
+        out = StringIO()
+        call_command('prune_notifications', days=30, stdout=out)
+        self.assertIn("Pruned 3 notifications.", out.getvalue())
+        self.assertFalse(NotificationArchive.objects.exists())
+
+
+class FastDeleteTests(SimpleTestCase):
+    def test_tables_without_receivers_are_fast_deleted(self):
+        collector = Collector(using='default')
+        for model in (ChangeLog, RoomInventory, DailyRevenueRollup, ItemPopularity, DailyItemPopularity):
+            with self.subTest(model=model.__name__):
+                self.assertTrue(collector.can_fast_delete(model.objects.all()))
+
+
+@jobs.task('test_flaky', max_attempts=2)
+def flaky_task(job, fail_times):
+    if job.attempts <= fail_times:
+        raise RuntimeError("flaky")
+    return {'attempts': job.attempts}
+
+
+@jobs.task('test_record')
+def record_task(job, label):
+    return label
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', password='pass')
+        Job.objects.all().delete()  # the registration notification
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        overrides = override_settings(JOBS_FILES_DIR=files.name)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def test_jobs_run_by_priority(self):
+        low = jobs.enqueue('test_record', label='low')
+        high = jobs.enqueue('test_record', priority=5, label='high')
+        self.assertEqual(jobs.claim('test').pk, high.pk)
+        self.assertEqual(jobs.claim('test').pk, low.pk)
+        self.assertIsNone(jobs.claim('test'))
+
+    def test_failures_are_retried_with_backoff_then_fail(self):
+        job = jobs.enqueue('test_flaky', fail_times=1)
+        jobs.work_off()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('RuntimeError', job.error)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        jobs.work_off()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.DONE, {'attempts': 2}))
+
+        doomed = jobs.enqueue('test_flaky', fail_times=5)
+        jobs.work_off()
+        Job.objects.filter(pk=doomed.pk).update(run_after=timezone.now())
+        jobs.work_off()
+        doomed.refresh_from_db()
+        self.assertEqual((doomed.status, doomed.attempts), (Job.FAILED, 2))
+
+    @override_settings(JOBS_EAGER=True)
+    def test_eager_mode_runs_only_cheap_tasks_inline(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            notify = jobs.enqueue('notify_staff', message='New booking', type='booking')
+            report = jobs.enqueue('export_report', export_format='pdf')
+        notify.refresh_from_db()
+        report.refresh_from_db()
+        self.assertEqual((notify.status, report.status), (Job.DONE, Job.QUEUED))
+
+    def test_jobs_left_running_are_claimed_again_once_stale(self):
+        job = jobs.enqueue('test_record', label='stuck')
+        jobs.claim('dead')
+        self.assertIsNone(jobs.claim('test'))
+        Job.objects.filter(pk=job.pk).update(
+            started_at=timezone.now() - timedelta(seconds=jobs.STALE_AFTER + 1)
+        )
+        self.assertEqual(jobs.claim('test').worker, 'test')
+
+    def test_rerun_staff_notification_is_not_sent_twice(self):
+        caches['shared'].clear()
+        job = jobs.enqueue('notify_staff', message='New booking', type='booking')
+        jobs.work_off()
+        sent = Notification.objects.filter(message='New booking').count()
+        self.assertEqual(sent, 1)
+        # As if the worker died after committing the notifications, before marking the job done
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING, started_at=timezone.now() - timedelta(seconds=jobs.STALE_AFTER + 1),
+        )
+        jobs.work_off()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), (Job.DONE, {'notified': sent}))
+        self.assertEqual(Notification.objects.filter(message='New booking').count(), sent)
+
+    def test_report_export_is_queued_and_downloadable(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/reports/?export=pdf')
+        job = Job.objects.get(task='export_report')
+        self.assertRedirects(response, f'/jobs/{job.pk}/')
+
+        jobs.work_off()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        download = self.client.get(f'/jobs/{job.pk}/download/')
+        self.assertEqual(download['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(download.streaming_content).startswith(b'%PDF'))
+
+    def test_unchanged_report_is_built_once_and_served_from_the_store(self):
+        caches['shared'].clear()
+        self.client.force_login(self.admin)
+        first = self.client.get('/reports/?export=pdf')
+        job = Job.objects.get(task='export_report')
+        self.assertRedirects(first, f'/jobs/{job.pk}/')
+        # Asking again while it is being built joins the same job
+        self.assertRedirects(self.client.get('/reports/?export=pdf'), f'/jobs/{job.pk}/')
+
+        jobs.work_off()
+        key = Job.objects.get(pk=job.pk).kwargs['key']
+        stored = self.client.get('/reports/?export=pdf')
+        self.assertRedirects(stored, f'/reports/files/{key}.pdf', fetch_redirect_response=False)
+        download = self.client.get(f'/reports/files/{key}.pdf')
+        self.assertEqual(download['ETag'], f'"{key}"')
+        self.assertTrue(b''.join(download.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(self.client.get(f'/reports/files/{key}.pdf', HTTP_IF_NONE_MATCH=f'"{key}"').status_code, 304)
+        self.assertEqual(Job.objects.filter(task='export_report').count(), 1)
+
+        # New data means a new report
+        with self.captureOnCommitCallbacks(execute=True):
+            Food.objects.create(name='Dinner', price_per_person=Decimal('900'))
+        self.client.get('/reports/?export=pdf')
+        self.assertEqual(Job.objects.filter(task='export_report').count(), 2)
+
+
+class BackupTests(CatalogMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        self.files = files.name
+
+    def test_dump_reads_each_model_in_chunks_and_loads_back(self):
+        booking = self.make_booking()
+        path = os.path.join(self.files, 'backup.jsonl.gz')
+        with CaptureQueriesContext(connection) as one_booking:
+            backups.write_dump(path, 'gzip')
+        with gzip.open(path, 'rt') as lines:
+            objects = [json.loads(line) for line in lines]
+        dumped = next(o for o in objects if o['model'] == 'myApp.booking')
+        self.assertEqual(dumped['fields']['activities'], [self.activity.pk])
+        labels = [o['model'] for o in objects]
+        self.assertLess(labels.index('myApp.roomtype'), labels.index('myApp.room'))
+
+        # Many-to-many ids are prefetched per chunk, not queried per object
+        for _ in range(4):
+            self.make_booking()
+        with CaptureQueriesContext(connection) as five_bookings:
+            backups.write_dump(os.path.join(self.files, 'again.jsonl'), 'none')
+        self.assertEqual(len(five_bookings), len(one_booking))
+
+        Booking.objects.all().delete()
+        call_command('loaddata', path, verbosity=0)
+        restored = Booking.objects.get(pk=booking.pk)
+        self.assertEqual(list(restored.activities.all()), [self.activity])
+        self.assertEqual(restored.total_amount, booking.total_amount)
+
+    def test_sqlite_snapshot_is_a_working_database(self):
+        self.make_booking()
+        path = os.path.join(self.files, 'backup.sqlite3')
+        self.assertGreater(backups.snapshot(path), 0)
+        copy = sqlite3.connect(path)
+        self.addCleanup(copy.close)
+        self.assertEqual(copy.execute('SELECT COUNT(*) FROM "myApp_booking"').fetchone(), (1,))
+
+    def test_backup_view_queues_the_kind_asked_for(self):
+        admin = User.objects.create_superuser('boss', password='pass12345')
+        Job.objects.all().delete()
+        self.client.force_login(admin)
+        with override_settings(JOBS_FILES_DIR=self.files):
+            response = self.client.get('/backup/?kind=sqlite&compression=gzip')
+            job = Job.objects.get(task='backup_data')
+            self.assertRedirects(response, f'/jobs/{job.pk}/')
+            self.assertEqual(job.kwargs, {'kind': 'sqlite', 'compression': 'gzip'})
+            jobs.work_off()
+            download = self.client.get(f'/jobs/{job.pk}/download/')
+        self.assertEqual(download['Content-Type'], 'application/gzip')
+        self.assertIn('.sqlite3.gz', download['Content-Disposition'])
+        with gzip.open(BytesIO(b''.join(download.streaming_content))) as snapshot:
+            self.assertTrue(snapshot.read(16).startswith(b'SQLite format 3'))
+
+        self.assertEqual(self.client.get('/backup/?kind=xml').status_code, 400)
+        with mock.patch.object(backups, 'zstandard', None):
+            self.assertEqual(self.client.get('/backup/?compression=zstd').status_code, 400)
+
+    def test_incremental_backup_replays_onto_the_full_one(self):
+        kept, removed = self.make_booking(), self.make_booking()
+        full = os.path.join(self.files, 'full.jsonl.gz')
+        since = changes.checkpoint()
+        backups.write_dump(full)
+
+        kept.customer_name = 'Renamed'
+        kept.save()
+        removed_pk = removed.pk
+        removed.delete()
+        added = self.make_booking(pax=3)
+        added.tours.clear()
+        self.user.notifications.all().mark_read()  # a bulk UPDATE, logged by mark_read itself
+        delta = os.path.join(self.files, 'delta.jsonl')
+        _, until = backups.write_changes(delta, since, 'none')
+
+        with open(delta) as lines:
+            objects = [json.loads(line) for line in lines]
+        self.assertEqual(objects[0], {'checkpoint': {'since': since, 'until': until}})
+        self.assertIn({'model': 'myApp.booking', 'deleted': [removed_pk]}, objects)
+        saved = {(o['model'], o['pk']) for o in objects if 'fields' in o}
+        self.assertTrue({('myApp.booking', kept.pk), ('myApp.booking', added.pk)} <= saved)
+        self.assertTrue({('myApp.notification', pk) for pk in self.user.notifications.values_list('pk', flat=True)} <= saved)
+        self.assertNotIn(('myApp.activity', self.activity.pk), saved)  # untouched rows stay out
+
+        gap = os.path.join(self.files, 'gap.jsonl.gz')
+        backups.write_changes(gap, until + 1)
+        with self.assertRaises(ValueError):
+            backups.restore([full, delta, gap])
+        # The full backup records where its changes end, so a first delta starting later is refused too
+        self.assertEqual(backups.read_checkpoint(full), {'since': None, 'until': since})
+        late = os.path.join(self.files, 'late.jsonl')
+        backups.write_changes(late, since + 1, 'none')
+        with self.assertRaises(ValueError):
+            backups.restore([full, late])
+        with self.assertRaises(ValueError):
+            backups.restore([delta, full])
+
+        self.make_booking(customer_name='After the backups')
+        after = Booking.objects.get(customer_name='After the backups').pk
+        queued = Job.objects.count()
+        call_command('restore', full, delta, stdout=StringIO())
+        self.assertFalse(Booking.objects.filter(pk=after).exists())
+        # Rows are inserted raw with signals muted: no jobs or fresh timestamps, and the change
+        # log restarts where the delta ended, without the entries made since
+        self.assertEqual(changes.checkpoint(), until)
+        self.assertEqual(ChangeLog.objects.count(), 1)
+        self.assertLess(Job.objects.count(), queued)
+        restored = Booking.objects.get(pk=kept.pk)
+        self.assertEqual(restored.customer_name, 'Renamed')
+        self.assertAlmostEqual(restored.created_at, kept.created_at, delta=timedelta(milliseconds=1))
+        self.assertFalse(Booking.objects.filter(pk=removed_pk).exists())
+        restored = Booking.objects.get(pk=added.pk)
+        self.assertEqual((restored.pax, restored.tours.count()), (3, 0))
+        self.assertFalse(Notification.objects.filter(is_read=False).exclude(user__is_staff=True).exists())
+        # Derived tables are rebuilt from the restored rows
+        self.assertEqual(RoomInventory.objects.get(date=date(2025, 1, 10)).booked, 2)
+        self.assertEqual([t.num_bookings for t in popularity.top('tours')], [1])
+        # The receivers are connected again afterwards, and the next delta holds only the new changes
+        booking = self.make_booking()
+        changed = changes.changed_since(until, changes.checkpoint())
+        self.assertEqual(changed[Booking], {booking.pk})
+
+    def test_backup_view_continues_from_the_last_checkpoint(self):
+        self.client.force_login(User.objects.create_superuser('boss', password='pass12345'))
+        Job.objects.all().delete()
+        with override_settings(JOBS_FILES_DIR=self.files):
+            self.assertEqual(self.client.get('/backup/?since=last').status_code, 400)
+            self.client.get('/backup/')
+            jobs.work_off()
+            full = Job.objects.get(task='backup_data')
+            self.make_booking()
+            self.client.get('/backup/?since=last')
+            incremental = Job.objects.filter(task='backup_data').latest('pk')
+            self.assertEqual(incremental.kwargs['since'], full.result['checkpoint'])
+            jobs.work_off()
+        incremental.refresh_from_db()
+        self.assertGreater(incremental.result['checkpoint'], full.result['checkpoint'])
+        self.assertIn(f"_since{full.result['checkpoint']}.jsonl.gz", incremental.result['filename'])
+        # Backup jobs prune the log up to the latest full backup, which still reports its checkpoint
+        oldest = ChangeLog.objects.order_by('id').values_list('id', flat=True).first()
+        self.assertEqual(oldest, full.result['checkpoint'])
+        self.assertEqual(self.client.get('/backup/?kind=sqlite&since=3').status_code, 400)
+
+
+class CsvExportTests(CatalogMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_superuser('boss', password='pass12345'))
+        self.booking = self.make_booking(customer_name='Alice')
+        self.old_booking = self.make_booking(customer_name='Bob')
+        Booking.objects.filter(pk=self.old_booking.pk).update(created_at=timezone.now() - timedelta(days=30))
+        FoodOrder.objects.create(user=self.user, food=self.food, quantity=2)
+
+    def export(self, query='', **headers):
+        response = self.client.get(f'/reports/export/csv/{query}', **headers)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_export_streams_every_row_in_constant_queries(self):
+        with self.assertNumQueries(4):  # session, user, bookings, food orders
+            response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = body.decode().splitlines()
+        self.assertIn('Bob,', lines[2])
+        self.assertIn('Alice,', lines[3])
+        self.assertEqual(lines[4], ',,Total Bookings Revenue,12600.00')
+        self.assertEqual(lines[-1], ',,,Total Food Revenue,300.00')
+
+    def test_date_and_category_filters(self):
+        today = timezone.localdate().isoformat()
+        _, body = self.export(f'?start={today}&end={today}&category=bookings')
+        text = body.decode()
+        self.assertIn('Alice', text)
+        self.assertNotIn('Bob', text)
+        self.assertNotIn('FOOD ORDERS', text)
+        self.assertEqual(self.client.get('/reports/export/csv/?start=2025-02-30').status_code, 400)
+        self.assertEqual(self.client.get('/reports/export/csv/?category=rooms').status_code, 400)
+
+    def test_gzip_when_accepted(self):
+        import gzip
+
+        response, body = self.export(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn(b'FOOD ORDERS REPORT', gzip.decompress(body))
+
+
+class ReservationTests(CatalogMixin, TestCase):
+    def test_full_room_type_is_rolled_back(self):
+        self.room_type.total_rooms = 1
+        self.room_type.save()
+        reservations.create_booking(
+            selections={'rooms': [self.room.pk]}, check_in=date(2025, 1, 10), check_out=date(2025, 1, 12),
+        )
+        with self.assertRaises(reservations.RoomUnavailable):
+            reservations.create_booking(
+                selections={'rooms': [self.room.pk], 'tours': [self.tour.pk]},
+                check_in=date(2025, 1, 11), check_out=date(2025, 1, 13),
+            )
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertFalse(RoomInventory.objects.filter(date=date(2025, 1, 12), booked__gt=0).exists())
+
+    def test_retried_date_change_moves_the_ledger(self):
+        booking = reservations.create_booking(
+            selections={'rooms': [self.room.pk]}, check_in=date(2030, 1, 10), check_out=date(2030, 1, 12),
+        )
+        booking = Booking.objects.get(pk=booking.pk)
+        locked = OperationalError('database is locked')
+        with mock.patch.object(reservations, 'check_capacity', side_effect=[locked, None]), \
+                mock.patch.object(reservations, 'RETRY_BACKOFF', 0):
+            reservations.update_booking(booking, check_in=date(2030, 2, 1), check_out=date(2030, 2, 5))
+
+        booked = dict(RoomInventory.objects.filter(booked__gt=0).values_list('date', 'booked'))
+        self.assertEqual(booked, {date(2030, 2, day): 1 for day in range(1, 5)})
+        inventory.rebuild()
+        self.assertEqual(dict(RoomInventory.objects.filter(booked__gt=0).values_list('date', 'booked')), booked)
+
+
+class ConcurrentReservationTests(CatalogMixin, TransactionTestCase):
+    """Many threads race for the same room type; none may overbook it."""
+
+    THREADS = 16
+
+    def test_no_overbooking_under_concurrency(self):
+        outcomes = []
+        start = threading.Barrier(self.THREADS)
+
+        def reserve():
+            start.wait()
+            try:
+                reservations.create_booking(
+                    selections={'rooms': [self.room.pk]},
+                    check_in=date(2025, 3, 1), check_out=date(2025, 3, 3),
+                )
+                outcomes.append('booked')
+            except reservations.RoomUnavailable:
+                outcomes.append('full')
+            except reservations.ReservationBusy:
+                outcomes.append('busy')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reserve) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        booked = Booking.objects.filter(rooms=self.room).count()
+        self.assertEqual(booked, outcomes.count('booked'))
+        self.assertLessEqual(booked, self.room_type.total_rooms)
+        self.assertGreaterEqual(booked, 1)
+        self.assertEqual(
+            set(RoomInventory.objects.values_list('booked', flat=True)), {booked}
+        )
+
+
+class JobWorkerTests(TransactionTestCase):
+    def test_worker_command_drains_queue(self):
+        for label in ('a', 'b', 'c', 'd'):
+            jobs.enqueue('test_record', label=label)
+        call_command('run_jobs', '--once', '--threads=2', stdout=StringIO())
+        self.assertEqual(
+            sorted(Job.objects.filter(status=Job.DONE).values_list('result', flat=True)), ['a', 'b', 'c', 'd']
+        )
+
+
+class SQLiteChannelLayerTests(SimpleTestCase):
+    def setUp(self):
+        files = tempfile.TemporaryDirectory()
+        self.addCleanup(files.cleanup)
+        self.path = os.path.join(files.name, 'channels.sqlite3')
+
+    def test_groups_reach_channels_in_other_layer_instances(self):
+        # Two instances on one file stand in for two worker processes
+        sender, receiver = (SQLiteChannelLayer(path=self.path, capacity=2) for _ in range(2))
+
+        async def scenario():
+            first, second = await receiver.new_channel(), await receiver.new_channel()
+            await receiver.group_add('staff', first)
+            await receiver.group_add('staff', second)
+            await sender.group_send('staff', {'type': 'hello', 'raw': b'\x00'})
+            received = [await receiver.receive(first), await receiver.receive(second)]
+
+            await receiver.group_discard('staff', second)
+            await sender.group_send('staff', {'type': 'again'})
+            await sender.send(second, {'type': 'direct'})
+            received += [await receiver.receive(first), await receiver.receive(second)]
+
+            await sender.send(second, {'type': 'one'})
+            await sender.send(second, {'type': 'two'})
+            with self.assertRaises(ChannelFull):
+                await sender.send(second, {'type': 'three'})
+            return received
+
+        received = async_to_sync(scenario)()
+        self.assertEqual(received[0], {'type': 'hello', 'raw': b'\x00'})
+        self.assertEqual([message['type'] for message in received], ['hello', 'hello', 'again', 'direct'])
+
+    def test_expired_messages_are_not_delivered(self):
+        layer = SQLiteChannelLayer(path=self.path, expiry=0)
+
+        async def scenario():
+            channel = await layer.new_channel()
+            await layer.send(channel, {'type': 'stale'})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(layer.receive(channel), 0.3)
+
+        async_to_sync(scenario)()
+
+    def test_notification_consumer_streams_per_user(self):
+        layers = {'default': {
+            'BACKEND': 'myApp.channel_layers.SQLiteChannelLayer', 'CONFIG': {'path': self.path},
+        }}
+        # channels.testing needs daphne, so drive the ASGI protocol directly
+        scope = {'type': 'websocket', 'path': '/ws/notifications/', 'headers': [], 'subprotocols': []}
+
+        async def scenario():
+            anonymous = ApplicationCommunicator(NotificationConsumer.as_asgi(), dict(scope, user=AnonymousUser()))
+            await anonymous.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await anonymous.receive_output(2))['type'], 'websocket.close')
+
+            user = User(pk=7, username='guest')
+            communicator = ApplicationCommunicator(NotificationConsumer.as_asgi(), dict(scope, user=user))
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(2))['type'], 'websocket.accept')
+            other_process = SQLiteChannelLayer(path=self.path)
+            await other_process.group_send(
+                user_group(8), {'type': 'send_notification', 'message': 'Not yours', 'unread': 1}
+            )
+            await other_process.group_send(
+                user_group(7), {'type': 'send_notification', 'id': 3, 'message': 'New booking #1', 'unread': 2}
+            )
+            sent = await communicator.receive_output(2)
+            self.assertEqual(json.loads(sent['text']), {'id': 3, 'message': 'New booking #1', 'unread': 2})
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(2)
+
+        with override_settings(CHANNEL_LAYERS=layers):
+            async_to_sync(scenario)()
+
+
+class NotificationReplayTests(TransactionTestCase):
+    # The consumer reads the backlog on a database thread, so the rows must be committed
+
+    def setUp(self):
+        self.user = User.objects.create_user('guest')
+        self.notifications = [
+            Notification.objects.create(user=self.user, message=f'Booking #{n}') for n in range(3)
+        ]
+        Notification.objects.create(user=User.objects.create_user('other'), message='Not yours')
+
+    def connect(self, query_string):
+        scope = {
+            'type': 'websocket', 'path': '/ws/notifications/', 'headers': [], 'subprotocols': [],
+            'query_string': query_string, 'user': self.user,
+        }
+
+        async def scenario():
+            communicator = ApplicationCommunicator(NotificationConsumer.as_asgi(), scope)
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(5))['type'], 'websocket.accept')
+            sent = []
+            while not await communicator.receive_nothing(0.2):
+                sent.append(json.loads((await communicator.receive_output(1))['text']))
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(5)
+            return sent
+
+        return async_to_sync(scenario)()
+
+    def test_reconnect_replays_only_missed_notifications(self):
+        first, second, third = self.notifications
+        sent = self.connect(f'last_seen_id={first.pk}'.encode())
+        self.assertEqual([event['id'] for event in sent], [second.pk, third.pk])
+        self.assertEqual(sent[0], {
+            'id': second.pk, 'message': 'Booking #1', 'notification_type': 'booking',
+            'unread': 3, 'replayed': True,
+        })
+        self.assertEqual(self.connect(f'last_seen_id={third.pk}'.encode()), [])
+        # A first connection has nothing to catch up on
+        self.assertEqual(self.connect(b''), [])
+
+    def test_too_large_a_gap_asks_the_client_to_reload(self):
+        with mock.patch('myApp.consumers.REPLAY_LIMIT', 1):
+            sent = self.connect(b'last_seen_id=0')
+        self.assertEqual(sent, [{'resync': True, 'unread': 3}])
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class AsgiRoutingTests(TransactionTestCase):
+    # The auth middleware reads the session from another thread, so the rows must be committed
+
+    def connect(self, origin=b'http://testserver', session_key=None):
+        from EpicTrailAdventures.asgi import application
+
+        headers = [(b'origin', origin), (b'host', b'testserver')]
+        if session_key:
+            headers.append((b'cookie', f'sessionid={session_key}'.encode()))
+        scope = {'type': 'websocket', 'path': '/ws/notifications/', 'headers': headers, 'subprotocols': []}
+
+        async def handshake():
+            communicator = ApplicationCommunicator(application, scope)
+            await communicator.send_input({'type': 'websocket.connect'})
+            reply = await communicator.receive_output(5)
+            if reply['type'] == 'websocket.accept':
+                await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+                await communicator.wait(5)
+            return reply['type']
+
+        return async_to_sync(handshake)()
+
+    def test_only_signed_in_same_origin_sockets_are_accepted(self):
+        self.client.force_login(User.objects.create_user('guest'))
+        session_key = self.client.cookies['sessionid'].value
+        self.assertEqual(self.connect(session_key=session_key), 'websocket.accept')
+        self.assertEqual(self.connect(), 'websocket.close')
+        self.assertEqual(self.connect(origin=b'http://evil.example', session_key=session_key), 'websocket.close')
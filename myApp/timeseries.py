@@ -0,0 +1,190 @@
+"""
+Booking and food order time series for the analytics charts.
+
+series() buckets bookings (count, guests, revenue) and food orders (count,
+revenue) by day, week, month or year over a date range, on either the date a
+booking was made (created_at) or the date it starts (check_in). Buckets are
+whole dates truncated in the database, so January 2025 and January 2026 are
+separate points, and every bucket in the range is present, zero-filled.
+
+created_at series are read from the daily rollup table (rollups.py), a few
+rows per day. check_in series truncate the Booking and FoodOrder rows
+themselves, through indexes that cover the columns summed.
+
+Values are typed arrays (array.array), one entry per label, so they pickle
+compactly into the cache and numpy.asarray()/frombuffer() take them without
+conversion. Results are cached in the shared tier under the report data
+version, so any change to bookings, orders or prices gives a fresh series.
+"""
+from array import array
+from datetime import timedelta
+
+from django.core.cache import caches
+from django.db.models import Count, DateField, DecimalField, F, Sum
+from django.db.models.functions import Trunc
+
+from . import rollups, stats
+from .models import Booking, DailyRevenueRollup, FoodOrder
+
+GRANULARITIES = ('day', 'week', 'month', 'year')
+FIELDS = ('created_at', 'check_in')
+MAX_BUCKETS = 1000
+
+# Series array -> array.array typecode
+COLUMNS = {
+    'bookings': 'q',
+    'pax': 'q',
+    'revenue': 'd',
+    'food_orders': 'q',
+    'food_revenue': 'd',
+}
+
+LABEL_FORMATS = {
+    'day': '%d %b %Y',
+    'week': 'w/c %d %b %Y',
+    'month': '%b %Y',
+    'year': '%Y',
+}
+
+
+def bucket_start(day, granularity):
+    """The first day of the bucket `day` falls in. Weeks start on Monday, as in the database."""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    if granularity == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_bucket(start, granularity):
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    if granularity == 'year':
+        return start.replace(year=start.year + 1)
+    return start + timedelta(days=1)
+
+
+def previous_bucket(start, granularity):
+    if granularity == 'week':
+        return start - timedelta(days=7)
+    if granularity == 'month':
+        return (start - timedelta(days=1)).replace(day=1)
+    if granularity == 'year':
+        return start.replace(year=start.year - 1)
+    return start - timedelta(days=1)
+
+
+def recent(granularity, count, today):
+    """(start, end) covering the `count` buckets up to and including `today`'s."""
+    start = bucket_start(today, granularity)
+    for _ in range(count - 1):
+        start = previous_bucket(start, granularity)
+    return start, today
+
+
+def buckets(start, end, granularity):
+    """The start date of every bucket from `start` to `end` inclusive, oldest first."""
+    found = []
+    current = bucket_start(start, granularity)
+    while current <= end:
+        if len(found) == MAX_BUCKETS:
+            raise ValueError(f"More than {MAX_BUCKETS} {granularity} buckets; pick a shorter range or coarser granularity.")
+        found.append(current)
+        current = next_bucket(current, granularity)
+    return found
+
+
+class Series:
+    """Zero-filled arrays of bookings, guests and revenue, one entry per bucket in `labels`."""
+
+    def __init__(self, granularity, field, labels):
+        self.granularity = granularity
+        self.field = field
+        self.labels = labels
+        for name, typecode in COLUMNS.items():
+            setattr(self, name, array(typecode, [0]) * len(labels))
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def display_labels(self):
+        return [label.strftime(LABEL_FORMATS[self.granularity]) for label in self.labels]
+
+    def columns(self):
+        """{name: array} for every series, e.g. to build a DataFrame or chart datasets."""
+        return {name: getattr(self, name) for name in COLUMNS}
+
+
+def compute(start, end, granularity='month', field='created_at'):
+    """
+    The uncached Series for bookings and orders dated `start` to `end`
+    inclusive. A range that starts or ends mid-bucket only counts its own days
+    in the first and last buckets.
+    """
+    result = Series(granularity, field, buckets(start, end, granularity))
+    positions = {bucket: index for index, bucket in enumerate(result.labels)}
+
+    def add(bucket, **values):
+        for name, value in values.items():
+            getattr(result, name)[positions[bucket]] += value or 0
+
+    truncated = Trunc(field if field == 'check_in' else 'date', granularity, output_field=DateField())
+
+    if field == 'created_at':
+        rows = (
+            DailyRevenueRollup.objects
+            .filter(date__range=(start, end), category__in=[rollups.ALL_BOOKINGS, rollups.FOOD_ORDERS])
+            .annotate(bucket=truncated).values('bucket', 'category').order_by()
+            .annotate(count=Sum('bookings'), guests=Sum('pax'), total=Sum('revenue'))
+        )
+        for row in rows:
+            if row['category'] == rollups.ALL_BOOKINGS:
+                add(row['bucket'], bookings=row['count'], pax=row['guests'], revenue=float(row['total'] or 0))
+            else:
+                add(row['bucket'], food_orders=row['count'], food_revenue=float(row['total'] or 0))
+    else:
+        booking_rows = (
+            Booking.objects.filter(check_in__range=(start, end))
+            .annotate(bucket=truncated).values('bucket').order_by()
+            .annotate(count=Count('id'), guests=Sum('pax'), total=Sum('total_amount'))
+        )
+        for row in booking_rows:
+            add(row['bucket'], bookings=row['count'], pax=row['guests'], revenue=float(row['total'] or 0))
+        order_rows = (
+            FoodOrder.objects.filter(check_in__range=(start, end))
+            .annotate(bucket=truncated).values('bucket').order_by()
+            .annotate(count=Count('id'), total=Sum(
+                F('food__price_per_person') * F('quantity'), output_field=DecimalField(),
+            ))
+        )
+        for row in order_rows:
+            add(row['bucket'], food_orders=row['count'], food_revenue=float(row['total'] or 0))
+
+    return result
+
+
+def series(start, end, granularity='month', field='created_at'):
+    """
+    compute(), cached per range, granularity and field until the report data
+    changes. Raises ValueError for an unknown granularity or field, an end
+    before the start, or more than MAX_BUCKETS buckets.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity {granularity!r}; use one of {', '.join(GRANULARITIES)}.")
+    if field not in FIELDS:
+        raise ValueError(f"Unknown field {field!r}; use one of {', '.join(FIELDS)}.")
+    if end < start:
+        raise ValueError("The end date is before the start date.")
+
+    cache = caches[stats.SHARED_CACHE]
+    key = f'timeseries:{stats.report_data_version()}:{field}:{granularity}:{start.isoformat()}:{end.isoformat()}'
+    result = cache.get(key)
+    if result is None:
+        result = compute(start, end, granularity, field)
+        cache.set(key, result, stats.SHARED_TTL)
+    return result
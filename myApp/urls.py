@@ -1,6 +1,6 @@
 from django.urls import path
 from . import views  # Import views from the same app
-from .views import notifications_view, mark_notification_read
+from .views import notifications_view, mark_notification_read, mark_notifications_read
 from django.conf import settings
 from django.conf.urls.static import static
 
@@ -56,6 +56,7 @@ urlpatterns = [
     path('bookings/edit/<int:pk>/', views.edit_booking, name='edit_booking'),
     path('bookings/delete/<int:pk>/', views.delete_booking, name='delete_booking'),
     path('bookings/new/', views.create_booking, name='create_booking'),
+    path('bookings/availability/', views.room_availability, name='room_availability'),
     path('bookings/new/for-user/', views.admin_create_booking, name='create_user_booking'),  # booking on behalf of user
     
     path('menu/', views.food_menu, name='food_menu'),
@@ -68,9 +69,12 @@ urlpatterns = [
     
     path('notifications/', notifications_view, name='notifications'),
     path('notifications/<int:pk>/read/', mark_notification_read, name='mark_notification_read'),
+    path('notifications/read/', mark_notifications_read, name='mark_notifications_read'),
     
     path('explore/', views.explore, name='explore'),
     path('reports/', views.reports_analytics, name='reports_analytics'),
+    path('reports/export/csv/', views.export_report_csv, name='export_report_csv'),
+    path('reports/files/<slug:key>.<slug:export_format>', views.report_download, name='report_download'),
     
     path('duties/assign/', views.assign_duty, name='assign_duty'),
     path('duties/', views.duties, name='duties'),
@@ -80,6 +84,9 @@ urlpatterns = [
     path('upcoming-bookings/', views.upcoming_bookings_list, name='upcoming_bookings'),
     
     path('backup/', views.backup_data, name='backup_data'),
+    path('jobs/', views.job_list, name='job_list'),
+    path('jobs/<int:pk>/', views.job_detail, name='job_detail'),
+    path('jobs/<int:pk>/download/', views.job_download, name='job_download'),
     path("system-settings/", views.system_settings, name="system_settings"),
 
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -7,23 +7,22 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.core.paginator import Paginator
 from django.db.models import Q
 from .models import Profile
-from .models import Activity, Package, Tour, Food, Room, RoomType, RoomBooking, Booking, Notification, Duty, FoodOrder
+from .models import Activity, Package, Tour, Food, Room, RoomType, Booking, Notification, Duty, FoodOrder
 from django.utils.dateparse import parse_date
 # from django.db.models import Count, Sum
-from django.db.models import F, Sum, Count, ExpressionWrapper, DecimalField
-import csv, io
-from django.http import HttpResponse
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from django.db.models.functions import ExtractMonth
-from datetime import datetime
+from django.db.models import Max
+import os
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from django.views.decorators.http import etag, require_POST
+from django.core.cache import caches
+from datetime import timedelta
 from django.utils.timezone import now
 from django.utils import timezone
-import calendar
-import requests, base64
 from django.conf import settings
-from django.core import management
-from .models import SystemSetting
+from .models import Job, SystemSetting
+from . import backups, inventory, jobs, pagination, popularity, reports, reservations, rollups, stats, timeseries
 
 # Create your views here.
 
@@ -703,25 +702,23 @@ def book_room(request, pk):
         check_in = parse_date(request.POST['check_in'])
         check_out = parse_date(request.POST['check_out'])
 
-        # Count existing overlapping bookings
-        overlapping = RoomBooking.objects.filter(
-            room_type=room,
-            check_in__lt=check_out,
-            check_out__gt=check_in
-        ).count()
-
-        if overlapping >= room.total_rooms:
+        # Busiest night of the stay, from the inventory ledger
+        if inventory.rooms_free(room, check_in, check_out) < 1:
             messages.error(request, "Sorry, no available rooms for the selected dates.")
             return redirect('list_rooms')
 
-        RoomBooking.objects.create(
-            room_type=room,
-            customer_name=request.POST['customer_name'],
-            customer_email=request.POST['customer_email'],
-            check_in=check_in,
-            check_out=check_out,
-            guests=request.POST['guests'],
-        )
+        try:
+            reservations.book_room_type(
+                room,
+                customer_name=request.POST['customer_name'],
+                customer_email=request.POST['customer_email'],
+                check_in=check_in,
+                check_out=check_out,
+                guests=request.POST['guests'],
+            )
+        except (reservations.RoomUnavailable, reservations.ReservationBusy) as exc:
+            messages.error(request, str(exc))
+            return redirect('list_rooms')
         messages.success(request, "Room booked successfully!")
         return redirect('list_rooms')
     return render(request, 'room_book.html', {'room': room})
@@ -761,16 +758,11 @@ def create_booking(request):
             return redirect("create_booking")
 
         # --- Validate room availability ---
-        for room_id in selected_room_ids:
-            room = get_object_or_404(Room, id=room_id)
-            overlapping = Booking.objects.filter(
-                rooms=room,
-                check_in__lt=check_out,
-                check_out__gt=check_in
-            ).count()
-            if overlapping >= room.room_type.total_rooms:
-                messages.error(request, f"Room '{room.name}' is fully booked for the selected dates.")
-                return redirect("create_booking")
+        availability = inventory.check_rooms(selected_room_ids, check_in, check_out)
+        if not availability.ok:
+            for message in availability.messages():
+                messages.error(request, message)
+            return redirect("create_booking")
 
         # --- Role-based restrictions ---
         if not (request.user.is_staff or request.user.is_superuser):
@@ -801,22 +793,27 @@ def create_booking(request):
         if selected_tour_ids:
             pax_details['tours'] = {'ids': selected_tour_ids, 'pax': tours_pax}
 
-        # --- Create booking ---
-        booking = Booking.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            customer_name=customer_name,
-            customer_email=customer_email,
-            check_in=check_in,
-            check_out=check_out,
-            pax=pax,
-            pax_details=pax_details
-        )
-
-        booking.activities.set(selected_activity_ids)
-        booking.packages.set(selected_package_ids)
-        booking.rooms.set(selected_room_ids)
-        booking.food.set(selected_food_ids)
-        booking.tours.set(selected_tour_ids)
+        # --- Create booking (all-or-nothing, rechecks capacity under lock) ---
+        try:
+            reservations.create_booking(
+                selections={
+                    'activities': selected_activity_ids,
+                    'packages': selected_package_ids,
+                    'rooms': selected_room_ids,
+                    'food': selected_food_ids,
+                    'tours': selected_tour_ids,
+                },
+                user=request.user if request.user.is_authenticated else None,
+                customer_name=customer_name,
+                customer_email=customer_email,
+                check_in=check_in,
+                check_out=check_out,
+                pax=pax,
+                pax_details=pax_details
+            )
+        except (reservations.RoomUnavailable, reservations.ReservationBusy) as exc:
+            messages.error(request, str(exc))
+            return redirect("create_booking")
 
         messages.success(request, "Booking created successfully!")
         return redirect("booking_list")
@@ -840,14 +837,67 @@ def create_booking(request):
     }
     return render(request, "booking_create.html", context)
 
+AVAILABILITY_DAYS = 90  # default window for room_availability
+AVAILABILITY_WINDOWS = (7, 30, 90, 180, 366)  # window lengths served; longer requests get the last
+AVAILABILITY_PAST_DAYS = 31  # how far before today a window may start
+AVAILABILITY_AHEAD_DAYS = 730  # how far after today a window may start
+
+def room_availability(request):
+    """
+    JSON: free rooms of every room type per night, for ?start=YYYY-MM-DD
+    (default today) and ?days=N. The window served starts on the Monday of
+    the (clamped) start date and runs for the shortest AVAILABILITY_WINDOWS
+    length covering the nights asked for, so the payload's own start and
+    days may differ from the query. This keeps the number of cached windows
+    small; each is cached until any booking data changes.
+    """
+    try:
+        start = parse_date(request.GET['start']) if request.GET.get('start') else timezone.localdate()
+        days = int(request.GET.get('days', AVAILABILITY_DAYS))
+    except ValueError:
+        start = days = None
+    if start is None or days is None or days < 1:
+        return JsonResponse({'error': "Pass a valid start date and a positive number of days."}, status=400)
+
+    today = timezone.localdate()
+    start = min(max(start, today - timedelta(days=AVAILABILITY_PAST_DAYS)), today + timedelta(days=AVAILABILITY_AHEAD_DAYS))
+    monday = start - timedelta(days=start.weekday())
+    wanted = days + (start - monday).days
+    days = next((window for window in AVAILABILITY_WINDOWS if window >= wanted), AVAILABILITY_WINDOWS[-1])
+    start = monday
+
+    cache = caches[stats.SHARED_CACHE]
+    key = f'availability:{stats.booking_data_version()}:{start.isoformat()}:{days}'
+    payload = cache.get(key)
+    if payload is None:
+        payload = inventory.availability_window(start, days)
+        cache.set(key, payload, stats.SHARED_TTL)
+    return JsonResponse(payload)
+
+# Sort options for the booking list (?sort=...)
+BOOKING_SORTS = {
+    'amount': 'priced_total',
+    '-amount': '-priced_total',
+    'balance': 'priced_balance',
+    '-balance': '-priced_balance',
+    'check_in': 'check_in',
+    '-check_in': '-check_in',
+}
+
 @login_required
 def booking_list(request):
+    # Amounts and balances are priced in SQL, so they can be sorted and filtered on
+    sort = request.GET.get('sort', '')
+    ordering = BOOKING_SORTS.get(sort, '-created_at')
     bookings = (
         Booking.objects
+        .with_totals()
         .select_related('user')
-        .prefetch_related('activities', 'packages', 'rooms', 'food', 'tours')
-        .order_by('-created_at')
+        .prefetch_related('activities', 'packages', 'rooms__room_type', 'food', 'tours')
+        .order_by(ordering, '-id')
     )
+    if request.GET.get('outstanding'):
+        bookings = bookings.filter(priced_balance__gt=0)
 
     if request.user.is_superuser:
         editable_ids = bookings.values_list('id', flat=True)
@@ -862,11 +912,15 @@ def booking_list(request):
         editable_ids = bookings.values_list('id', flat=True)
         base_template = 'base.user.html'
         template_name = 'bookings.user.html'  # Cards for normal users
+    if template_name == 'bookings.html':
+        # The table prints each package with its activities (Package.__str__)
+        bookings = bookings.prefetch_related('packages__activities')
 
     return render(request, template_name, {
         'bookings': bookings,
         'editable_ids': set(editable_ids),
         'base_template': base_template,
+        'sort': sort,
     })
 
 
@@ -883,7 +937,6 @@ def edit_booking(request, pk):
     if request.method == "POST":
         check_in = request.POST.get("check_in")
         check_out = request.POST.get("check_out")
-        guests = int(request.POST.get("guests", 1))
         selected_room_ids = request.POST.getlist("rooms")
 
         # Validate dates
@@ -892,31 +945,29 @@ def edit_booking(request, pk):
             return redirect("edit_booking", pk=booking.pk)
 
         # Validate room availability
-        for room_id in selected_room_ids:
-            room = get_object_or_404(Room, id=room_id)
-            overlapping = Booking.objects.filter(
-                rooms=room,
-                check_in__lt=check_out,
-                check_out__gt=check_in
-            ).exclude(id=booking.id).count()
-
-            if overlapping >= room.room_type.total_rooms:
-                messages.error(
-                    request,
-                    f"Room '{room.name}' is fully booked for the selected dates."
-                )
-                return redirect("edit_booking", pk=booking.pk)
+        availability = inventory.check_rooms(selected_room_ids, check_in, check_out, exclude_booking=booking)
+        if not availability.ok:
+            for message in availability.messages():
+                messages.error(request, message)
+            return redirect("edit_booking", pk=booking.pk)
 
         # Update booking details
-        booking.check_in = check_in
-        booking.check_out = check_out
-        booking.guests = guests
-        booking.activities.set(request.POST.getlist("activities"))
-        booking.packages.set(request.POST.getlist("packages"))
-        booking.rooms.set(selected_room_ids)
-        booking.food.set(request.POST.getlist("food"))
-        booking.tours.set(request.POST.getlist("tours"))
-        booking.save()
+        try:
+            reservations.update_booking(
+                booking,
+                selections={
+                    'activities': request.POST.getlist("activities"),
+                    'packages': request.POST.getlist("packages"),
+                    'rooms': selected_room_ids,
+                    'food': request.POST.getlist("food"),
+                    'tours': request.POST.getlist("tours"),
+                },
+                check_in=check_in,
+                check_out=check_out,
+            )
+        except (reservations.RoomUnavailable, reservations.ReservationBusy) as exc:
+            messages.error(request, str(exc))
+            return redirect("edit_booking", pk=booking.pk)
 
         messages.success(request, "Booking updated successfully!")
         return redirect("booking_list")
@@ -955,13 +1006,15 @@ def delete_booking(request, pk):
     messages.success(request, "Booking deleted successfully!")
     return redirect('booking_list')
 
+NOTIFICATIONS_PER_PAGE = 50
+
 @login_required
 @user_passes_test(admin_required)
 def notifications_view(request):
     if request.user.is_staff:
-        notifications = Notification.objects.all().order_by('-created_at')
+        notifications = Notification.objects.all()
     else:
-        notifications = request.user.notifications.all().order_by('-created_at')
+        notifications = request.user.notifications.all()
 
     # Filtering
     notif_type = request.GET.get('type')
@@ -971,7 +1024,24 @@ def notifications_view(request):
     if unread:
         notifications = notifications.filter(is_read=False)
 
-    return render(request, 'notifications.html', {'notifications': notifications})
+    # Keyset pages (?before=<cursor>) cost the same however far back they are
+    page = pagination.newest_first(notifications, request.GET.get('before'), NOTIFICATIONS_PER_PAGE)
+    older_query = None
+    if page.has_next:
+        query = request.GET.copy()
+        query['before'] = page.next_cursor
+        older_query = query.urlencode()
+    newest_query = request.GET.copy()
+    newest_query.pop('before', None)
+
+    return render(request, 'notifications.html', {
+        'notifications': page,
+        'older_query': older_query,
+        'newest_query': newest_query.urlencode() if 'before' in request.GET else None,
+        'unread_count': stats.unread_count(request.user.pk),
+        # The socket replays anything newer than this if it has to reconnect
+        'last_seen_id': request.user.notifications.aggregate(last=Max('id'))['last'] or 0,
+    })
 
 @login_required
 @user_passes_test(admin_required)
@@ -979,13 +1049,36 @@ def mark_notification_read(request, pk):
     notif = get_object_or_404(Notification, pk=pk)
     if notif.user == request.user or request.user.is_staff:
         notif.is_read = True
-        notif.save()
+        notif.save(update_fields=['is_read'])
+    return redirect('notifications')
+
+@login_required
+@user_passes_test(admin_required)
+@require_POST
+def mark_notifications_read(request):
+    """
+    Mark the ticked notifications (ids) read, or with all=1 every one of the
+    user's own, in a single UPDATE.
+    """
+    if request.POST.get('all'):
+        notifications = request.user.notifications.all()
+        user_ids = [request.user.pk]
+    else:
+        ids = [pk for pk in request.POST.getlist('ids') if pk.isdigit()]
+        notifications = Notification.objects.filter(pk__in=ids)
+        if not request.user.is_staff:
+            notifications = notifications.filter(user=request.user)
+        user_ids = set(notifications.filter(is_read=False).values_list('user_id', flat=True))
+    updated = notifications.mark_read()
+    stats.invalidate_unread(*user_ids)
+    messages.success(request, f"Marked {updated} notification{'s' if updated != 1 else ''} as read.")
     return redirect('notifications')
 
 def explore(request):
-    activities = Activity.objects.all()
-    rooms = Room.objects.all()
-    tours = Tour.objects.all()
+    # Most booked first, from the popularity counters (see popularity.py)
+    activities = popularity.with_popularity(Activity.objects.all(), 'activities').order_by('-num_bookings', 'name')
+    rooms = popularity.with_popularity(Room.objects.all(), 'rooms').order_by('-num_bookings', 'name')
+    tours = popularity.with_popularity(Tour.objects.all(), 'tours').order_by('-num_bookings', 'name')
 
     # Decide base template based on user authentication
     base_template = 'base.user.html' if request.user.is_authenticated else 'base.html'
@@ -997,186 +1090,80 @@ def explore(request):
         'base_template': base_template,
     })
 
+# Buckets the analytics chart shows when no range is given, per granularity
+CHART_BUCKETS = {'day': 30, 'week': 12, 'month': 12, 'year': 5}
+
 @login_required
 @user_passes_test(lambda u: u.is_superuser)  # Only admin
 def reports_analytics(request):
-    from .models import Booking, Activity, Package, Room, Tour, FoodOrder
+    # Counts and revenue come from the daily rollup (see rollups.py), a few rows per day
+    summary = rollups.totals()
 
     # --- Bookings ---
-    bookings = Booking.objects.all()
-    total_bookings = bookings.count()
-    total_revenue = sum(b.amount_required for b in bookings)
+    total_bookings = summary[rollups.ALL_BOOKINGS]['bookings']
+    total_revenue = summary[rollups.ALL_BOOKINGS]['revenue']
 
     # --- Food Orders ---
-    orders = FoodOrder.objects.all()
-    total_orders = orders.count()
-
-    # Calculate revenue: food price * quantity
-    orders_with_total = orders.annotate(
-        order_total=ExpressionWrapper(
-            F("food__price_per_person") * F("quantity"),
-            output_field=DecimalField()
-        )
-    )
-    total_order_revenue = orders_with_total.aggregate(total=Sum("order_total"))["total"] or 0
+    total_orders = summary[rollups.FOOD_ORDERS]['bookings']
+    total_order_revenue = summary[rollups.FOOD_ORDERS]['revenue']
 
     # --- Revenue by category (bookings) ---
-    revenue_activities = sum(
-        sum(a.price_per_person * b.pax for a in b.activities.all()) for b in bookings
-    )
-    revenue_packages = sum(
-        sum(p.price_per_person * b.pax for p in b.packages.all()) for b in bookings
-    )
-    revenue_rooms = sum(
-        sum(r.room_type.price_per_night * b.pax * b.nights_spent for r in b.rooms.all()) for b in bookings
-    )
-    revenue_tours = sum(
-        sum(t.price_per_person * b.pax for t in b.tours.all()) for b in bookings
-    )
-
-    # --- Monthly performance (bookings only) ---
-    monthly_data = (
-        bookings.annotate(month=ExtractMonth('created_at'))
-        .values('month')
-        .annotate(total=Count('id'), revenue=Sum('paid'))
-    )
-
-    months = [calendar.month_abbr[i] for i in range(1, 13)]
-    monthly_bookings = [0] * 12
-    monthly_revenue = [0] * 12
-    for entry in monthly_data:
-        idx = entry['month'] - 1
-        monthly_bookings[idx] = entry['total']
-        monthly_revenue[idx] = float(entry['revenue'] or 0)
+    revenue_activities = summary['activities']['revenue']
+    revenue_packages = summary['packages']['revenue']
+    revenue_rooms = summary['rooms']['revenue']
+    revenue_tours = summary['tours']['revenue']
+
+    # --- Bookings and revenue over time (see timeseries.py) ---
+    granularity = request.GET.get('granularity') or 'month'
+    field = request.GET.get('field') or 'created_at'
+    try:
+        start = parse_date(request.GET['start']) if request.GET.get('start') else None
+        end = parse_date(request.GET['end']) if request.GET.get('end') else None
+        if any(request.GET.get(key) and value is None for key, value in (('start', start), ('end', end))):
+            raise ValueError("pass start and end as YYYY-MM-DD.")
+        if granularity in timeseries.GRANULARITIES and not (start and end):
+            default_start, default_end = timeseries.recent(
+                granularity, CHART_BUCKETS[granularity], timezone.localdate(),
+            )
+            start, end = start or default_start, end or default_end
+        chart = timeseries.series(start, end, granularity, field)
+    except ValueError as error:
+        return HttpResponse(f"Invalid chart range: {error}", status=400)
 
     # --- Pie chart (bookings + food orders) ---
     pie_labels = ["Activities", "Packages", "Rooms", "Tours", "Food Orders"]
     pie_data = [revenue_activities, revenue_packages, revenue_rooms, revenue_tours, total_order_revenue]
 
-    # --- Top booked items ---
-    popular_activities = Activity.objects.annotate(num_bookings=Count('booking')).order_by('-num_bookings')[:5]
-    popular_packages = Package.objects.annotate(num_bookings=Count('booking')).order_by('-num_bookings')[:5]
-    popular_rooms = Room.objects.annotate(num_bookings=Count('booking')).order_by('-num_bookings')[:5]
-    popular_tours = Tour.objects.annotate(num_bookings=Count('booking')).order_by('-num_bookings')[:5]
-
-    # ---------------- CSV Export ----------------
-    if request.GET.get("export") == "csv":
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = f'attachment; filename="EpicTrail-Report_{datetime.now().strftime("%Y%m%d")}.csv"'
-        writer = csv.writer(response)
-
-        # --- Bookings Report ---
-        writer.writerow(["--- BOOKINGS REPORT ---"])
-        writer.writerow(["Customer", "Booking Date", "Guests", "Revenue (KSh)"])
-        bookings_total = 0
-        for b in bookings:
-            customer = getattr(b, "display_customer", str(b.customer_name))
-            booking_date = b.created_at.strftime('%Y-%m-%d')
-            revenue = round(b.amount_required, 2)
-            bookings_total += revenue
-            writer.writerow([customer, booking_date, b.pax, revenue])
-
-        writer.writerow(["", "", "Total Bookings Revenue", bookings_total])
-        writer.writerow([])
-
-        # --- Food Orders Report ---
-        writer.writerow(["--- FOOD ORDERS REPORT ---"])
-        writer.writerow(["Customer", "Order Date", "Food Item", "Quantity", "Revenue (KSh)"])
-        food_total = 0
-        for o in orders_with_total:
-            customer = str(o.user) if o.user else "Guest"
-            order_date = o.created_at.strftime('%Y-%m-%d')
-            food_name = o.food.name
-            revenue = round(o.order_total, 2)
-            food_total += revenue
-            writer.writerow([customer, order_date, food_name, o.quantity, revenue])
-
-        writer.writerow(["", "", "", "Total Food Revenue", food_total])
-
-        return response
-
-    # ---------------- PDF Export ----------------
-    if request.GET.get("export") == "pdf":
-        response = HttpResponse(content_type="application/pdf")
-        response["Content-Disposition"] = f'attachment; filename="EpicTrail-Report_{datetime.now().strftime("%Y%m%d")}.pdf"'
-
-        p = canvas.Canvas(response, pagesize=A4)
-        width, height = A4
-
-        # Title
-        p.setFont("Helvetica-Bold", 18)
-        p.drawString(50, height - 50, "EpicTrail Adventures - Analytics Report")
-        p.setFont("Helvetica", 10)
-        p.drawString(50, height - 70, f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-
-        # --- Bookings Section ---
-        y = height - 110
-        p.setFont("Helvetica-Bold", 14)
-        p.drawString(50, y, "Bookings Report")
-        y -= 30
-        p.setFont("Helvetica-Bold", 12)
-        p.drawString(50, y, "Customer")
-        p.drawString(200, y, "Booking Date")
-        p.drawString(350, y, "Revenue (KSh)")
-        p.setFont("Helvetica", 10)
-
-        bookings_total = 0
-        for b in bookings:
-            y -= 20
-            if y < 80:
-                p.showPage()
-                y = height - 50
-            customer = getattr(b, "display_customer", str(b.customer_name))
-            booking_date = b.created_at.strftime('%Y-%m-%d')
-            revenue = round(b.amount_required, 2)
-            bookings_total += revenue
-            p.drawString(50, y, customer)
-            p.drawString(200, y, booking_date)
-            p.drawString(350, y, f"KSh {revenue:,.2f}")
-
-        y -= 30
-        p.setFont("Helvetica-Bold", 12)
-        p.drawString(50, y, f"Total Bookings Revenue: KSh {bookings_total:,.2f}")
-
-        # --- Food Orders Section ---
-        y -= 60
-        p.setFont("Helvetica-Bold", 14)
-        p.drawString(50, y, "Food Orders Report")
-        y -= 30
-        p.setFont("Helvetica-Bold", 12)
-        p.drawString(50, y, "Customer")
-        p.drawString(200, y, "Order Date")
-        p.drawString(300, y, "Food Item")
-        p.drawString(450, y, "Revenue (KSh)")
-        p.setFont("Helvetica", 10)
-
-        food_total = 0
-        for o in orders_with_total:
-            y -= 20
-            if y < 80:
-                p.showPage()
-                y = height - 50
-            customer = str(o.user) if o.user else "Guest"
-            order_date = o.created_at.strftime('%Y-%m-%d')
-            food_name = o.food.name
-            revenue = round(o.order_total, 2)
-            food_total += revenue
-            p.drawString(50, y, customer)
-            p.drawString(200, y, order_date)
-            p.drawString(300, y, food_name)
-            p.drawString(450, y, f"KSh {revenue:,.2f}")
-
-        y -= 30
-        p.setFont("Helvetica-Bold", 12)
-        p.drawString(50, y, f"Total Food Revenue: KSh {food_total:,.2f}")
-
-        p.showPage()
-        p.save()
-        return response
+    # --- Top booked items, from the popularity counters (see popularity.py) ---
+    top_window = request.GET.get('top_window')
+    if top_window and top_window not in [str(days) for days in popularity.WINDOWS]:
+        return HttpResponse(f"Invalid top_window; use one of {', '.join(map(str, popularity.WINDOWS))}.", status=400)
+    window = int(top_window) if top_window else None
+    popular_activities = popularity.top('activities', window=window)
+    popular_packages = popularity.top('packages', window=window)
+    popular_rooms = popularity.top('rooms', window=window)
+    popular_tours = popularity.top('tours', window=window)
+
+    # ---------------- CSV / PDF Export ----------------
+    export_format = request.GET.get("export")
+    if export_format == 'csv':
+        # Streamed straight to the browser, however large (see export_report_csv)
+        return redirect('export_report_csv')
+    if export_format in reports.EXPORT_FORMATS:
+        # A report whose data has not changed since it was last built is served as is
+        key = reports.artifact_key(export_format)
+        if os.path.exists(reports.artifact_path(key, export_format)):
+            return redirect('report_download', key=key, export_format=export_format)
+        job = Job.objects.filter(
+            task='export_report', kwargs__key=key, status__in=[Job.QUEUED, Job.RUNNING],
+        ).first()
+        if job is None:
+            job = jobs.enqueue('export_report', user=request.user, export_format=export_format, key=key)
+        messages.info(request, f"Your {export_format.upper()} report is being prepared.")
+        return redirect('job_detail', pk=job.pk)
 
     # ---------------- Web Render ----------------
     return render(request, "reports_analytics.html", {
-        "bookings": bookings,
         "total_bookings": total_bookings,
         "total_revenue": total_revenue,
         "revenue_activities": revenue_activities,
@@ -1185,16 +1172,51 @@ def reports_analytics(request):
         "revenue_tours": revenue_tours,
         "total_orders": total_orders,
         "total_order_revenue": total_order_revenue,
-        "months": months,
-        "monthly_bookings": monthly_bookings,
-        "monthly_revenue": monthly_revenue,
+        "chart_labels": chart.display_labels,
+        "chart_bookings": chart.bookings.tolist(),
+        "chart_revenue": chart.revenue.tolist(),
+        "chart_food_revenue": chart.food_revenue.tolist(),
+        "chart_granularity": granularity,
+        "chart_field": field,
+        "chart_start": start,
+        "chart_end": end,
         "pie_labels": pie_labels,
         "pie_data": pie_data,
         "popular_activities": popular_activities,
         "popular_packages": popular_packages,
         "popular_rooms": popular_rooms,
         "popular_tours": popular_tours,
+        "top_window": window,
+        "top_windows": popularity.WINDOWS,
     })
+
+@login_required
+@user_passes_test(admin_required)
+def export_report_csv(request):
+    """
+    Stream the bookings and food orders CSV report. Takes optional ?start and
+    ?end dates (YYYY-MM-DD, inclusive) and ?category=bookings|food_orders,
+    which may be repeated. Compressed with gzip when the client accepts it.
+    """
+    try:
+        start = parse_date(request.GET['start']) if request.GET.get('start') else None
+        end = parse_date(request.GET['end']) if request.GET.get('end') else None
+        valid = all(value or not request.GET.get(key) for key, value in (('start', start), ('end', end)))
+    except ValueError:
+        valid = False
+    categories = [c for c in request.GET.getlist('category') if c] or reports.EXPORT_CATEGORIES
+    if not valid or not set(categories) <= set(reports.EXPORT_CATEGORIES):
+        return HttpResponse("Pass start and end as YYYY-MM-DD and category as bookings or food_orders.", status=400)
+
+    chunks = reports.csv_chunks(reports.csv_rows(start=start, end=end, categories=categories))
+    gzipped = 'gzip' in request.headers.get('Accept-Encoding', '')
+    response = StreamingHttpResponse(compress_sequence(chunks) if gzipped else chunks, content_type='text/csv')
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['Content-Disposition'] = f'attachment; filename="{reports.export_filename("csv")}"'
+    return response
+
 # def reports_analytics(request):
 #     from .models import Booking, Activity, Package, Room, Tour #, FoodOrder
 
@@ -1432,8 +1454,6 @@ def manage_orders(request):
     return render(request, "manage_orders.html", {"orders": orders})
 
 
-from django.views.decorators.http import require_POST
-
 @login_required
 @user_passes_test(is_admin)
 @require_POST
@@ -1448,54 +1468,101 @@ def update_order_status(request, order_id):
         messages.error(request, "Invalid status.")
     return redirect('manage_orders')
 
-def initiate_stk_push(phone, amount, account_reference="EpicTrail Adventures", transaction_desc="Booking Payment"):
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    password = base64.b64encode(
-        f"{settings.MPESA_SHORTCODE}{settings.MPESA_PASSKEY}{timestamp}".encode('utf-8')
-    ).decode('utf-8')
-
-    # Get OAuth token
-    token_url = f"https://{settings.MPESA_ENVIRONMENT}.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-    response = requests.get(token_url, auth=(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET))
-    access_token = response.json()['access_token']
-
-    # STK Push URL
-    stk_url = f"https://{settings.MPESA_ENVIRONMENT}.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
-    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
-
-    payload = {
-        "BusinessShortCode": settings.MPESA_SHORTCODE,
-        "Password": password,
-        "Timestamp": timestamp,
-        "TransactionType": "CustomerPayBillOnline",
-        "Amount": amount,
-        "PartyA": phone,
-        "PartyB": settings.MPESA_SHORTCODE,
-        "PhoneNumber": phone,
-        "CallBackURL": settings.CALLBACK_URL,
-        "AccountReference": account_reference,
-        "TransactionDesc": transaction_desc,
-    }
+def last_backup_checkpoint():
+    """The checkpoint recorded by the most recent finished backup job, if any."""
+    finished = Job.objects.filter(task='backup_data', status=Job.DONE).order_by('-finished_at', '-pk')
+    for result in finished.values_list('result', flat=True).iterator():
+        if result and result.get('checkpoint') is not None:
+            return result['checkpoint']
+    return None
 
-    res = requests.post(stk_url, json=payload, headers=headers)
-    return res.json()
 
 @login_required
 @user_passes_test(admin_required)
 def backup_data(request):
     """
-    Creates a downloadable JSON backup of the database.
+    Queues a backup of the database; the job page links to the download.
+    Takes ?kind=ndjson (default; JSON lines readable by loaddata) or sqlite
+    (a binary snapshot) and ?compression=gzip (default), zstd or none. With
+    ?since=<checkpoint>, or ?since=last for the checkpoint the latest
+    finished backup ended at, only the JSON lines changed after it.
     """
-    # Create an in-memory file
-    buffer = io.StringIO()
+    kind = request.GET.get('kind') or 'ndjson'
+    compression = request.GET.get('compression') or 'gzip'
+    try:
+        backups.check_options(kind, compression)
+    except ValueError as error:
+        return HttpResponse(str(error), status=400)
+    options = {'kind': kind, 'compression': compression}
+    since = request.GET.get('since')
+    if since:
+        if kind != 'ndjson':
+            return HttpResponse("Incremental backups are JSON lines only.", status=400)
+        if since == 'last':
+            since = last_backup_checkpoint()
+            if since is None:
+                return HttpResponse("No finished backup to continue from; take a full backup first.", status=400)
+        elif not since.isdigit():
+            return HttpResponse("since must be a checkpoint number or 'last'.", status=400)
+        options['since'] = int(since)
+    job = jobs.enqueue('backup_data', user=request.user, **options)
+    messages.info(request, "The backup is being prepared.")
+    return redirect('job_detail', pk=job.pk)
+
+
+# ---------------- Background jobs ----------------
 
-    # Dump all data into the buffer
-    management.call_command('dumpdata', format='json', indent=2, stdout=buffer)
+@login_required
+@user_passes_test(admin_required)
+def job_list(request):
+    status = request.GET.get('status', '')
+    job_qs = Job.objects.select_related('user').order_by('-created_at')
+    if status:
+        job_qs = job_qs.filter(status=status)
+    page = Paginator(job_qs, 50).get_page(request.GET.get('page'))
+    return render(request, 'jobs.html', {
+        'jobs': page,
+        'status': status,
+        'statuses': Job.STATUS_CHOICES,
+    })
+
+
+@login_required
+@user_passes_test(admin_required)
+def job_detail(request, pk):
+    job = get_object_or_404(Job.objects.select_related('user'), pk=pk)
+    return render(request, 'job_detail.html', {'job': job})
+
+
+@login_required
+@user_passes_test(admin_required)
+def job_download(request, pk):
+    job = get_object_or_404(Job, pk=pk, status=Job.DONE)
+    if not job.result or 'file' not in job.result:
+        raise Http404("This job has no file to download.")
+    path = os.path.join(jobs.files_dir(), os.path.basename(job.result['file']))
+    if not os.path.exists(path):
+        raise Http404("The file for this job is no longer available.")
+    return FileResponse(
+        open(path, 'rb'), as_attachment=True,
+        filename=job.result['filename'], content_type=job.result['content_type'],
+    )
 
-    # Prepare HTTP response
-    filename = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    response = HttpResponse(buffer.getvalue(), content_type='application/json')
-    response['Content-Disposition'] = f'attachment; filename={filename}'
+@login_required
+@user_passes_test(admin_required)
+@etag(lambda request, key, export_format: key)
+def report_download(request, key, export_format):
+    """A stored report (see reports.artifact_key). Its name changes with its content, so it never goes stale."""
+    if export_format not in reports.EXPORT_FORMATS:
+        raise Http404("Unknown report format.")
+    path = reports.artifact_path(key, export_format)
+    if not os.path.exists(path):
+        raise Http404("This report is no longer available.")
+    response = FileResponse(
+        open(path, 'rb'), as_attachment=True,
+        filename=reports.export_filename(export_format), content_type=reports.EXPORT_FORMATS[export_format],
+    )
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
     return response
 
 @login_required
@@ -1513,7 +1580,11 @@ def system_settings(request):
         settings.enable_stripe = "enable_stripe" in request.POST
         settings.max_daily_bookings = int(request.POST.get("max_daily_bookings", 100))
         settings.discount_rate = request.POST.get("discount_rate", 0)
+        settings.notification_retention_days = int(request.POST.get("notification_retention_days", 90))
+        settings.archive_notifications = "archive_notifications" in request.POST
         settings.save()
+        # Apply the retention policy in the background rather than waiting for cron
+        jobs.enqueue('prune_notifications', user=request.user)
         return redirect("admin_dashboard")
 
     return render(request, "system_settings.html", {"settings": settings})
@@ -1535,20 +1606,24 @@ def admin_create_booking(request):
         check_out = request.POST.get('check_out')
         pax = request.POST.get('pax', 1)
 
-        # Create the booking linked to a user
-        booking = Booking.objects.create(
-            user=User.objects.get(id=selected_user_id) if selected_user_id else None,
-            check_in=check_in,
-            check_out=check_out,
-            pax=pax,
-        )
-
-        # Set ManyToMany relationships
-        booking.activities.set(request.POST.getlist('activities'))
-        booking.packages.set(request.POST.getlist('packages'))
-        booking.rooms.set(request.POST.getlist('rooms'))
-        # booking.food.set(request.POST.getlist('food'))
-        booking.tours.set(request.POST.getlist('tours'))
+        # Create the booking linked to a user, with its ManyToMany selections
+        try:
+            reservations.create_booking(
+                selections={
+                    'activities': request.POST.getlist('activities'),
+                    'packages': request.POST.getlist('packages'),
+                    'rooms': request.POST.getlist('rooms'),
+                    # 'food': request.POST.getlist('food'),
+                    'tours': request.POST.getlist('tours'),
+                },
+                user=User.objects.get(id=selected_user_id) if selected_user_id else None,
+                check_in=check_in,
+                check_out=check_out,
+                pax=pax,
+            )
+        except (reservations.RoomUnavailable, reservations.ReservationBusy) as exc:
+            messages.error(request, str(exc))
+            return redirect('create_user_booking')
 
         messages.success(request, "Booking created successfully on behalf of user.")
         return redirect('booking_list')